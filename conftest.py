@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# puts the repository root on sys.path so the tests import this checkout
@@ -14,7 +14,15 @@ setup(
     download_url='https://github.com/erdc/spt_dataset_manager/archive/0.0.1.tar.gz',
     license='BSD 3-Clause',
     packages=find_packages(),
-    install_requires=['future', 'requests', 'requests_toolbelt', 'tethys_dataset_services'],
+    install_requires=['future', 'requests', 'requests_toolbelt', 'tethys_dataset_services',
+                      'futures; python_version < "3"'],
+    extras_require={'yaml': ['PyYAML'],
+                    's3': ['boto3']},
+    entry_points={
+        'console_scripts': [
+            'spt_dataset_manager=spt_dataset_manager.batch:main',
+        ],
+    },
     classifiers=[
                 'Intended Audience :: Developers',
                 'Intended Audience :: Science/Research',
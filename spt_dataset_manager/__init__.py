@@ -1,6 +1,45 @@
-from .dataset_manager import (CKANDatasetManager, 
-                              ECMWFRAPIDDatasetManager, 
-                              GeoServerDatasetManager, 
-                              RAPIDInputDatasetManager, 
-                              WRFHydroHRRRDatasetManager,
-                              )
\ No newline at end of file
+"""spt_dataset_manager
+
+    The manager classes are loaded on first access so that importing the
+    package does not pull in tethys_dataset_services and its dependencies.
+"""
+from importlib import import_module
+import sys
+
+_LAZY_ATTRIBUTES = {
+    'CKANDatasetManager': '.dataset_manager',
+    'ECMWFRAPIDDatasetManager': '.dataset_manager',
+    'GeoServerDatasetManager': '.dataset_manager',
+    'RAPIDInputDatasetManager': '.dataset_manager',
+    'WRFHydroHRRRDatasetManager': '.dataset_manager',
+}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    """
+    Import the module holding the requested attribute on first access
+    """
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {0!r} has no attribute {1!r}"
+                             .format(__name__, name))
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if sys.version_info < (3, 7):
+    # module level __getattr__ (PEP 562) is not available, load eagerly
+    from .dataset_manager import (CKANDatasetManager,
+                                  ECMWFRAPIDDatasetManager,
+                                  GeoServerDatasetManager,
+                                  RAPIDInputDatasetManager,
+                                  WRFHydroHRRRDatasetManager,
+                                  )
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""batch.py
+    spt_dataset_manager
+
+    Runs a job spec of uploads, downloads, syncs and purges for many
+    watersheds in one process so that imports, engine validation and
+    connections are shared between the jobs.
+
+    License: BSD-3 Clause
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import datetime
+from glob import glob
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from .dataset_manager import (ECMWFRAPIDDatasetManager,
+                              GeoServerDatasetManager,
+                              RAPIDInputDatasetManager,
+                              WRFHydroHRRRDatasetManager)
+from .cache import ArchiveCache
+from .notifications import (CycleListener, FileQueueSink, UnixSocketSink,
+                            WebhookSink)
+from .prefetch import (ECMWF_SCHEDULE, PrefetchScheduler,
+                       WRF_HYDRO_SCHEDULE)
+from .replication import ReplicatedDatasetManager
+from .retention import ForecastRetention
+from .retry_journal import RetryJournal
+from .storage import FileSystemStorage, S3Storage
+from .throttle import AdaptiveConcurrencyLimiter, TokenBucket
+
+
+# -----------------------------------------------------------------------------
+# Job Spec Loading
+# -----------------------------------------------------------------------------
+def load_job_spec(spec_path):
+    """
+    Loads a job spec from a JSON or YAML file
+    """
+    with open(spec_path) as spec_file:
+        if os.path.splitext(spec_path)[1].lower() in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read YAML job "
+                                  "specs. Install it or use JSON instead.")
+            return yaml.safe_load(spec_file)
+        return json.load(spec_file)
+
+
+# -----------------------------------------------------------------------------
+# Manager Creation
+# -----------------------------------------------------------------------------
+def _create_storage(storage_config):
+    """
+    Creates the storage backend from its config
+    ({"type": "filesystem" or "s3", ...constructor arguments})
+    """
+    storage_options = dict(storage_config)
+    storage_type = storage_options.pop('type', 'filesystem')
+    if storage_type == 'filesystem':
+        return FileSystemStorage(**storage_options)
+    if storage_type == 's3':
+        return S3Storage(**storage_options)
+    raise ValueError("Invalid storage type '{0}'. "
+                     "Valid types: filesystem, s3".format(storage_type))
+
+
+# notification sink types and their classes
+NOTIFICATION_SINKS = {
+    'webhook': WebhookSink,
+    'unix_socket': UnixSocketSink,
+    'file_queue': FileQueueSink,
+}
+
+
+def _create_notification_sink(sink_config):
+    """
+    Creates a notification sink from its config
+    ({"type": "webhook", "unix_socket" or "file_queue", ...constructor
+    arguments})
+    """
+    sink_options = dict(sink_config)
+    sink_type = sink_options.pop('type', None)
+    if sink_type not in NOTIFICATION_SINKS:
+        raise ValueError("Invalid notification sink type '{0}'. "
+                         "Valid types: {1}"
+                         .format(sink_type,
+                                 ", ".join(sorted(NOTIFICATION_SINKS))))
+    return NOTIFICATION_SINKS[sink_type](**sink_options)
+
+
+def _get_ckan_options(config):
+    """
+    Returns the optional CKAN manager arguments from the manager config
+    """
+    options = {}
+    if config.get('retry_journal_directory'):
+        options['retry_journal'] = \
+            RetryJournal(config['retry_journal_directory'])
+    if config.get('archive_cache_directory'):
+        options['archive_cache'] = \
+            ArchiveCache(config['archive_cache_directory'],
+                         config.get('archive_cache_max_bytes'))
+    if config.get('extraction_workers'):
+        options['extraction_workers'] = int(config['extraction_workers'])
+    if config.get('pipeline_queue_depth'):
+        options['pipeline_queue_depth'] = int(config['pipeline_queue_depth'])
+    if config.get('download_buffer_size'):
+        options['download_buffer_size'] = int(config['download_buffer_size'])
+    if config.get('storage'):
+        options['storage'] = _create_storage(config['storage'])
+    if config.get('partitioning'):
+        options['partitioning'] = config['partitioning']
+    if config.get('notifications'):
+        options['notification_sinks'] = \
+            [_create_notification_sink(sink_config)
+             for sink_config in config['notifications']]
+    if config.get('retention'):
+        options['retention'] = \
+            ForecastRetention(config['retention'].get('keep_cycles'),
+                              config['retention'].get('max_bytes'))
+    return options
+
+
+def _create_ecmwf_manager(config):
+    return ECMWFRAPIDDatasetManager(config['engine_url'],
+                                    config['api_key'],
+                                    config.get('owner_org', ""),
+                                    **_get_ckan_options(config))
+
+
+def _create_wrf_hydro_manager(config):
+    return WRFHydroHRRRDatasetManager(config['engine_url'],
+                                      config['api_key'],
+                                      config.get('owner_org', ""),
+                                      **_get_ckan_options(config))
+
+
+def _create_rapid_input_manager(config):
+    return RAPIDInputDatasetManager(config['engine_url'],
+                                    config['api_key'],
+                                    config['model_name'],
+                                    config['app_instance_id'],
+                                    config.get('owner_org', ""),
+                                    **_get_ckan_options(config))
+
+
+def _create_geoserver_manager(config):
+    return GeoServerDatasetManager(config['engine_url'],
+                                   config['username'],
+                                   config['password'],
+                                   config['app_instance_id'],
+                                   catalog_ttl=config.get('catalog_ttl'))
+
+
+MANAGER_FACTORIES = {
+    'ecmwf': _create_ecmwf_manager,
+    'wrf_hydro': _create_wrf_hydro_manager,
+    'rapid_input': _create_rapid_input_manager,
+    'geoserver': _create_geoserver_manager,
+}
+
+
+class ManagerPool(object):
+    """
+    Creates (and validates) each configured manager once and hands out
+    a shallow copy per worker thread. The copies share the dataset engine
+    and HTTP session but keep their own watershed/date state.
+
+    transfer_limits may contain 'bytes_per_second' and 'concurrency'
+    (keyword arguments for AdaptiveConcurrencyLimiter) and the resulting
+    limiters are shared by all of the CKAN managers.
+    """
+    def __init__(self, manager_configs, parallelism=1, transfer_limits=None):
+        self.manager_configs = manager_configs
+        self.parallelism = parallelism
+        transfer_limits = transfer_limits or {}
+        self.bandwidth_limiter = None
+        if transfer_limits.get('bytes_per_second'):
+            self.bandwidth_limiter = \
+                TokenBucket(transfer_limits['bytes_per_second'])
+        self.concurrency_limiter = None
+        if transfer_limits.get('concurrency') is not None:
+            self.concurrency_limiter = \
+                AdaptiveConcurrencyLimiter(**transfer_limits['concurrency'])
+        self._prototypes = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._http_session = None
+
+    def get_manager_type(self, manager_name):
+        """
+        Returns the manager type for a configured manager
+        """
+        try:
+            config = self.manager_configs[manager_name]
+        except KeyError:
+            raise KeyError("Manager '{0}' is not configured in the job spec"
+                           .format(manager_name))
+        manager_type = config.get('type', manager_name)
+        if manager_type not in MANAGER_FACTORIES:
+            raise ValueError("Invalid manager type '{0}'. Valid types: {1}"
+                             .format(manager_type,
+                                     ", ".join(sorted(MANAGER_FACTORIES))))
+        return manager_type
+
+    def _get_http_session(self):
+        if self._http_session is None:
+            from requests import Session
+            from requests.adapters import HTTPAdapter
+            self._http_session = Session()
+            adapter = HTTPAdapter(pool_maxsize=max(self.parallelism, 10))
+            self._http_session.mount('http://', adapter)
+            self._http_session.mount('https://', adapter)
+        return self._http_session
+
+    def _get_prototype(self, manager_name):
+        with self._lock:
+            if manager_name not in self._prototypes:
+                manager_type = self.get_manager_type(manager_name)
+                config = self.manager_configs[manager_name]
+                manager = MANAGER_FACTORIES[manager_type](config)
+                if config.get('mirrors'):
+                    # replicate to the mirror CKAN endpoints
+                    manager = ReplicatedDatasetManager(
+                        [manager] +
+                        [MANAGER_FACTORIES[manager_type](dict(config,
+                                                              **mirror))
+                         for mirror in config['mirrors']])
+                if hasattr(manager, 'http_session'):
+                    manager.http_session = self._get_http_session()
+                    manager.bandwidth_limiter = self.bandwidth_limiter
+                    manager.concurrency_limiter = self.concurrency_limiter
+                self._prototypes[manager_name] = manager
+            return self._prototypes[manager_name]
+
+    def get(self, manager_name):
+        """
+        Returns the manager for the current thread
+        """
+        thread_managers = getattr(self._local, 'managers', None)
+        if thread_managers is None:
+            thread_managers = self._local.managers = {}
+        if manager_name not in thread_managers:
+            thread_managers[manager_name] = \
+                copy.copy(self._get_prototype(manager_name))
+        return thread_managers[manager_name]
+
+    def close(self):
+        """
+        Closes the shared HTTP session
+        """
+        if self._http_session is not None:
+            self._http_session.close()
+            self._http_session = None
+
+
+# -----------------------------------------------------------------------------
+# Job Actions
+# -----------------------------------------------------------------------------
+def _set_watershed(manager, watershed, subbasin):
+    manager.watershed = watershed.lower()
+    manager.subbasin = subbasin.lower()
+
+
+def _purge_datasets(manager, watershed=None, subbasin=None,
+                    days_from_now_buffer=180):
+    all_datasets = watershed is None
+    if not all_datasets:
+        _set_watershed(manager, watershed, subbasin)
+    return manager.delete_past_datasets(days_from_now_buffer, all_datasets)
+
+
+def _parse_job_date(date_string):
+    # dates in job specs are YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS
+    if date_string is None:
+        return None
+    for date_format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(date_string, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date '{0}'.".format(date_string))
+
+
+def _upload_ecmwf(manager, source_directory, watersheds=None,
+                  start_date=None, end_date=None, watermark_file=None):
+    return manager.zip_upload_resources(source_directory, watersheds,
+                                        _parse_job_date(start_date),
+                                        _parse_job_date(end_date),
+                                        watermark_file)
+
+
+def _upload_rapid_input(manager, source_directory=None, upload_file=None,
+                        watershed=None, subbasin=None, incremental=False):
+    if upload_file:
+        return manager.upload_model_resource(upload_file, watershed, subbasin)
+    return manager.zip_upload_resource(source_directory, incremental)
+
+
+def _prefetch(schedule):
+    # polls the due cycles once (run the job from cron for prefetching);
+    # the cycles downloaded by earlier runs are found on the disk
+    def prefetch(manager, watersheds, main_extract_directory):
+        return PrefetchScheduler(manager, watersheds, main_extract_directory,
+                                 schedule).run_pending()
+    return prefetch
+
+
+def _process_notifications(manager, queue_directory, main_extract_directory,
+                           watersheds=None):
+    # downloads the cycles announced in a file queue (run from cron)
+    listener = CycleListener(manager, main_extract_directory, watersheds)
+    try:
+        return [dict(event, downloaded=num_downloaded)
+                for event, num_downloaded
+                in listener.process_file_queue(queue_directory)]
+    finally:
+        listener.stop()
+
+
+def _upload_shapefile(manager, resource_name, file_list, rename=True,
+                      overwrite=True):
+    shapefile_list = []
+    for file_pattern in file_list:
+        shapefile_list += glob(file_pattern)
+    return manager.upload_shapefile(resource_name, shapefile_list,
+                                    rename, overwrite)
+
+
+def _purge_geoserver(manager, layer_group_id=None, layer_id=None):
+    if layer_group_id:
+        return manager.purge_remove_geoserver_layer_group(layer_group_id)
+    return manager.purge_remove_geoserver_layer(layer_id)
+
+
+# actions are either the name of the manager method called with the job
+# arguments or a function called with the manager and the job arguments
+JOB_ACTIONS = {
+    'ecmwf': {
+        'upload': _upload_ecmwf,
+        'download': 'download_recent_resource',
+        'download_all': 'download_recent_resources',
+        'download_warning_points': 'download_recent_warning_points',
+        'warning_points_summary': 'get_warning_points_summary',
+        'prefetch': _prefetch(ECMWF_SCHEDULE),
+        'process_notifications': _process_notifications,
+        'purge': _purge_datasets,
+        'retry': 'retry_pending',
+    },
+    'wrf_hydro': {
+        'upload': 'zip_upload_resource',
+        'download': 'download_recent_resource',
+        'prefetch': _prefetch(WRF_HYDRO_SCHEDULE),
+        'process_notifications': _process_notifications,
+        'purge': _purge_datasets,
+        'retry': 'retry_pending',
+    },
+    'rapid_input': {
+        'upload': _upload_rapid_input,
+        'sync': 'sync_dataset',
+        'retry': 'retry_pending',
+    },
+    'geoserver': {
+        'upload': _upload_shapefile,
+        'purge': _purge_geoserver,
+    },
+}
+
+
+# -----------------------------------------------------------------------------
+# Job Runner
+# -----------------------------------------------------------------------------
+def _run_job(manager_pool, job_index, job):
+    """
+    Runs a single job and returns its summary
+    """
+    job_args = dict(job)
+    manager_name = job_args.pop('manager', None)
+    action = job_args.pop('action', None)
+    job_name = job_args.pop('name', None)
+    summary = {
+        'index': job_index,
+        'name': job_name,
+        'manager': manager_name,
+        'action': action,
+    }
+    start_time = time.time()
+    try:
+        manager_type = manager_pool.get_manager_type(manager_name)
+        try:
+            job_action = JOB_ACTIONS[manager_type][action]
+        except KeyError:
+            raise ValueError("Invalid action '{0}' for '{1}'. "
+                             "Valid actions: {2}"
+                             .format(action, manager_type,
+                                     ", ".join(
+                                         sorted(JOB_ACTIONS[manager_type]))))
+        manager = manager_pool.get(manager_name)
+        if callable(job_action):
+            result = job_action(manager, **job_args)
+        else:
+            result = getattr(manager, job_action)(**job_args)
+        summary['status'] = 'success'
+        summary['result'] = result
+    except Exception as ex:
+        traceback.print_exc()
+        summary['status'] = 'error'
+        summary['error'] = "{0}: {1}".format(type(ex).__name__, ex)
+    summary['elapsed_seconds'] = round(time.time() - start_time, 3)
+    return summary
+
+
+def run_job_spec(job_spec, parallelism=None):
+    """
+    Runs all of the jobs in a job spec and returns a summary dictionary
+    """
+    if parallelism is None:
+        parallelism = int(job_spec.get('parallelism', 1))
+    parallelism = max(1, parallelism)
+    jobs = job_spec.get('jobs', [])
+    manager_pool = ManagerPool(job_spec.get('managers', {}), parallelism,
+                               job_spec.get('transfer_limits'))
+
+    start_time = time.time()
+    started = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            job_summaries = list(executor.map(
+                lambda indexed_job: _run_job(manager_pool, *indexed_job),
+                enumerate(jobs)))
+    finally:
+        manager_pool.close()
+
+    num_failed = len([job for job in job_summaries
+                      if job['status'] != 'success'])
+    return {
+        'started': started,
+        'elapsed_seconds': round(time.time() - start_time, 3),
+        'parallelism': parallelism,
+        'total': len(job_summaries),
+        'succeeded': len(job_summaries) - num_failed,
+        'failed': num_failed,
+        'jobs': job_summaries,
+    }
+
+
+def main(argv=None):
+    """
+    Console entry point for the batch job runner
+    """
+    parser = argparse.ArgumentParser(
+        description="Run a JSON/YAML job spec of SPT dataset manager "
+                    "uploads, downloads, syncs and purges in one process.")
+    parser.add_argument('job_spec', help="Path to the JSON or YAML job spec.")
+    parser.add_argument('-p', '--parallelism', type=int, default=None,
+                        help="Number of jobs to run at once "
+                             "(overrides 'parallelism' in the job spec).")
+    parser.add_argument('-s', '--summary-file', '--summary', dest='summary',
+                        default=None,
+                        help="Write the JSON summary to this file "
+                             "instead of stdout.")
+    args = parser.parse_args(argv)
+
+    # the progress output of the managers goes to stderr so stdout only
+    # has the summary
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        summary = run_job_spec(load_job_spec(args.job_spec),
+                               args.parallelism)
+    finally:
+        sys.stdout = stdout
+    summary_json = json.dumps(summary, indent=2, default=str)
+    if args.summary:
+        with open(args.summary, 'w') as summary_file:
+            summary_file.write(summary_json)
+    else:
+        print(summary_json)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""cache.py
+    spt_dataset_manager
+
+    Content-addressed cache of downloaded resource archives that can be
+    shared by several processes on one host.
+
+    License: BSD-3 Clause
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from .locking import FileLock
+
+
+class ArchiveCache(object):
+    """
+    Stores downloaded archives in cache_directory by SHA-256 of their
+    content, with an index from the resource (id or url, plus its created
+    time, last modified time and size) to the content hash. Identical
+    archives are stored once.
+
+    When max_bytes is set the least recently used archives are removed
+    once the cache is over that many bytes, down to EVICTION_TARGET of
+    it. The total size is kept in a file so only evictions list the
+    archives. A lock file coordinates the processes sharing the
+    directory.
+    """
+    # fraction of max_bytes left after an eviction
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, cache_directory, max_bytes=None):
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        self.objects_directory = os.path.join(cache_directory, 'objects')
+        self.index_directory = os.path.join(cache_directory, 'index')
+        for directory in (self.objects_directory, self.index_directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        self._lock_path = os.path.join(cache_directory, '.lock')
+        self._size_path = os.path.join(cache_directory, 'size.json')
+
+    @staticmethod
+    def get_resource_key(resource_info):
+        """
+        Returns the cache key and revision for a resource. The revision
+        changes when a resource is overwritten, even at the same URL.
+        """
+        resource_key = resource_info.get('id') or resource_info['url']
+        revision = "{0}|{1}|{2}|{3}".format(
+            resource_info['url'],
+            resource_info.get('created') or "",
+            resource_info.get('last_modified') or "",
+            resource_info.get('size') or "")
+        return resource_key, revision
+
+    def _get_index_path(self, resource_key):
+        return os.path.join(self.index_directory, "%s.json" %
+                            hashlib.sha1(resource_key.encode("utf-8"))
+                                   .hexdigest())
+
+    def _get_object_path(self, content_hash):
+        return os.path.join(self.objects_directory, content_hash[:2],
+                            content_hash)
+
+    @staticmethod
+    def hash_file(file_path, block_size=1048576):
+        """
+        Returns the SHA-256 hex digest of a file
+        """
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as hash_file:
+            for block in iter(lambda: hash_file.read(block_size), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def get(self, resource_info):
+        """
+        Returns the path to the cached archive for a resource or None.
+        Another process may evict it at any time; use checkout to keep
+        a copy.
+        """
+        resource_key, revision = self.get_resource_key(resource_info)
+        try:
+            with open(self._get_index_path(resource_key)) as index_file:
+                index_entry = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if index_entry.get('revision') != revision:
+            return None
+        object_path = self._get_object_path(index_entry['sha256'])
+        try:
+            # mark as recently used for LRU eviction
+            os.utime(object_path, None)
+        except OSError:
+            return None
+        return object_path
+
+    def checkout(self, resource_info, file_path):
+        """
+        Hard links the cached archive for a resource to file_path (copies
+        it on another file system) so it survives eviction while it is
+        extracted. Returns False if the resource is not cached.
+        """
+        with FileLock(self._lock_path, shared=True):
+            object_path = self.get(resource_info)
+            if object_path is None:
+                return False
+            try:
+                os.link(object_path, file_path)
+            except OSError:
+                shutil.copyfile(object_path, file_path)
+        return True
+
+    def put(self, resource_info, file_path):
+        """
+        Moves a downloaded archive into the cache and returns its new path
+        """
+        resource_key, revision = self.get_resource_key(resource_info)
+        content_hash = self.hash_file(file_path)
+        object_path = self._get_object_path(content_hash)
+        with FileLock(self._lock_path):
+            total_bytes = self._read_total_bytes()
+            if os.path.exists(object_path):
+                # same content is already cached
+                os.remove(file_path)
+                os.utime(object_path, None)
+            else:
+                try:
+                    os.makedirs(os.path.dirname(object_path))
+                except OSError:
+                    pass
+                shutil.move(file_path, object_path)
+                self._write_total_bytes(total_bytes +
+                                        os.path.getsize(object_path))
+            index_path = self._get_index_path(resource_key)
+            with open("%s.tmp" % index_path, 'w') as index_file:
+                json.dump({'key': resource_key,
+                           'revision': revision,
+                           'sha256': content_hash,
+                           'size': os.path.getsize(object_path)},
+                          index_file)
+            os.rename("%s.tmp" % index_path, index_path)
+            self._evict(keep_path=object_path)
+        return object_path
+
+    def _list_objects(self):
+        """
+        Returns the (last used time, size, path) of the cached archives
+        """
+        cached_objects = []
+        for root, _, file_names in os.walk(self.objects_directory):
+            for file_name in file_names:
+                object_path = os.path.join(root, file_name)
+                try:
+                    object_stat = os.stat(object_path)
+                except OSError:
+                    continue
+                cached_objects.append((object_stat.st_mtime,
+                                       object_stat.st_size,
+                                       object_path))
+        return cached_objects
+
+    def _read_total_bytes(self):
+        """
+        Returns the size of the cached archives. Must be called with the
+        cache lock held.
+        """
+        try:
+            with open(self._size_path) as size_file:
+                return json.load(size_file)['total_bytes']
+        except (IOError, OSError, ValueError, KeyError):
+            # new cache or older version without the size file
+            return sum(object_size for _, object_size, _
+                       in self._list_objects())
+
+    def _write_total_bytes(self, total_bytes):
+        with open("%s.tmp" % self._size_path, 'w') as size_file:
+            json.dump({'total_bytes': total_bytes}, size_file)
+        os.rename("%s.tmp" % self._size_path, self._size_path)
+
+    def _evict(self, keep_path=None):
+        """
+        Removes the least recently used archives when the cache is over
+        the byte budget. Must be called with the cache lock held.
+        """
+        if self.max_bytes is None or \
+                self._read_total_bytes() <= self.max_bytes:
+            return
+        cached_objects = self._list_objects()
+        total_bytes = sum(object_size for _, object_size, _
+                          in cached_objects)
+        target_bytes = self.max_bytes * self.EVICTION_TARGET
+        for _, object_size, object_path in sorted(cached_objects):
+            if total_bytes <= target_bytes:
+                break
+            if object_path == keep_path:
+                continue
+            try:
+                # open handles in other processes keep working on POSIX
+                os.remove(object_path)
+                total_bytes -= object_size
+            except OSError:
+                pass
+        self._write_total_bytes(total_bytes)
+
+    def evict(self):
+        """
+        Removes the least recently used archives if the cache is over
+        the byte budget
+        """
+        with FileLock(self._lock_path):
+            self._evict()
@@ -5,19 +5,52 @@
     Created by Alan D. Snow, 2015-2017.
     License: BSD-3 Clause
 """
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import datetime
+from fnmatch import fnmatch
 from glob import glob
+import io
+import json
 import os
 from past.builtins import basestring
 import re
-from requests import get
 from shutil import rmtree
 import tarfile
+import tempfile
+import threading
 import zipfile
 
-# tethys imports
-from tethys_dataset_services.engines import (GeoServerSpatialDatasetEngine, 
-                                             CkanDatasetEngine)
+from .discovery import UploadWatermark, discover_upload_work
+from .delta import (LOCAL_MANIFEST_FILE, apply_delta_archive,
+                    build_manifest, diff_manifests, read_local_manifest,
+                    write_delta_archive, write_local_manifest)
+from .geoserver_catalog import CATALOG_KINDS, GeoServerCatalogSnapshot
+from .locking import get_lock_path
+from .notifications import create_cycle_complete_event
+from .partitioning import get_partitioning
+from .pipeline import run_pipeline
+from .profiling import get_profiler, profiled
+from .singleflight import SingleFlight
+from .throttle import TransferRequest
+from .transfer import (DEFAULT_DOWNLOAD_BUFFER_SIZE, TransferProgress,
+                       download_to_file, route_engine_requests,
+                       stream_upload, stream_upload_files)
+from .warning_points import SUMMARY_EXTRA, summarize_warning_points_data
+
+# NOTE: requests and the tethys engines are imported where they are used
+# so that importing this module stays cheap
+
+
+# downloads to the same location by any manager in this process
+# are done once
+_download_flights = SingleFlight()
+
+# extraction process pools shared by the managers in this process
+# (by number of workers)
+_extraction_pools = {}
+_extraction_pools_lock = threading.Lock()
 
 
 # -----------------------------------------------------------------------------
@@ -33,25 +66,205 @@ def get_watershed_subbasin_from_folder(folder_name):
     return watershed, subbasin
 
 
+def write_tarfile(output_tar_file, file_paths, on_file=None):
+    """
+    Packages the files into a tar.gz file if it does not exist and
+    returns the path. on_file is called with the path and the contents of
+    each file as it is added (or read if the archive exists), so the
+    files are not read again to inspect them.
+    """
+    if not os.path.exists(output_tar_file):
+        # write to a temporary file so an interrupted run does not
+        # leave a partial archive behind to be uploaded later
+        partial_tar_file = "%s.part" % output_tar_file
+        with tarfile.open(partial_tar_file, "w:gz") as tar:
+            for file_path in file_paths:
+                if on_file is None:
+                    tar.add(file_path, arcname=os.path.basename(file_path))
+                    continue
+                with open(file_path, 'rb') as input_file:
+                    file_data = input_file.read()
+                tar.addfile(tar.gettarinfo(
+                    file_path, arcname=os.path.basename(file_path)),
+                    io.BytesIO(file_data))
+                on_file(file_path, file_data)
+        os.rename(partial_tar_file, output_tar_file)
+    elif on_file is not None:
+        for file_path in file_paths:
+            with open(file_path, 'rb') as input_file:
+                on_file(file_path, input_file.read())
+    return output_tar_file
+
+
+def extract_archive(archive_path, extract_directory, file_format):
+    """
+    Extracts a tar.gz or zip archive into the extract directory
+    """
+    if file_format.lower() == "tar.gz":
+        with tarfile.open(archive_path) as tar:
+            tar.extractall(extract_directory)
+    elif file_format.lower() == "zip":
+        with zipfile.ZipFile(archive_path) as zip_file:
+            zip_file.extractall(extract_directory)
+    else:
+        print("Unsupported file format. Skipping ...")
+
+
+def get_extraction_pool(max_workers):
+    """
+    Returns the process pool with max_workers processes shared by the
+    managers in this process for extracting archives. The processes are
+    started with forkserver (spawn where it is not available) as forking
+    the threaded managers can copy locks held by other threads.
+    """
+    with _extraction_pools_lock:
+        extraction_pool = _extraction_pools.get(max_workers)
+        if extraction_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+            try:
+                start_method = 'forkserver' if 'forkserver' in \
+                    multiprocessing.get_all_start_methods() else 'spawn'
+                extraction_pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context(start_method))
+            except (AttributeError, TypeError):  # Python < 3.7
+                extraction_pool = \
+                    ProcessPoolExecutor(max_workers=max_workers)
+            _extraction_pools[max_workers] = extraction_pool
+        return extraction_pool
+
+
+class ResourceSummary(namedtuple('ResourceSummary',
+                                 ['name', 'url', 'format', 'created',
+                                  'last_modified', 'size'])):
+    """
+    Compact resource information that also supports the dictionary style
+    access used for full CKAN resource dictionaries. Summaries from the
+    search index have the last modified time of their dataset.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return super(ResourceSummary, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @classmethod
+    def from_resource(cls, resource):
+        """
+        Creates the summary from a CKAN resource dictionary
+        """
+        return cls(resource.get('name'), resource.get('url'),
+                   resource.get('format'), resource.get('created'),
+                   resource.get('last_modified'), resource.get('size'))
+
+
 # -----------------------------------------------------------------------------
 # Main CKAN Dataset Manager Class
 # -----------------------------------------------------------------------------
+@profiled
 class CKANDatasetManager(object):
     """
     This class is used to find, zip and upload files to a CKAN data server
     #note: this does not delete the original files
     """
+    # last part of the dataset names with one dataset per cycle
+    CYCLE_DATASET_DATE_FORMAT = "%Y%m%d"
+    # archives up to this size are sent to CKAN together in multipart
+    # package_revise calls (CKAN 2.9+), larger ones are streamed with a
+    # resource_create call each
+    UPLOAD_BATCH_MAX_FILE_BYTES = 1048576
+    # archives sent to CKAN in one multipart package_revise call
+    UPLOAD_BATCH_MAX_BYTES = 16777216
+
     def __init__(self, engine_url, api_key, model_name, 
                  dataset_notes="CKAN Dataset", 
                  resource_description="CKAN Resource",
                  date_format_string="%Y%m%d",
-                 owner_org=""):
+                 owner_org="",
+                 bandwidth_limiter=None,
+                 concurrency_limiter=None,
+                 retry_journal=None,
+                 upload_progress_callback=None,
+                 archive_cache=None,
+                 extraction_workers=1,
+                 pipeline_queue_depth=2,
+                 retention=None,
+                 profiler=None,
+                 download_buffer_size=DEFAULT_DOWNLOAD_BUFFER_SIZE,
+                 storage=None,
+                 partitioning=None,
+                 notification_sinks=None):
+        """
+        bandwidth_limiter (throttle.TokenBucket) caps the bytes per second
+        and concurrency_limiter (throttle.AdaptiveConcurrencyLimiter) caps
+        the number of simultaneous transfers. Share the same instances
+        between managers for a global limit.
+
+        retry_journal (retry_journal.RetryJournal) keeps failed uploads so
+        that they can be replayed with retry_pending.
+
+        upload_progress_callback is called with (upload_file_name,
+        bytes_sent, total_bytes, bytes_per_second) during uploads
+        (see transfer.TransferProgress).
+
+        archive_cache (cache.ArchiveCache) keeps downloaded archives so
+        repeat extractions do not download them again.
+
+        extraction_workers is the number of processes used to extract
+        archives while others are still downloading (1 extracts in the
+        calling thread). The process pool is shared by the managers of
+        the process (see get_extraction_pool), so scripts using it need
+        an if __name__ == "__main__" guard.
+
+        pipeline_queue_depth is the number of compressed archives that can
+        wait for upload in the zip_upload methods.
+
+        retention (retention.ForecastRetention) removes old forecast cycles
+        from the extract directories after each download.
+
+        profiler (profiling.OperationProfiler or True) writes a profile of
+        each public operation. It is also enabled for all managers with
+        the SPT_DATASET_MANAGER_PROFILE environment variable.
+
+        download_buffer_size is the number of bytes read and written at a
+        time by downloads.
+
+        storage (storage.FileSystemStorage or storage.S3Storage) stores
+        the uploaded files instead of the CKAN FileStore. Only their URL
+        is registered with CKAN and downloads read them from the store.
+
+        partitioning ("cycle" (default), "day", "month" or a
+        partitioning.DatasetPartitioning) groups the forecast cycles of a
+        watershed into datasets. The resources are named after their
+        cycle, so lookups and downloads find the cycles in the datasets
+        of the manager's partitioning. Only delete_past_datasets also
+        understands the datasets created with another partitioning (see
+        partitioning.parse_partition_key).
+
+        notification_sinks (a list of notifications.WebhookSink,
+        UnixSocketSink or FileQueueSink) receive a cycle complete event
+        when an upload completes a forecast cycle.
+        """
         if engine_url.endswith('/'):
             engine_url = engine_url[:-1]
         if not engine_url.endswith('api/action') \
                 and not engine_url.endswith('api/3/action'):
             engine_url += '/api/3/action'
-        
+
+        self.engine_url = engine_url
+        self.api_key = api_key
+        from tethys_dataset_services.engines import CkanDatasetEngine
         self.dataset_engine = \
             CkanDatasetEngine(endpoint=engine_url, apikey=api_key)
         self.dataset_engine.validate()
@@ -60,7 +273,43 @@ class CKANDatasetManager(object):
         self.resource_description = resource_description
         self.date_format_string = date_format_string
         self.owner_org = owner_org
-        
+        self._http_session = None
+        # CKAN features found on first use ({'package_revise': bool}),
+        # shared with the copies of this manager
+        self._capabilities = {}
+        # uploads that failed (see _record_failed_upload)
+        self.num_failed_uploads = 0
+        # replication.ReplicatedDatasetManager sending the uploads of
+        # this manager to all of its endpoints
+        self.replicator = None
+        self.bandwidth_limiter = bandwidth_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.retry_journal = retry_journal
+        self.upload_progress_callback = upload_progress_callback
+        self.archive_cache = archive_cache
+        self.extraction_workers = extraction_workers
+        self.pipeline_queue_depth = pipeline_queue_depth
+        self.retention = retention
+        self.profiler = get_profiler(profiler)
+        self.download_buffer_size = download_buffer_size
+        self.storage = storage
+        self.partitioning = get_partitioning(partitioning,
+                                             self.CYCLE_DATASET_DATE_FORMAT)
+        self.notification_sinks = notification_sinks or []
+
+    @property
+    def http_session(self):
+        """
+        Optional requests.Session shared between managers to reuse
+        connections for transfers and the CKAN API calls
+        """
+        return self._http_session
+
+    @http_session.setter
+    def http_session(self, http_session):
+        self._http_session = http_session
+        route_engine_requests(self.dataset_engine, http_session)
+
     def update_date(self, date_string):
         """
         Update date information
@@ -68,15 +317,45 @@ class CKANDatasetManager(object):
         self.date_string = date_string
         self.date = datetime.datetime.strptime(self.date_string,
                                                self.date_format_string)
-        self.dataset_name = '%s-%s-%s-%s' % (self.model_name,
-                                             self.watershed,
-                                             self.subbasin,
-                                             self.date.strftime("%Y%m%d"))
+        self.dataset_name = self.get_partition_dataset_name()
         self.resource_name = '%s-%s-%s-%s' % (self.model_name,
                                               self.watershed,
                                               self.subbasin,
                                               self.date_string)
 
+    def get_partition_dataset_name(self):
+        """
+        This function returns the name of the dataset holding the current
+        forecast date with the partitioning
+        """
+        return '%s-%s-%s-%s' % (self.model_name,
+                                self.watershed,
+                                self.subbasin,
+                                self.partitioning.get_partition_key(self.date))
+
+    def get_cycle_resource_prefix(self):
+        """
+        This function returns the name prefix of the resources of the
+        current cycle or None if the dataset holds only the current cycle
+        """
+        return None
+
+    def filter_cycle_resources(self, dataset_summary, resource_prefix=None):
+        """
+        This function keeps only the resources of the current cycle
+        (or starting with resource_prefix) in a dataset summary, as a
+        dataset may hold several cycles
+        """
+        if resource_prefix is None:
+            resource_prefix = self.get_cycle_resource_prefix()
+        if resource_prefix is None or dataset_summary is None:
+            return dataset_summary
+        resources = [resource for resource in dataset_summary['resources']
+                     if (resource['name'] or '').startswith(resource_prefix)]
+        return dict(dataset_summary,
+                    num_resources=len(resources),
+                    resources=resources)
+
     def initialize_run(self, watershed, subbasin, date_string):
         """
         Initialize run for watershed upload/download
@@ -93,12 +372,7 @@ class CKANDatasetManager(object):
         base_path = os.path.dirname(file_path)
         output_tar_file = \
             os.path.join(base_path, "%s.tar.gz" % self.resource_name)
-
-        if not os.path.exists(output_tar_file):
-            with tarfile.open(output_tar_file, "w:gz") as tar:
-                    tar.add(file_path, arcname=os.path.basename(file_path))
-
-        return output_tar_file
+        return write_tarfile(output_tar_file, [file_path])
 
     def make_directory_tarfile(self, directory_path, search_string="*"):
         """
@@ -108,23 +382,19 @@ class CKANDatasetManager(object):
         base_path = os.path.dirname(directory_path)
         output_tar_file = \
             os.path.join(base_path, "%s.tar.gz" % self.resource_name)
-
-        if not os.path.exists(output_tar_file):
-            directory_files = glob(os.path.join(directory_path, search_string))
-            with tarfile.open(output_tar_file, "w:gz") as tar:
-                    for directory_file in directory_files:
-                        tar.add(directory_file,
-                                arcname=os.path.basename(directory_file))
-
-        return output_tar_file
+        return write_tarfile(output_tar_file,
+                             glob(os.path.join(directory_path, search_string)))
     
     def get_dataset_id(self):
         """
-        This function gets the id of a dataset
+        This function gets the id of a dataset. Returns None if the
+        dataset does not exist or the search failed.
         """
         # Use the json module to load CKAN's response into a dictionary.
         response_dict = \
-            self.dataset_engine.search_datasets({'name': self.dataset_name})
+            self.dataset_engine.search_datasets({'name': self.dataset_name},
+                                                fl="id",
+                                                rows=1)
         if response_dict['success']:
             if int(response_dict['result']['count']) > 0:
                 return response_dict['result']['results'][0]['id']
@@ -169,82 +439,620 @@ class CKANDatasetManager(object):
 
         return dataset_id
        
-    def upload_resource(self, file_path, overwrite=False,
-                        file_format='tar.gz'):
+    def _upload_resource(self, file_path, overwrite=False,
+                         file_format='tar.gz', resource_name=None,
+                         extras=None):
         """
         This function uploads a resource to a dataset if it does not exist
+        and raises an exception if the upload fails.
+        Returns None if the resource already exists.
         """
+        if resource_name is None:
+            resource_name = self.resource_name
         # create dataset for each watershed-subbasin combo if needed
         dataset_id = self.create_dataset()
-        if dataset_id:
-            # check if dataset already exists
-            resource_results = \
-                self.dataset_engine.search_resources(
-                    {'name': self.resource_name},
-                    datset_id=dataset_id)
+        if not dataset_id:
+            raise IOError("Failed to find/create dataset")
+
+        # check if dataset already exists
+        resource_results = \
+            self.dataset_engine.search_resources(
+                {'name': resource_name},
+                datset_id=dataset_id)
+        # determine if results are exact or similar
+        same_ckan_resource_id = ""
+        if resource_results['result']['count'] > 0:
+            for resource in resource_results['result']['results']:
+                if resource['name'] == resource_name:
+                    same_ckan_resource_id = resource['id']
+                    break
+
+        if overwrite and same_ckan_resource_id:
+            # delete resource
+            """
+            CKAN API CURRENTLY DOES NOT WORK FOR UPDATE 
+            -> bug = needs file or url, 
+            but requres both and to have only one ...
+
+            #update existing resource
+            print(resource_results['result']['results'][0])
+            update_results = 
+                self.dataset_engine.update_resource(
+                    resource_results['result']['results'][0]['id'], 
+                    file=file_to_upload,
+                    url="",
+                    date_uploaded=datetime.datetime.utcnow()
+                                          .strftime("%Y%m%d%H%M"))
+            """
+            self.dataset_engine.delete_resource(same_ckan_resource_id)
+
+        if same_ckan_resource_id and not overwrite:
+            print("Resource {0} exists. Skipping ..."
+                  .format(resource_name))
+            return None
+
+        # upload resources to the dataset (streamed from disk)
+        resource_fields = self._get_resource_fields(dataset_id, resource_name,
+                                                    file_format, extras)
+        if self.storage is not None:
+            # payload to the object store, only the URL to CKAN
+            resource_fields['url'] = self._put_in_storage(
+                file_path, self._get_storage_key(resource_name, file_format))
+            result = self.dataset_engine.execute_api_method(
+                'resource_create', **resource_fields)
+            if not result['success']:
+                print("Registration of {0} failed: {1}"
+                      .format(resource_name, result.get('error')))
+            return result
+
+        with TransferRequest(self.concurrency_limiter,
+                             os.path.getsize(file_path)) as transfer:
+            status_code, result = stream_upload(
+                '%s/resource_create' % self.engine_url,
+                resource_fields,
+                file_path,
+                "%s.%s" % (resource_name, file_format),
+                headers={'Authorization': str(self.api_key),
+                         'X-CKAN-API-Key': str(self.api_key)},
+                progress_callback=self.upload_progress_callback,
+                bandwidth_limiter=self.bandwidth_limiter,
+                session=self.http_session)
+            transfer.set_status_code(status_code)
+            if result is None:
+                # the response was not JSON (server error)
+                transfer.set_failed(overloaded=True)
+                raise IOError("Invalid response from CKAN uploading {0}"
+                              .format(resource_name))
+            elif not result['success']:
+                transfer.set_failed()
+        return result
+
+    def _get_resource_fields(self, dataset_id, resource_name, file_format,
+                             extras=None):
+        """
+        Returns the CKAN fields of a resource of the current cycle
+        """
+        resource_fields = dict(extras or {})
+        resource_fields.update({
+            'package_id': dataset_id,
+            'name': resource_name,
+            'format': file_format,
+            'tethys_app': "streamflow_prediciton_tool",
+            'watershed': self.watershed,
+            'subbasin': self.subbasin,
+            'forecast_date': self.date_string,
+            'description': self.resource_description,
+            'url': "",
+        })
+        return resource_fields
+
+    def _get_storage_key(self, resource_name, file_format):
+        """
+        Returns the storage key of a resource payload
+        """
+        return "%s/%s.%s" % (self.dataset_name, resource_name, file_format)
+
+    def _get_dataset_resources(self):
+        """
+        Returns the resources of the current dataset (None if the dataset
+        is not found)
+        """
+        response_dict = self.dataset_engine.execute_api_method(
+            'package_show', id=self.dataset_name)
+        if not response_dict or not response_dict['success']:
+            return None
+        return response_dict['result'].get('resources', [])
+
+    def _supports_package_revise(self):
+        """
+        True if CKAN has package_revise (2.9+). The version is read once
+        with status_show and shared with the copies of this manager.
+        """
+        supported = self._capabilities.get('package_revise')
+        if supported is not None:
+            return supported
+        try:
+            response_dict = \
+                self.dataset_engine.execute_api_method('status_show')
+        except Exception as ex:
+            print("CKAN version check failed: {0}".format(ex))
+            return False
+        if not response_dict or not response_dict['success']:
+            return False
+        version_numbers = tuple(
+            int(number) for number in
+            re.findall(r'\d+', response_dict['result'].get('ckan_version') or
+                       '')[:2])
+        supported = version_numbers >= (2, 9)
+        self._capabilities['package_revise'] = supported
+        return supported
+
+    @staticmethod
+    def _is_unknown_action(response_dict):
+        """
+        True if CKAN does not have the action of the response
+        (e.g. package_revise before CKAN 2.9)
+        """
+        if not response_dict or response_dict.get('success'):
+            return False
+        error = response_dict.get('error') or {}
+        return 'Action name not known' in str(error.get('message', error))
+
+    def register_resources(self, resources, overwrite=False,
+                           file_paths=None):
+        """
+        This function adds resources with known URLs (dictionaries of
+        resource fields) to the current dataset with a single
+        package_revise call (package_show and package_patch before
+        CKAN 2.9) instead of a resource_create call per resource.
+        Resources that exist are replaced if overwrite is True, otherwise
+        skipped. Returns the CKAN response or None if there was nothing
+        to register.
+
+        With file_paths (the archive of each resource) the archives are
+        uploaded with the resources in the package_revise call. Before
+        CKAN 2.9 they are uploaded with a resource_create call each.
+        """
+        if self.replicator is not None:
+            return self.replicator.register_resources_on_all(
+                resources, overwrite, file_paths)
+        return self._register_resources(resources, overwrite, file_paths)
+
+    def _register_resources(self, resources, overwrite=False,
+                            file_paths=None):
+        """
+        Registers the resources on this manager's endpoint
+        (see register_resources)
+        """
+        dataset_id = self.create_dataset()
+        if not dataset_id:
+            raise IOError("Failed to find/create dataset")
+        dataset_resources = self._get_dataset_resources() or []
+        existing_resources = dict((resource['name'], resource)
+                                  for resource in dataset_resources)
+        new_resources = []
+        replaced_resources = {}
+        upload_files = {}
+        resource_uploads = []
+        for resource_index, resource in enumerate(resources):
+            resource = dict((key, value) for key, value in resource.items()
+                            if key != 'package_id')
+            existing_resource = existing_resources.get(resource['name'])
+            if existing_resource is None:
+                new_resources.append(resource)
+                upload_key = len(new_resources)
+            elif overwrite:
+                replaced_resources[existing_resource['id']] = resource
+                upload_key = existing_resource['id']
+            else:
+                print("Resource {0} exists. Skipping ..."
+                      .format(resource['name']))
+                continue
+            if file_paths is not None:
+                upload_files[upload_key] = file_paths[resource_index]
+                resource_uploads.append((resource,
+                                         file_paths[resource_index]))
+        if not new_resources and not replaced_resources:
+            return None
+
+        if self._supports_package_revise():
+            revise_fields = {'match': {'id': dataset_id}}
+            if new_resources:
+                revise_fields['update__resources__extend'] = new_resources
+            for resource_id, resource in replaced_resources.items():
+                revise_fields['update__resources__%s' % resource_id] = \
+                    resource
+            if file_paths is not None:
+                response_dict = self._revise_with_uploads(
+                    revise_fields, upload_files, len(new_resources))
+            else:
+                response_dict = self.dataset_engine.execute_api_method(
+                    'package_revise', **revise_fields)
+            if not self._is_unknown_action(response_dict):
+                return response_dict
+            self._capabilities['package_revise'] = False
+
+        if file_paths is not None:
+            return self._upload_each_resource(resource_uploads, overwrite)
+        # one package_patch with the complete list of resources
+        patch_resources = []
+        for resource in dataset_resources:
+            if resource['id'] in replaced_resources:
+                resource = dict(resource, **replaced_resources[resource['id']])
+            patch_resources.append(resource)
+        return self.dataset_engine.execute_api_method(
+            'package_patch', id=dataset_id,
+            resources=patch_resources + new_resources)
+
+    def _upload_each_resource(self, resource_uploads, overwrite=False):
+        """
+        Uploads the (resource fields, file_path) items with a
+        resource_create call each and stops at the first failure.
+        Returns the last CKAN response.
+        """
+        response_dict = None
+        for resource, file_path in resource_uploads:
+            response_dict = self._upload_resource(file_path, overwrite,
+                                                  resource['format'],
+                                                  resource['name'], resource)
+            if response_dict is not None and not response_dict['success']:
+                break
+        return response_dict
+
+    def _revise_with_uploads(self, revise_fields, upload_files,
+                             num_new_resources):
+        """
+        Sends package_revise as a multipart form with the files
+        ({new resource number or replaced resource id: file_path}).
+        The JSON fields are sent as strings, which CKAN parses.
+        """
+        form_fields = dict((key, json.dumps(value))
+                           for key, value in revise_fields.items())
+        form_files = {}
+        for upload_key, file_path in upload_files.items():
+            if isinstance(upload_key, int):
+                # new resources are at the end of the list
+                upload_key = upload_key - num_new_resources - 1
+            form_files['update__resources__%s__upload' % upload_key] = \
+                (os.path.basename(file_path), file_path)
+        with TransferRequest(self.concurrency_limiter,
+                             sum(os.path.getsize(file_path) for file_path
+                                 in upload_files.values())) as transfer:
+            status_code, response_dict = stream_upload_files(
+                '%s/package_revise' % self.engine_url,
+                form_fields,
+                form_files,
+                headers={'Authorization': str(self.api_key),
+                         'X-CKAN-API-Key': str(self.api_key)},
+                progress_callback=self.upload_progress_callback,
+                bandwidth_limiter=self.bandwidth_limiter,
+                session=self.http_session)
+            transfer.set_status_code(status_code)
+            if response_dict is None:
+                # the response was not JSON (server error)
+                transfer.set_failed(overloaded=True)
+                raise IOError("Invalid response from CKAN uploading {0} "
+                              "files".format(len(form_files)))
+            elif not response_dict['success']:
+                transfer.set_failed()
+        return response_dict
+
+    def _get_storage_callback(self, name, total_bytes, progress_callback):
+        """
+        Returns the callback for the bytes of each block transferred by
+        the storage (called from its transfer threads)
+        """
+        progress = TransferProgress(name, total_bytes, progress_callback,
+                                    self.bandwidth_limiter)
+        progress_lock = threading.Lock()
+
+        def storage_callback(num_bytes):
+            with progress_lock:
+                progress.update(progress.bytes_transferred + num_bytes)
+        return storage_callback
+
+    def _put_in_storage(self, file_path, key):
+        """
+        Writes a file to the storage and returns its URL
+        """
+        file_size = os.path.getsize(file_path)
+        with TransferRequest(self.concurrency_limiter, file_size):
+            return self.storage.put(
+                file_path, key,
+                self._get_storage_callback(os.path.basename(key), file_size,
+                                           self.upload_progress_callback))
+
+    def _delete_from_storage(self, resource_urls):
+        """
+        Removes the payloads of deleted resources from the storage
+        """
+        if self.storage is None:
+            return
+        for resource_url in resource_urls:
+            if self.storage.owns(resource_url):
+                try:
+                    self.storage.delete(resource_url)
+                except Exception as ex:
+                    print("Storage delete of {0} failed: {1}"
+                          .format(resource_url, ex))
+
+    def upload_resource(self, file_path, overwrite=False,
+                        file_format='tar.gz', resource_name=None,
+                        extras=None):
+        """
+        This function uploads a resource to a dataset if it does not exist.
+        Failed uploads are added to the retry journal if there is one.
+        The resource name defaults to the current resource name and extras
+        are additional resource fields.
+        """
+        if resource_name is None:
+            resource_name = self.resource_name
+        if self.replicator is not None:
+            return self.replicator.upload_resource_to_all(
+                file_path, overwrite, file_format, resource_name, extras)
+        try:
+            result = self._upload_resource(file_path, overwrite, file_format,
+                                           resource_name, extras)
+        except Exception as e:
+            print(e)
+            self._record_failed_upload(file_path, overwrite, file_format,
+                                       resource_name, e, extras)
+            return None
+        if result is not None and not result['success']:
+            self._record_failed_upload(file_path, overwrite, file_format,
+                                       resource_name, result.get('error'),
+                                       extras)
+        return result
+
+    def _record_failed_upload(self, file_path, overwrite, file_format,
+                              resource_name, error, extras=None):
+        """
+        Counts a failed upload and adds it to the retry journal
+        """
+        self.num_failed_uploads += 1
+        if self.retry_journal is None or not os.path.exists(file_path):
+            return
+        try:
+            self.retry_journal.record(
+                file_path,
+                engine_url=self.engine_url,
+                model_name=self.model_name,
+                dataset_name=self.dataset_name,
+                resource_name=resource_name,
+                watershed=self.watershed,
+                subbasin=self.subbasin,
+                date_string=self.date_string,
+                date=self.date.strftime("%Y-%m-%dT%H:%M:%S"),
+                file_format=file_format,
+                overwrite=overwrite,
+                extras=extras,
+                error=str(error))
+        except (IOError, OSError) as ex:
+            print("Unable to add {0} to retry journal: {1}"
+                  .format(resource_name, ex))
+
+    def retry_pending(self):
+        """
+        This function replays the failed uploads to this manager's
+        endpoint in the retry journal that are due and returns the names
+        of the resources that succeeded and failed
+        """
+        if self.retry_journal is None:
+            raise ValueError("No retry journal configured for this manager.")
+        retry_results = {'succeeded': [], 'failed': []}
+        retried_cycles = {}
+        for task in self.retry_journal.get_due_tasks():
+            if task['model_name'] != self.model_name or \
+                    task.get('engine_url', self.engine_url) != \
+                    self.engine_url:
+                continue
+            self.watershed = task['watershed']
+            self.subbasin = task['subbasin']
+            self.date_string = task['date_string']
+            self.date = datetime.datetime.strptime(task['date'],
+                                                   "%Y-%m-%dT%H:%M:%S")
+            self.dataset_name = task['dataset_name']
+            self.resource_name = task['resource_name']
+            print("Retrying upload of {0}".format(self.resource_name))
+            error = None
             try:
-                # determine if results are exact or similar
-                same_ckan_resource_id = ""
-                if resource_results['result']['count'] > 0:
-                    for resource in resource_results['result']['results']:
-                        if resource['name'] == self.resource_name:
-                            same_ckan_resource_id = resource['id']
-                            break
-                        
-                if overwrite and same_ckan_resource_id:
-                    # delete resource
-                    """
-                    CKAN API CURRENTLY DOES NOT WORK FOR UPDATE 
-                    -> bug = needs file or url, 
-                    but requres both and to have only one ...
-
-                    #update existing resource
-                    print(resource_results['result']['results'][0])
-                    update_results = 
-                        self.dataset_engine.update_resource(
-                            resource_results['result']['results'][0]['id'], 
-                            file=file_to_upload,
-                            url="",
-                            date_uploaded=datetime.datetime.utcnow()
-                                                  .strftime("%Y%m%d%H%M"))
-                    """
-                    self.dataset_engine.delete_resource(same_ckan_resource_id)
-
-                if not same_ckan_resource_id or overwrite:
-                    # upload resources to the dataset
-                    return self.dataset_engine.create_resource(
-                        dataset_id,
-                        name=self.resource_name,
-                        file=file_path,
-                        format=file_format,
-                        tethys_app="streamflow_prediciton_tool",
-                        watershed=self.watershed,
-                        subbasin=self.subbasin,
-                        forecast_date=self.date_string,
-                        description=self.resource_description,
-                        url="")
-                                                    
-                else:
+                result = self._upload_resource(
+                    self.retry_journal.get_archive_path(task),
+                    task['overwrite'],
+                    task['file_format'],
+                    extras=task.get('extras'))
+                if result is not None and not result['success']:
+                    error = result.get('error')
+            except Exception as ex:
+                print(ex)
+                error = ex
+            if error is None:
+                self.retry_journal.complete(task)
+                retry_results['succeeded'].append(task['resource_name'])
+                retried_cycles[task['dataset_name'], task['date_string']] = \
+                    task
+            else:
+                self.retry_journal.reschedule(task, error)
+                retry_results['failed'].append(task['resource_name'])
+        if self.notification_sinks:
+            for task in retried_cycles.values():
+                self.watershed = task['watershed']
+                self.subbasin = task['subbasin']
+                self.date_string = task['date_string']
+                self.date = datetime.datetime.strptime(task['date'],
+                                                       "%Y-%m-%dT%H:%M:%S")
+                self.dataset_name = task['dataset_name']
+                self._notify_if_cycle_complete()
+        return retry_results
+
+    def _zip_upload_items(self, upload_items, overwrite=False,
+                          on_file=None):
+        """
+        This function compresses and uploads a list of
+        (resource_name, output_tar_file, source_files[, extras]) items.
+        on_file is passed to write_tarfile, it runs before the item is
+        uploaded and can fill in its extras.
+        The next item is compressed while the previous one uploads with at
+        most pipeline_queue_depth archives waiting. Each archive is
+        streamed with upload_resource, except that on CKAN 2.9+ archives
+        of up to UPLOAD_BATCH_MAX_FILE_BYTES (e.g. warning points) are
+        sent in batches of up to UPLOAD_BATCH_MAX_BYTES with one multipart
+        package_revise call each. Returns the resource info of the last
+        upload (None if all of the resources exist).
+        """
+        if self.storage is not None:
+            return self._zip_register_items(upload_items, overwrite,
+                                            on_file)
+
+        def compress(upload_item):
+            resource_name, output_tar_file, source_files = upload_item[:3]
+            return write_tarfile(output_tar_file, source_files, on_file)
+
+        batch = []
+
+        def upload_batch():
+            resources = []
+            for upload_item, tar_file_path in batch:
+                extras = upload_item[3] if len(upload_item) > 3 else None
+                resources.append(self._get_resource_fields(
+                    None, upload_item[0], 'tar.gz', extras))
+            error = None
+            try:
+                resource_info = self.register_resources(
+                    resources, overwrite,
+                    [tar_file_path for _, tar_file_path in batch])
+                if resource_info is not None and \
+                        not resource_info['success']:
+                    error = resource_info.get('error')
+            except Exception as ex:
+                resource_info = None
+                error = ex
+            if error is not None:
+                print('Error: {0}'.format(error))
+            for upload_item, tar_file_path in batch:
+                if error is not None:
+                    extras = upload_item[3] if len(upload_item) > 3 else None
+                    self._record_failed_upload(tar_file_path, overwrite,
+                                               'tar.gz', upload_item[0],
+                                               error, extras)
+                os.remove(tar_file_path)
+            del batch[:]
+            return resource_info
+
+        def upload(upload_item, tar_file_path):
+            if os.path.getsize(tar_file_path) > \
+                    self.UPLOAD_BATCH_MAX_FILE_BYTES or \
+                    not self._supports_package_revise():
+                extras = upload_item[3] if len(upload_item) > 3 else None
+                resource_info = self.upload_resource(
+                    tar_file_path, overwrite, resource_name=upload_item[0],
+                    extras=extras)
+                # resource_info is None if exists already
+                if resource_info is not None and \
+                        not resource_info['success']:
+                    print('Error: {0}'.format(resource_info['error']))
+                os.remove(tar_file_path)
+                return resource_info
+            batch.append((upload_item, tar_file_path))
+            if sum(os.path.getsize(batch_file_path) for _, batch_file_path
+                   in batch) < self.UPLOAD_BATCH_MAX_BYTES:
+                return None
+            return upload_batch()
+
+        resource_infos = run_pipeline(upload_items, compress, upload,
+                                      self.pipeline_queue_depth)
+        if batch:
+            resource_infos.append(upload_batch())
+        resource_infos = [resource_info for resource_info in resource_infos
+                          if resource_info is not None]
+        return resource_infos[-1] if resource_infos else None
+
+    def _zip_register_items(self, upload_items, overwrite=False,
+                            on_file=None):
+        """
+        This function compresses the items like _zip_upload_items and
+        writes them to the storage, then registers all of them with one
+        CKAN call. The archives are kept for the retry journal until they
+        are registered. Returns the registration response.
+        """
+        if not overwrite:
+            existing_names = set(resource['name'] for resource in
+                                 self._get_dataset_resources() or [])
+            for upload_item in upload_items:
+                if upload_item[0] in existing_names:
                     print("Resource {0} exists. Skipping ..."
-                          .format(self.resource_name))
-            except Exception as e:
-                print(e)
-                pass
-        else:
-            print("Failed to find/create dataset")
-         
+                          .format(upload_item[0]))
+            upload_items = [upload_item for upload_item in upload_items
+                            if upload_item[0] not in existing_names]
+        if not upload_items:
+            return None
+
+        def compress(upload_item):
+            resource_name, output_tar_file, source_files = upload_item[:3]
+            return write_tarfile(output_tar_file, source_files, on_file)
+
+        def store(upload_item, tar_file_path):
+            resource_name = upload_item[0]
+            extras = upload_item[3] if len(upload_item) > 3 else None
+            resource_fields = self._get_resource_fields(None, resource_name,
+                                                        'tar.gz', extras)
+            try:
+                resource_fields['url'] = self._put_in_storage(
+                    tar_file_path,
+                    self._get_storage_key(resource_name, 'tar.gz'))
+                # the URL stays the same when the resource is overwritten
+                resource_fields['size'] = os.path.getsize(tar_file_path)
+                resource_fields['last_modified'] = \
+                    datetime.datetime.utcnow().isoformat()
+            except Exception as ex:
+                print(ex)
+                self._record_failed_upload(tar_file_path, overwrite,
+                                           'tar.gz', resource_name, ex,
+                                           extras)
+                os.remove(tar_file_path)
+                return None
+            if self.retry_journal is None:
+                os.remove(tar_file_path)
+            return resource_fields, tar_file_path, extras
+
+        stored_items = [stored_item for stored_item in
+                        run_pipeline(upload_items, compress, store,
+                                     self.pipeline_queue_depth)
+                        if stored_item is not None]
+        if not stored_items:
+            return None
+        error = None
+        try:
+            resource_info = self.register_resources(
+                [resource_fields for resource_fields, _, _ in stored_items],
+                overwrite)
+            if resource_info is not None and not resource_info['success']:
+                error = resource_info.get('error')
+        except Exception as ex:
+            resource_info = None
+            error = ex
+        if error is not None:
+            print('Error: {0}'.format(error))
+        for resource_fields, tar_file_path, extras in stored_items:
+            if error is not None:
+                self._record_failed_upload(tar_file_path, overwrite,
+                                           'tar.gz', resource_fields['name'],
+                                           error, extras)
+            if self.retry_journal is not None:
+                os.remove(tar_file_path)
+        return resource_info
+
     def zip_upload_file(self, file_path):
         """
         This function uploads a resource to a dataset if it does not exist
         """
         # zip file and get dataset information
-        print("Zipping files for watershed: {0} {1}"
+        print("Zipping and uploading files for watershed: {0} {1}"
               .format(self.watershed, self.subbasin))
-        tar_file_path = self.make_tarfile(file_path)    
-        print("Finished zipping files")
-        print("Uploading datasets")
-        resource_info = self.upload_resource(tar_file_path)
-        os.remove(tar_file_path)
+        output_tar_file = os.path.join(os.path.dirname(file_path),
+                                       "%s.tar.gz" % self.resource_name)
+        resource_info = self._zip_upload_items(
+            [(self.resource_name, output_tar_file, [file_path])])
         print("Finished uploading datasets")
         return resource_info
 
@@ -254,20 +1062,21 @@ class CKANDatasetManager(object):
         This function uploads a resource to a dataset if it does not exist
         """
         # zip file and get dataset information
-        print("Zipping files for watershed: {0} {1}"
+        print("Zipping and uploading files for watershed: {0} {1}"
               .format(self.watershed, self.subbasin))
-        tar_file_path = \
-            self.make_directory_tarfile(directory_path, search_string)
-        print("Finished zipping files")
-        print("Uploading datasets")
-        resource_info = self.upload_resource(tar_file_path, overwrite)
-        os.remove(tar_file_path)
+        output_tar_file = os.path.join(os.path.dirname(directory_path),
+                                       "%s.tar.gz" % self.resource_name)
+        resource_info = self._zip_upload_items(
+            [(self.resource_name, output_tar_file,
+              glob(os.path.join(directory_path, search_string)))],
+            overwrite)
         print("Finished uploading datasets")
         return resource_info
            
     def get_resource_info(self):
         """
-        This function gets the info of a resource
+        This function gets the info of a resource. Returns None if the
+        resource does not exist or the search failed.
         """
         dataset_id = self.get_dataset_id()
         if dataset_id:
@@ -275,7 +1084,8 @@ class CKANDatasetManager(object):
             resource_results = \
                 self.dataset_engine.search_resources(
                     {'name': self.resource_name},
-                    datset_id=dataset_id)
+                    datset_id=dataset_id,
+                    limit=10)
             try:
                 if resource_results['result']['count'] > 0:
                     for resource in resource_results['result']['results']:
@@ -289,11 +1099,13 @@ class CKANDatasetManager(object):
 
     def get_dataset_info(self):
         """
-        This function gets the info of a resource
+        This function gets the info of a dataset. Returns None if the
+        dataset does not exist or the search failed.
         """
         # Use the json module to load CKAN's response into a dictionary.
         response_dict = \
-            self.dataset_engine.search_datasets({'name': self.dataset_name})
+            self.dataset_engine.search_datasets({'name': self.dataset_name},
+                                                rows=10)
         
         if response_dict['success']:
             if int(response_dict['result']['count']) > 0:
@@ -305,16 +1117,182 @@ class CKANDatasetManager(object):
         else:
             return None
 
+    def get_dataset_summary(self):
+        """
+        This function gets the id, name and resource summaries
+        (name, url, format and the last modified time of the dataset) of
+        the current cycle in the dataset. Only these fields are requested
+        from the search index to keep the response small. Returns None
+        if the dataset does not exist or the search failed.
+        """
+        response_dict = \
+            self.dataset_engine.search_datasets(
+                {'name': self.dataset_name},
+                fl="id,name,num_resources,metadata_modified,"
+                   "res_name,res_url,res_format",
+                rows=1)
+        if not response_dict or not response_dict['success']:
+            return None
+        for dataset in response_dict['result']['results']:
+            if dataset.get('name') == self.dataset_name:
+                return self.filter_cycle_resources(
+                    self.summarize_dataset(dataset))
+        return None
+
+    @staticmethod
+    def summarize_dataset(dataset):
+        """
+        This function converts a dataset search result into a dictionary
+        with the id, name, num_resources and resource summaries
+        """
+        if 'resources' in dataset:
+            # full dataset document
+            resources = [ResourceSummary.from_resource(resource)
+                         for resource in dataset['resources']]
+        else:
+            # the search index stores the resource fields as lists
+            resources = [ResourceSummary(name, url, file_format, None,
+                                         dataset.get('metadata_modified'),
+                                         None)
+                         for name, url, file_format in
+                         zip(dataset.get('res_name', []),
+                             dataset.get('res_url', []),
+                             dataset.get('res_format', []))]
+        return {
+            'id': dataset.get('id'),
+            'name': dataset.get('name'),
+            'num_resources': len(resources),
+            'resources': resources,
+        }
+
+    def get_dataset_extras(self):
+        """
+        This function gets the extras (key: value) in the metadata of the
+        current dataset. Returns None if the dataset does not exist or the
+        request failed.
+        """
+        try:
+            response_dict = self.dataset_engine.execute_api_method(
+                'package_show', id=self.dataset_name)
+        except Exception as ex:
+            print(ex)
+            return None
+        if not response_dict or not response_dict['success']:
+            return None
+        return dict((extra['key'], extra['value'])
+                    for extra in response_dict['result'].get('extras', []))
+
+    def patch_dataset_extras(self, extras):
+        """
+        This function adds or replaces extras (key: value) in the metadata
+        of the current dataset. The dataset is not patched (no new
+        revision) if it already has the extras.
+        """
+        if self.replicator is not None:
+            return self.replicator.patch_dataset_extras_on_all(extras)
+        return self._patch_dataset_extras(extras)
+
+    def _patch_dataset_extras(self, extras):
+        """
+        Patches the extras on this manager's endpoint
+        (see patch_dataset_extras)
+        """
+        dataset_extras = self.get_dataset_extras()
+        if dataset_extras is None:
+            print("Dataset {0} not found. Skipping metadata ..."
+                  .format(self.dataset_name))
+            return None
+        if all(dataset_extras.get(key) == value
+               for key, value in extras.items()):
+            print("Metadata of {0} is up to date. Skipping ..."
+                  .format(self.dataset_name))
+            return None
+        dataset_extras.update(extras)
+        response_dict = self.dataset_engine.execute_api_method(
+            'package_patch',
+            id=self.dataset_name,
+            extras=[{'key': key, 'value': value}
+                    for key, value in sorted(dataset_extras.items())])
+        if not response_dict or not response_dict['success']:
+            print("Metadata update failed for {0}: {1}"
+                  .format(self.dataset_name,
+                          (response_dict or {}).get('error')))
+        return response_dict
+
+    def _download_file(self, url, local_file_path):
+        """
+        Downloads a file from url
+        """
+        if self.storage is not None and self.storage.owns(url):
+            # read directly from the object store
+            with TransferRequest(self.concurrency_limiter):
+                self.storage.download(
+                    url, local_file_path,
+                    self._get_storage_callback(
+                        os.path.basename(local_file_path), 0, None))
+            return
+        with TransferRequest(self.concurrency_limiter) as transfer:
+            def check_response(r):
+                transfer.set_status_code(r.status_code)
+                transfer.num_bytes = \
+                    int(r.headers.get('content-length', 0)) or None
+
+            download_to_file(url, local_file_path, self.http_session,
+                             self.bandwidth_limiter,
+                             self.download_buffer_size, check_response)
+
     def download_resource_from_info(self, extract_directory,
                                     resource_info_array, local_file=None):
         """
-        Downloads a resource from url
+        Downloads a resource from url.
+
+        Concurrent calls for the same location (from threads or other
+        processes) are coalesced: the first caller downloads and the
+        others wait for it and reuse its result (callers in other
+        processes then find the files and return -1). Every download
+        into the extract directory (the whole cycle or a single file of
+        it) holds the lock of the extract directory, which is kept next
+        to it (see locking.get_lock_path).
         """
-        num_resources_downloaded = 0
-        # only download if file does not exist already
         check_location = extract_directory
         if local_file:
             check_location = os.path.join(extract_directory, local_file)
+        check_location = os.path.abspath(check_location)
+        lock_path = get_lock_path(extract_directory)
+        return _download_flights.do(
+            check_location,
+            lambda: self._download_resource_from_info(check_location,
+                                                      extract_directory,
+                                                      resource_info_array),
+            lock_path)
+
+    @staticmethod
+    def _remove_file(file_path):
+        """
+        Removes a file if it exists
+        """
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def _finish_extraction(self, resource_info, local_tar_file_path,
+                           from_cache):
+        """
+        Moves a newly downloaded archive into the archive cache after it
+        was extracted successfully, otherwise removes it
+        """
+        if self.archive_cache is not None and not from_cache:
+            self.archive_cache.put(resource_info, local_tar_file_path)
+        self._remove_file(local_tar_file_path)
+
+    def _download_resource_from_info(self, check_location, extract_directory,
+                                     resource_info_array):
+        """
+        Downloads a resource from url if check_location does not exist
+        """
+        num_resources_downloaded = 0
+        # only download if file does not exist already
         if not os.path.exists(check_location):
             print("Downloading and extracting files for watershed: {0} {1}"
                   .format(self.watershed, self.subbasin))
@@ -322,49 +1300,108 @@ class CKANDatasetManager(object):
                 os.makedirs(extract_directory)
             except OSError:
                 pass
+            # extraction runs on a process pool (when configured) so
+            # archives are extracted while the next ones download
+            extraction_pool = None
+            if self.extraction_workers > 1 and len(resource_info_array) > 1:
+                extraction_pool = \
+                    get_extraction_pool(self.extraction_workers)
+            pending_extractions = []
             for resource_info in resource_info_array:
                 # for resource
                 file_format = resource_info['format']
-                
-                local_tar_file = "%s.%s" % (resource_info['name'], file_format)
-                    
+
+                local_tar_file = "%s.%s" % (resource_info['name'],
+                                            file_format)
+
                 local_tar_file_path = os.path.join(extract_directory,
                                                    local_tar_file)
                 if os.path.exists(local_tar_file_path):
                     print("Local raw file found. Skipping ...")
-                else:
-                    try:    
-                        r = get(resource_info['url'], stream=True)
-                        with open(local_tar_file_path, 'wb') as f:
-                            for chunk in r.iter_content(chunk_size=1024): 
-                                if chunk:  # filter out keep-alive new chunks
-                                    f.write(chunk)
-                                    f.flush()
-            
-                        if file_format.lower() == "tar.gz":
-                            with tarfile.open(local_tar_file_path) as tar:
-                                tar.extractall(extract_directory)
-                        elif file_format.lower() == "zip":
-                            with zipfile.ZipFile(local_tar_file_path) \
-                                    as zip_file:
-                                zip_file.extractall(extract_directory)
-                        else:
-                            print("Unsupported file format. Skipping ...")
-                    except Exception as ex:
-                        print(ex)
-                        pass
-                    
-                    try:
-                        os.remove(local_tar_file_path)
-                    except OSError:
-                        pass
-                    num_resources_downloaded += 1
+                    continue
+                try:
+                    # a link to the cached archive so it cannot be
+                    # evicted before the extraction
+                    from_cache = self.archive_cache is not None and \
+                        self.archive_cache.checkout(resource_info,
+                                                    local_tar_file_path)
+                    if from_cache:
+                        print("Using cached archive for {0}"
+                              .format(resource_info['name']))
+                    else:
+                        self._download_file(resource_info['url'],
+                                            local_tar_file_path)
+                    if extraction_pool is not None:
+                        pending_extractions.append(
+                            (resource_info, from_cache,
+                             extraction_pool.submit(extract_archive,
+                                                    local_tar_file_path,
+                                                    extract_directory,
+                                                    file_format)))
+                    else:
+                        extract_archive(local_tar_file_path,
+                                        extract_directory,
+                                        file_format)
+                        self._finish_extraction(resource_info,
+                                                local_tar_file_path,
+                                                from_cache)
+                except Exception as ex:
+                    print(ex)
+                    self._remove_file(local_tar_file_path)
+                num_resources_downloaded += 1
+
+            for resource_info, from_cache, extraction in \
+                    pending_extractions:
+                local_tar_file_path = \
+                    os.path.join(extract_directory,
+                                 "%s.%s" % (resource_info['name'],
+                                            resource_info['format']))
+                try:
+                    extraction.result()
+                    self._finish_extraction(resource_info,
+                                            local_tar_file_path,
+                                            from_cache)
+                except Exception as ex:
+                    print(ex)
+                    self._remove_file(local_tar_file_path)
             print("Finished downloading and extracting file(s)")
             return num_resources_downloaded
         else:
             print("Resource exists locally. Skipping ...")
             return -1
 
+    def register_cycle(self, cycle_path):
+        """
+        This function adds a downloaded forecast cycle to the retention
+        index (if there is retention) which removes old cycles
+        """
+        if self.retention is not None:
+            self.retention.register(cycle_path)
+
+    def notify_cycle_complete(self, num_resources, date_string=None):
+        """
+        This function sends the cycle complete event of the current cycle
+        to the notification sinks. date_string is the one used to
+        download the cycle (the current date_string by default).
+        """
+        event = create_cycle_complete_event(self.model_name, self.watershed,
+                                            self.subbasin,
+                                            date_string or self.date_string,
+                                            self.dataset_name, num_resources)
+        for notification_sink in self.notification_sinks:
+            try:
+                notification_sink.send(event)
+            except Exception as ex:
+                print("Notification to {0} failed: {1}"
+                      .format(type(notification_sink).__name__, ex))
+
+    def _notify_if_cycle_complete(self):
+        """
+        Sends the cycle complete event after an upload to the current
+        cycle if it is complete (forecast managers only)
+        """
+        pass
+
     def download_resource(self, extract_directory, local_file=None):
         """
         This function downloads a resource
@@ -412,7 +1449,7 @@ class CKANDatasetManager(object):
                     self.dataset_engine.search_datasets(
                         {'name': dataset_name_query},
                         rows=1000,
-                        fl="id,name",
+                        fl="id,name,res_url",
                         sort="forecast_date asc")
                 if not response_dict['success']:
                     print("ERROR: {0}".format(response_dict))
@@ -423,16 +1460,20 @@ class CKANDatasetManager(object):
                         # print("FOUND Name: {0}, ID: {1}"
                         #       .format(dataset['name'], dataset['id']))
                         # STEP 1: GET DATE
-                        dataset_date_string = dataset['name'].split("-")[-1]\
-                                                             .replace("t", ".")
-                        dataset_date = \
-                            datetime.datetime\
-                                    .strptime(dataset_date_string, "%Y%m%d.%H")
-                        # STEP 2: IF OLD, DELETE ALL RESOURCES
-                        if dataset_date < (datetime.datetime.utcnow() -
-                                           datetime.timedelta(
-                                               days=days_from_now_buffer)):
+                        try:
+                            _, dataset_end_date = \
+                                self.partitioning.get_partition_range(
+                                    dataset['name'].split("-")[-1])
+                        except ValueError as ex:
+                            print("{0}. Skipping ...".format(ex))
+                            continue
+                        # STEP 2: IF ALL CYCLES ARE OLD, DELETE ALL RESOURCES
+                        oldest_date = datetime.datetime.utcnow() - \
+                            datetime.timedelta(days=days_from_now_buffer)
+                        if dataset_end_date <= oldest_date:
                             self.dataset_engine.delete_dataset(dataset['id'])
+                            self._delete_from_storage(
+                                dataset.get('res_url', []))
                             print("DELETED Name: {0}, ID: {1}"
                                   .format(dataset['name'], dataset['id']))
                         else:
@@ -451,12 +1492,15 @@ class CKANDatasetManager(object):
 # -----------------------------------------------------------------------------
 # ECMWF RAPID CKAN Dataset Manager Class
 # -----------------------------------------------------------------------------
+@profiled
 class ECMWFRAPIDDatasetManager(CKANDatasetManager):
     """
     This class is used to find and download, zip and upload ECMWFRAPID 
     prediction files from/to a data server
     """
-    def __init__(self, engine_url, api_key, owner_org=""):
+    CYCLE_DATASET_DATE_FORMAT = "%Y%m%dt%H"
+
+    def __init__(self, engine_url, api_key, owner_org="", **kwargs):
         super(ECMWFRAPIDDatasetManager, self).__init__(
             engine_url,
             api_key,
@@ -465,7 +1509,8 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
             'This dataset contians NetCDF3 files produced by '
             'downscalsing ECMWF forecasts and routing them with RAPID',
             "%Y%m%d.%H",
-            owner_org)
+            owner_org,
+            **kwargs)
                                                         
     def initialize_run_ecmwf(self, watershed, subbasin, date_string):
         """
@@ -476,10 +1521,30 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
         self.date_string = date_string[:11]
         self.date = datetime.datetime.strptime(self.date_string,
                                                self.date_format_string)
-        self.dataset_name = '%s-%s-%s-%s' % (self.model_name, 
-                                             self.watershed, 
-                                             self.subbasin, 
-                                             self.date.strftime("%Y%m%dt%H"))
+        self.dataset_name = self.get_partition_dataset_name()
+
+    def get_cycle_resource_prefix(self):
+        """
+        This function returns the name prefix of the forecast and warning
+        points resources of the current cycle or None if the datasets hold
+        one cycle
+        """
+        if not getattr(self.partitioning, 'groups_cycles', True):
+            return None
+        return '%s-%s-%s-%s-' % (self.model_name,
+                                 self.watershed,
+                                 self.subbasin,
+                                 self.date_string)
+
+    def get_summary_extra_key(self):
+        """
+        This function returns the dataset extra with the warning points
+        summary of the current cycle (one per cycle when the datasets hold
+        several cycles)
+        """
+        if getattr(self.partitioning, 'groups_cycles', True):
+            return '%s_%s' % (SUMMARY_EXTRA, self.date_string)
+        return SUMMARY_EXTRA
                                                 
     def update_resource_ensemble_number(self, ensemble_number):
         """
@@ -502,9 +1567,22 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
                               self.date_string,
                               return_period)
 
+    @staticmethod
+    def _find_directory_files(directory_path, search_string,
+                              directory_files=None):
+        """
+        Returns the files in the directory matching the search string,
+        from directory_files if the directory was listed already
+        """
+        if directory_files is None:
+            return glob(os.path.join(directory_path, search_string))
+        return [directory_file for directory_file in directory_files
+                if fnmatch(os.path.basename(directory_file), search_string)]
+
     def zip_upload_warning_points_in_directory(self, directory_path,
                                                search_string=
-                                               "return_*_points.geojson"):
+                                               "return_*_points.geojson",
+                                               directory_files=None):
         """
         This function packages all of the datasets into individual
         tar.gz files and
@@ -516,8 +1594,13 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
         # zip file and get dataset information
         print("Zipping and uploading warning points files "
               "for watershed: {0} {1}".format(self.watershed, self.subbasin))
-        directory_files = glob(os.path.join(directory_path, search_string))
-        resource_info = None
+        directory_files = self._find_directory_files(directory_path,
+                                                     search_string,
+                                                     directory_files)
+        upload_items = []
+        warning_points_summary = {}
+        # {directory_file: (return_period, resource extras)}
+        file_extras = {}
         for directory_file in directory_files:
             return_period = \
                 return_period_search.search(os.path.basename(directory_file))\
@@ -526,21 +1609,39 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
             # tar.gz file
             output_tar_file = \
                 os.path.join(base_path, "%s.tar.gz" % self.resource_name)
-            if not os.path.exists(output_tar_file):
-                with tarfile.open(output_tar_file, "w:gz") as tar:
-                    tar.add(directory_file,
-                            arcname=os.path.basename(directory_file))
-            # upload file
-            resource_info = self.upload_resource(output_tar_file)
-            if resource_info is not None:
-                if not resource_info['success']:
-                    print('Error: {0}'.format(resource_info['error']))
-            os.remove(output_tar_file)
+            resource_extras = {}
+            file_extras[directory_file] = (return_period, resource_extras)
+            upload_items.append((self.resource_name, output_tar_file,
+                                 [directory_file], resource_extras))
+
+        def summarize(directory_file, file_data):
+            # summary stored as metadata for dashboards, made from the
+            # contents read into the archive
+            return_period, resource_extras = file_extras[directory_file]
+            try:
+                warning_points_summary[return_period] = \
+                    summarize_warning_points_data(file_data)
+            except ValueError as ex:
+                print("Warning points summary failed: {0}".format(ex))
+                return
+            resource_extras[SUMMARY_EXTRA] = \
+                json.dumps(warning_points_summary[return_period])
+
+        resource_info = self._zip_upload_items(upload_items,
+                                               on_file=summarize)
+        if warning_points_summary:
+            self.patch_dataset_extras({
+                self.get_summary_extra_key(): json.dumps({
+                    'forecast_date': self.date_string,
+                    'return_periods': warning_points_summary,
+                })
+            })
         print("{0} datasets uploaded".format(len(directory_files)))
         return resource_info
 
     def zip_upload_forecasts_in_directory(self, directory_path,
-                                          search_string="*.nc"):
+                                          search_string="*.nc",
+                                          directory_files=None):
         """
         This function packages all of the datasets
         into individual tar.gz files and
@@ -552,8 +1653,10 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
         # zip file and get dataset information
         print("Zipping and uploading files for watershed: {0} {1}"
               .format(self.watershed, self.subbasin))
-        directory_files = glob(os.path.join(directory_path, search_string))
-        resource_info = None
+        directory_files = self._find_directory_files(directory_path,
+                                                     search_string,
+                                                     directory_files)
+        upload_items = []
         for directory_file in directory_files:
             ensemble_number = \
                 ensemble_number_search.search(
@@ -562,43 +1665,152 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
             # tar.gz file
             output_tar_file = os.path.join(base_path,
                                            "%s.tar.gz" % self.resource_name)
-            if not os.path.exists(output_tar_file):
-                with tarfile.open(output_tar_file, "w:gz") as tar:
-                    tar.add(directory_file,
-                            arcname=os.path.basename(directory_file))
-            # upload file
-            resource_info = self.upload_resource(output_tar_file)
-            # resource_info is None if exists already
-            if resource_info is not None:
-                if not resource_info['success']:
-                    print('Error: {0}'.format(resource_info['error']))
-            os.remove(output_tar_file)
+            upload_items.append((self.resource_name, output_tar_file,
+                                 [directory_file]))
+        resource_info = self._zip_upload_items(upload_items)
 
         print("{0} datasets uploaded".format(len(directory_files)))
         return resource_info
 
-    def zip_upload_resources(self, source_directory):
+    def zip_upload_resources(self, source_directory, watersheds=None,
+                             start_date=None, end_date=None,
+                             watermark_file=None):
         """
         This function packages all of the datasets in to tar.gz files and
-        returns their attributes
-        """
-        watershed_directories = [d for d in os.listdir(source_directory)
-                                 if os.path.isdir(
-                                 os.path.join(source_directory, d))]
-
-        for watershed_directory in watershed_directories:
-            watershed_dir = os.path.join(source_directory, watershed_directory)
-            watershed, subbasin = \
-                get_watershed_subbasin_from_folder(watershed_directory)
-            date_strings = [d for d in os.listdir(watershed_dir)
-                            if os.path.isdir(os.path.join(watershed_dir, d))]
-            for date_string in date_strings:
-                upload_dir = os.path.join(watershed_dir, date_string)
-                self.initialize_run_ecmwf(watershed, subbasin, date_string)
-                self.zip_upload_forecasts_in_directory(upload_dir,
-                                                       'Qout_*.nc')
-                self.zip_upload_warning_points_in_directory(upload_dir)
+        returns their attributes.
+
+        The date directories are found lazily so uploads start right away.
+        watersheds (a list of (watershed, subbasin)) and the date range
+        limit the directories visited. With a watermark_file only cycles
+        newer than the newest one of the last complete run are uploaded.
+        The watermark of a watershed only moves past cycles when all of
+        their uploads (and those of the older cycles) succeeded and they
+        are complete on CKAN (see is_dataset_ready), so cycles that are
+        still being written are uploaded again by the next run.
+        """
+        watermark = None
+        newer_than = {}
+        if watermark_file:
+            watermark = UploadWatermark(watermark_file)
+            newer_than = watermark.load()
+
+        def parse_date(date_string):
+            return datetime.datetime.strptime(date_string[:11],
+                                              self.date_format_string)
+
+        # {(watershed, subbasin): [(date, uploaded and complete)]}
+        cycle_outcomes = {}
+        for work_item in discover_upload_work(source_directory, parse_date,
+                                              watersheds, start_date,
+                                              end_date, newer_than):
+            num_failed_uploads = self.num_failed_uploads
+            self.initialize_run_ecmwf(work_item.watershed,
+                                      work_item.subbasin,
+                                      work_item.date_string)
+            forecast_info = self.zip_upload_forecasts_in_directory(
+                work_item.directory, 'Qout_*.nc', work_item.files)
+            warning_points_info = self.zip_upload_warning_points_in_directory(
+                work_item.directory, directory_files=work_item.files)
+            cycle_complete = None
+            if self.notification_sinks and \
+                    (forecast_info is not None or
+                     warning_points_info is not None):
+                cycle_complete = self._notify_if_cycle_complete()
+            uploaded = self.num_failed_uploads == num_failed_uploads
+            if watermark is not None and uploaded and cycle_complete is None:
+                cycle_complete = \
+                    self._get_ready_dataset_summary() is not None
+            cycle_outcomes.setdefault(
+                (work_item.watershed, work_item.subbasin), []).append(
+                    (work_item.date, uploaded and bool(cycle_complete)))
+
+        # the newest cycle before the first failed or partial one of each
+        # watershed
+        newest_dates = {}
+        for watershed_subbasin, outcomes in cycle_outcomes.items():
+            for date, uploaded in sorted(outcomes):
+                if not uploaded:
+                    break
+                newest_dates[watershed_subbasin] = date
+        if watermark is not None and newest_dates:
+            watermark.save(newest_dates)
     
+    def _get_ready_dataset_summary(self):
+        """
+        Returns the summary of the current cycle if it is ready for
+        download (see is_dataset_ready), otherwise None
+        """
+        dataset_info = self.get_dataset_summary()
+        if dataset_info and self.is_dataset_ready(dataset_info):
+            return dataset_info
+        return None
+
+    def _notify_if_cycle_complete(self):
+        """
+        Sends the cycle complete event if the current cycle is ready for
+        download (see is_dataset_ready). Returns True if it is ready.
+        """
+        dataset_info = self._get_ready_dataset_summary()
+        if dataset_info is None:
+            return False
+        # the date_string of download_recent_resource
+        self.notify_cycle_complete(
+            dataset_info['num_resources'],
+            '%s.%s' % (self.date.strftime("%Y%m%d"),
+                       '1200' if self.date.hour > 11 else '0'))
+        return True
+
+    @staticmethod
+    def is_dataset_ready(dataset_info):
+        """
+        This function checks if all of the forecasts (at least 52) and
+        warning points (none or 3) of a cycle are uploaded
+        """
+        forecast_count = 0
+        warning_point_count = 0
+        if dataset_info['num_resources'] >= 52:
+            for resource in dataset_info['resources']:
+                if "warning_points" in resource['name']:
+                    warning_point_count += 1
+                else:
+                    forecast_count += 1
+        dataset_ready = dataset_info['num_resources'] >= 52
+        if 0 < warning_point_count < 3:
+            dataset_ready = False
+        if forecast_count < 52:
+            dataset_ready = False
+        return dataset_ready
+
+    def download_cycle(self, watershed, subbasin, date_string,
+                       main_extract_directory, force=False):
+        """
+        This function downloads the resources of a forecast cycle if they
+        are all uploaded (or force is True). Returns the number of
+        resources downloaded, -1 if the cycle exists locally or 0 if it is
+        not available.
+        """
+        self.initialize_run_ecmwf(watershed, subbasin, date_string)
+        # get list of all resources
+        dataset_info = self.get_dataset_summary()
+        if not dataset_info:
+            print("No dataset info available ...")
+        elif not (main_extract_directory or
+                  not os.path.exists(main_extract_directory)):
+            print("No dataset info available or "
+                  "invalid extract directory ...")
+        elif force or self.is_dataset_ready(dataset_info):
+            extract_directory = \
+                os.path.join(main_extract_directory,
+                             "{0}-{1}".format(self.watershed,
+                                              self.subbasin),
+                             date_string)
+            num_downloaded = self.download_resource_from_info(
+                extract_directory, dataset_info['resources'])
+            if num_downloaded > 0:
+                self.register_cycle(extract_directory)
+            return num_downloaded
+        return 0
+
     def download_recent_resource(self, watershed, subbasin,
                                  main_extract_directory):
         """
@@ -613,53 +1825,134 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
                 today_datetime - datetime.timedelta(seconds=iteration*12*60*60)
             hour = '1200' if today.hour > 11 else '0'
             date_string = '%s.%s' % (today.strftime("%Y%m%d"), hour)
-            
-            self.initialize_run_ecmwf(watershed, subbasin, date_string)
-            # get list of all resources
-            dataset_info = self.get_dataset_info()
-            if not dataset_info:
-                print("No dataset info available ...")
-            elif not (main_extract_directory or
-                      not os.path.exists(main_extract_directory)):
-                print("No dataset info available or "
-                      "invalid extract directory ...")
-            else:
-                # check if forecast is ready to be downloaded
-                forecast_count = 0
-                warning_point_count = 0
-                if dataset_info['num_resources'] >= 52:
-                    for resource in dataset_info['resources']:
-                        if "warning_points" in resource['name']:
-                            warning_point_count += 1
-                        else:
-                            forecast_count += 1
-                dataset_ready = dataset_info['num_resources'] >= 52
-                if 0 < warning_point_count < 3:
-                    dataset_ready = False
-                if forecast_count < 52:
-                    dataset_ready = False
-
-                # make sure there are at least 52 or at least
-                # a day has passed before downloading
-                if dataset_ready or \
-                        (today_datetime-today >= datetime.timedelta(1)):
-                    extract_directory = \
-                        os.path.join(main_extract_directory,
-                                     "{0}-{1}".format(self.watershed,
-                                                      self.subbasin),
-                                     date_string)
-                                                     
-                    if self.download_resource_from_info(
-                            extract_directory,
-                            dataset_info['resources']) > 0:
-                        download_file = True
-                        break   
+
+            # make sure there are at least 52 or at least
+            # a day has passed before downloading
+            if self.download_cycle(
+                    watershed, subbasin, date_string, main_extract_directory,
+                    force=today_datetime-today >= datetime.timedelta(1)) > 0:
+                download_file = True
+                break
                                                                      
             iteration += 1
                     
         if not download_file:
             print("Recent resources not found ({0}-{1}). Skipping ..."
                   .format(watershed, subbasin))
+        return download_file
+
+    def search_dataset_summaries(self, dataset_names, names_per_search=50):
+        """
+        This function gets the summaries of many datasets with combined
+        searches. Returns {dataset_name: summary} for those found.
+        """
+        dataset_summaries = {}
+        for name_index in range(0, len(dataset_names), names_per_search):
+            search_names = dataset_names[name_index:
+                                         name_index + names_per_search]
+            response_dict = self.dataset_engine.search_datasets(
+                filtered_query={
+                    'name': "(%s)" % " OR ".join(search_names)},
+                fl="id,name,num_resources,metadata_modified,"
+                   "res_name,res_url,res_format",
+                rows=len(search_names))
+            if not response_dict or not response_dict['success']:
+                continue
+            for dataset in response_dict['result']['results']:
+                if dataset.get('name') in search_names:
+                    dataset_summaries[dataset['name']] = \
+                        self.summarize_dataset(dataset)
+        return dataset_summaries
+
+    def download_recent_resources(self, watersheds, main_extract_directory,
+                                  max_workers=4):
+        """
+        This function downloads the most recent resources within 6 days
+        for a list of (watershed, subbasin) like download_recent_resource.
+        The latest complete cycle of all of the watersheds is found with
+        one combined search per cycle and the downloads run on a pool of
+        max_workers threads.
+
+        Returns a list with the watershed, subbasin, date_string (None if
+        no cycle was found) and number of resources downloaded
+        (-1 if the cycle exists locally) for each watershed.
+        """
+        today_datetime = datetime.datetime.utcnow()
+        watershed_manager = copy.copy(self)
+        pending_watersheds = []
+        for watershed, subbasin in watersheds:
+            if (watershed.lower(), subbasin.lower()) not in pending_watersheds:
+                pending_watersheds.append((watershed.lower(),
+                                           subbasin.lower()))
+        recent_cycles = {}
+        iteration = 0
+        while pending_watersheds and iteration < 12:
+            today = \
+                today_datetime - datetime.timedelta(seconds=iteration*12*60*60)
+            hour = '1200' if today.hour > 11 else '0'
+            date_string = '%s.%s' % (today.strftime("%Y%m%d"), hour)
+            dataset_names = {}
+            resource_prefixes = {}
+            for watershed, subbasin in pending_watersheds:
+                watershed_manager.initialize_run_ecmwf(watershed, subbasin,
+                                                       date_string)
+                dataset_names[watershed_manager.dataset_name] = \
+                    (watershed, subbasin)
+                resource_prefixes[watershed_manager.dataset_name] = \
+                    watershed_manager.get_cycle_resource_prefix()
+            dataset_summaries = \
+                self.search_dataset_summaries(sorted(dataset_names))
+            # make sure there are at least 52 or at least
+            # a day has passed before downloading
+            force = today_datetime-today >= datetime.timedelta(1)
+            for dataset_name, dataset_info in dataset_summaries.items():
+                dataset_info = self.filter_cycle_resources(
+                    dataset_info, resource_prefixes[dataset_name])
+                if force and not dataset_info['num_resources']:
+                    # the dataset only holds other cycles
+                    continue
+                if force or self.is_dataset_ready(dataset_info):
+                    watershed_subbasin = dataset_names[dataset_name]
+                    recent_cycles[watershed_subbasin] = \
+                        (date_string, dataset_info)
+                    pending_watersheds.remove(watershed_subbasin)
+            iteration += 1
+
+        def download(watershed_subbasin):
+            watershed, subbasin = watershed_subbasin
+            date_string, dataset_info = recent_cycles[watershed_subbasin]
+            manager = copy.copy(self)
+            manager.initialize_run_ecmwf(watershed, subbasin, date_string)
+            extract_directory = \
+                os.path.join(main_extract_directory,
+                             "{0}-{1}".format(watershed, subbasin),
+                             date_string)
+            num_downloaded = manager.download_resource_from_info(
+                extract_directory, dataset_info['resources'])
+            if num_downloaded > 0:
+                manager.register_cycle(extract_directory)
+            return num_downloaded
+
+        download_watersheds = sorted(recent_cycles)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            download_results = dict(zip(download_watersheds,
+                                        executor.map(download,
+                                                     download_watersheds)))
+
+        results = []
+        for watershed, subbasin in watersheds:
+            watershed_subbasin = (watershed.lower(), subbasin.lower())
+            if watershed_subbasin not in recent_cycles:
+                print("Recent resources not found ({0}-{1}). Skipping ..."
+                      .format(watershed, subbasin))
+            results.append({
+                'watershed': watershed_subbasin[0],
+                'subbasin': watershed_subbasin[1],
+                'date_string':
+                    recent_cycles.get(watershed_subbasin, (None,))[0],
+                'downloaded': download_results.get(watershed_subbasin, 0),
+            })
+        return results
                                      
     def download_recent_warning_points(self, watershed, subbasin,
                                        main_extract_directory):
@@ -681,7 +1974,7 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
             
             self.initialize_run_ecmwf(watershed, subbasin, date_string)
             # get list of all resources
-            dataset_info = self.get_dataset_info()
+            dataset_info = self.get_dataset_summary()
             if dataset_info and main_extract_directory and \
                     os.path.exists(main_extract_directory):
                 # check if forecast is ready to be downloaded
@@ -717,6 +2010,7 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
                                 os.path.join(extract_directory,
                                              warning_file_name))
                     if downloaded_files:
+                        self.register_cycle(extract_directory)
                         break
             iteration += 1
         if not downloaded_files:
@@ -725,6 +2019,34 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
         return {"forecast_date": today,
                 "downloaded_files": downloaded_files}
             
+    def get_warning_points_summary(self, watershed, subbasin,
+                                   date_string=None):
+        """
+        This function gets the warning points summary (count, bounding
+        box and peaks per return period) of a cycle from the dataset
+        metadata without downloading the warning points. Without a
+        date_string the most recent cycle within 1 day with a summary is
+        used. Returns None if there is no summary.
+        """
+        if date_string is not None:
+            date_strings = [date_string]
+        else:
+            today_datetime = datetime.datetime.utcnow()
+            date_strings = []
+            for iteration in range(2):
+                today = today_datetime - \
+                    datetime.timedelta(seconds=iteration*12*60*60)
+                hour = '1200' if today.hour > 11 else '0'
+                date_strings.append('%s.%s' % (today.strftime("%Y%m%d"),
+                                               hour))
+        for date_string in date_strings:
+            self.initialize_run_ecmwf(watershed, subbasin, date_string)
+            dataset_extras = self.get_dataset_extras()
+            summary_extra_key = self.get_summary_extra_key()
+            if dataset_extras and dataset_extras.get(summary_extra_key):
+                return json.loads(dataset_extras[summary_extra_key])
+        return None
+
     def download_prediction_dataset(self, watershed, subbasin, date_string,
                                     extract_directory):
         """
@@ -732,24 +2054,29 @@ class ECMWFRAPIDDatasetManager(CKANDatasetManager):
         """
         self.initialize_run_ecmwf(watershed, subbasin, date_string)
         # get list of all resources
-        dataset_info = self.get_dataset_info()
+        dataset_info = self.get_dataset_summary()
         if dataset_info and extract_directory \
                 and os.path.exists(extract_directory):
-            if not self.download_resource_from_info(
-                    os.path.join(extract_directory, date_string),
-                    dataset_info['resources']):
+            num_downloaded = self.download_resource_from_info(
+                os.path.join(extract_directory, date_string),
+                dataset_info['resources'])
+            if not num_downloaded:
                 print("Recent prediction datasets not found. Skipping ...")
+            elif num_downloaded > 0:
+                self.register_cycle(os.path.join(extract_directory,
+                                                 date_string))
 
 
 # -----------------------------------------------------------------------------
 # WRF-Hydro RAPID CKAN Dataset Manager Class
 # -----------------------------------------------------------------------------
+@profiled
 class WRFHydroHRRRDatasetManager(CKANDatasetManager):
     """
     This class is used to find and download, zip and upload ECMWFRAPID 
     prediction files from/to a data server
     """
-    def __init__(self, engine_url, api_key, owner_org=""):
+    def __init__(self, engine_url, api_key, owner_org="", **kwargs):
         super(WRFHydroHRRRDatasetManager, self).__init__(
             engine_url,
             api_key,
@@ -758,7 +2085,8 @@ class WRFHydroHRRRDatasetManager(CKANDatasetManager):
             'This dataset contians NetCDF3 files produced by '
             'downscalsing WRF-Hydro forecasts and routing them with RAPID',
             "%Y%m%dT%H%MZ",
-            owner_org)
+            owner_org,
+            **kwargs)
           
     def zip_upload_resource(self, source_file, watershed, subbasin):
         """
@@ -769,7 +2097,38 @@ class WRFHydroHRRRDatasetManager(CKANDatasetManager):
         file_name = os.path.basename(source_file)
         date_string = file_name.split("_")[1]
         self.initialize_run(watershed, subbasin, date_string)
-        self.zip_upload_file(source_file)
+        resource_info = self.zip_upload_file(source_file)
+        if resource_info is not None and resource_info['success']:
+            self._notify_if_cycle_complete()
+
+    def _notify_if_cycle_complete(self):
+        """
+        Sends the cycle complete event (a cycle is a single resource)
+        """
+        self.notify_cycle_complete(1)
+
+    def download_cycle(self, watershed, subbasin, date_string,
+                       main_extract_directory):
+        """
+        This function downloads the resource of a forecast cycle.
+        Returns the number of resources downloaded, -1 if the cycle exists
+        locally or 0 if it is not available.
+        """
+        self.initialize_run(watershed, subbasin, date_string)
+        resource_info = self.get_resource_info()
+        if resource_info and main_extract_directory \
+                and os.path.exists(main_extract_directory):
+            extract_directory = os.path.join(
+                main_extract_directory,
+                "{0}-{1}".format(self.watershed, self.subbasin))
+            local_file = "RapidResult_%s_CF.nc" % date_string
+            num_downloaded = self.download_resource_from_info(
+                extract_directory, [resource_info], local_file)
+            if num_downloaded > 0:
+                self.register_cycle(os.path.join(extract_directory,
+                                                 local_file))
+            return num_downloaded
+        return 0
 
     def download_recent_resource(self, watershed, subbasin,
                                  main_extract_directory):
@@ -785,38 +2144,35 @@ class WRFHydroHRRRDatasetManager(CKANDatasetManager):
             today = \
                 today_datetime - datetime.timedelta(seconds=iteration*60*60)
             date_string = today.strftime(self.date_format_string)
-            self.initialize_run(watershed, subbasin, date_string)
-            resource_info = self.get_resource_info()
-            if resource_info and main_extract_directory \
-                    and os.path.exists(main_extract_directory):
-                extract_directory = os.path.join(
-                    main_extract_directory,
-                    "{0}-{1}".format(self.watershed, self.subbasin))
-                download_file = self.download_resource(
-                    extract_directory, "RapidResult_%s_CF.nc" % date_string)
+            download_file = self.download_cycle(watershed, subbasin,
+                                                date_string,
+                                                main_extract_directory)
             iteration += 1
                     
         if not download_file:
             print("Recent resources not found. Skipping ...")
+        return download_file
 
 
 # -----------------------------------------------------------------------------
 # RAPID Input CKAN Dataset Manager Class
 # -----------------------------------------------------------------------------
+@profiled
 class RAPIDInputDatasetManager(CKANDatasetManager):
     """
     This class is used to find and download, zip and upload ECMWFRAPID 
     prediction files from/to a data server
     """
     def __init__(self, engine_url, api_key, model_name, app_instance_id,
-                 owner_org=""):
+                 owner_org="", **kwargs):
         super(RAPIDInputDatasetManager, self).__init__(
               engine_url,
               api_key,
               model_name,
               "RAPID Input Dataset for %s" % model_name,
               'This dataset contians RAPID files for %s' % model_name,
-              owner_org=owner_org)
+              owner_org=owner_org,
+              **kwargs)
         self.app_instance_id = app_instance_id
         self.dataset_name = '%s-rapid-input-%s' % \
                             (self.model_name, self.app_instance_id)
@@ -833,21 +2189,154 @@ class RAPIDInputDatasetManager(CKANDatasetManager):
                                                        self.watershed, 
                                                        self.subbasin)
 
-    def zip_upload_resource(self, source_directory):
+    def get_manifest_name(self, resource_name=None):
+        """
+        Returns the name of the manifest resource for a RAPID input resource
+        """
+        return '%s-manifest' % (resource_name or self.resource_name)
+
+    @staticmethod
+    def _find_resource(resources, resource_name):
+        """
+        Returns the resource with the name from a list of resources or None
+        """
+        for resource in resources:
+            if resource['name'] == resource_name:
+                return resource
+        return None
+
+    def download_manifest(self, resource_name=None, dataset_info=None):
+        """
+        This function downloads the file manifest of a RAPID input resource.
+        The manifest has the base (UTC time of the full upload), the file
+        hashes ({relative_path: sha256}) of the latest version and the
+        names of the delta resources to apply to the base in order.
+        Returns None if there is no manifest.
+        """
+        if dataset_info is None:
+            dataset_info = self.get_dataset_info()
+        if not dataset_info:
+            return None
+        manifest_resource = \
+            self._find_resource(dataset_info['resources'],
+                                self.get_manifest_name(resource_name))
+        if manifest_resource is None:
+            return None
+        local_manifest_file, local_manifest_path = \
+            tempfile.mkstemp(suffix=".json")
+        os.close(local_manifest_file)
+        try:
+            self._download_file(manifest_resource['url'],
+                                local_manifest_path)
+            with open(local_manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except Exception as ex:
+            print("Manifest download failed: {0}".format(ex))
+            return None
+        finally:
+            self._remove_file(local_manifest_path)
+
+    def _upload_manifest(self, source_directory, manifest):
+        """
+        This function uploads the file manifest of the current resource
+        """
+        manifest_name = self.get_manifest_name()
+        manifest_path = os.path.join(os.path.dirname(source_directory),
+                                     "%s.json" % manifest_name)
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        try:
+            return self.upload_resource(
+                manifest_path, True, 'json', resource_name=manifest_name,
+                extras={'rapid_resource_type': 'manifest'})
+        finally:
+            os.remove(manifest_path)
+
+    def _delete_delta_resources(self):
+        """
+        This function removes the delta resources of the current resource
+        """
+        dataset_info = self.get_dataset_info()
+        if not dataset_info:
+            return
+        delta_prefix = '%s-delta-' % self.resource_name
+        for resource in dataset_info['resources']:
+            if resource['name'].startswith(delta_prefix):
+                print("Removing old delta {0}".format(resource['name']))
+                self.dataset_engine.delete_resource(resource['id'])
+                self._delete_from_storage([resource['url']])
+
+    def zip_upload_resource(self, source_directory, incremental=False):
         """
         This function adds RAPID files in to zip files and
-        uploads files to data store
+        uploads files to data store.
+
+        Manifests and deltas are only used in incremental mode: only the
+        files that changed since the uploaded manifest are uploaded as a
+        delta resource (with a list of the deleted files) and the manifest
+        is updated. Without a manifest on CKAN the full resource is
+        replaced, the old deltas are removed and a manifest with the file
+        hashes is uploaded.
         """
         # get info for waterhseds
         basin_name_search = re.compile(r'rapid_namelist_(\w+).dat')
         namelist_files = glob(os.path.join(source_directory,
                                            'rapid_namelist_*.dat'))
-        if namelist_files:
-            subbasin = basin_name_search.search(namelist_files[0]).group(1)
-            watershed = os.path.basename(source_directory)
-         
-            self.initialize_run(watershed, subbasin)
-            self.zip_upload_directory(source_directory)
+        if not namelist_files:
+            return None
+        subbasin = basin_name_search.search(namelist_files[0]).group(1)
+        watershed = os.path.basename(source_directory)
+
+        self.initialize_run(watershed, subbasin)
+        if not incremental:
+            return self.zip_upload_directory(source_directory)
+
+        local_files = build_manifest(source_directory)
+        manifest = self.download_manifest()
+        if manifest is None:
+            resource_info = self.zip_upload_directory(source_directory,
+                                                      overwrite=True)
+            if resource_info is None or not resource_info['success']:
+                return resource_info
+            self._delete_delta_resources()
+            # to the second so repeat full uploads on a day differ
+            self._upload_manifest(source_directory,
+                                  {'base': datetime.datetime.utcnow()
+                                                   .strftime("%Y%m%dT%H%M%SZ"),
+                                   'files': local_files,
+                                   'deltas': []})
+            return resource_info
+
+        changed_files, deleted_files = diff_manifests(manifest['files'],
+                                                      local_files)
+        if not changed_files and not deleted_files:
+            print("No changes for watershed: {0} {1}. Skipping ..."
+                  .format(self.watershed, self.subbasin))
+            return None
+
+        print("Uploading delta for watershed: {0} {1} "
+              "({2} changed, {3} deleted)"
+              .format(self.watershed, self.subbasin,
+                      len(changed_files), len(deleted_files)))
+        # unique for every delta of every full upload
+        delta_name = '%s-delta-%s-%d' % (self.resource_name, manifest['base'],
+                                         len(manifest['deltas']) + 1)
+        delta_tar_file = os.path.join(os.path.dirname(source_directory),
+                                      "%s.tar.gz" % delta_name)
+        write_delta_archive(delta_tar_file, source_directory,
+                            changed_files, deleted_files)
+        try:
+            resource_info = self.upload_resource(
+                delta_tar_file, resource_name=delta_name,
+                extras={'rapid_resource_type': 'delta'})
+        finally:
+            os.remove(delta_tar_file)
+        if resource_info is None or not resource_info['success']:
+            return resource_info
+        manifest['files'] = local_files
+        manifest['deltas'].append(delta_name)
+        self._upload_manifest(source_directory, manifest)
+        return resource_info
 
     def download_model_resource(self, resource_info, extract_directory):
         """
@@ -855,7 +2344,8 @@ class RAPIDInputDatasetManager(CKANDatasetManager):
         """
         self.initialize_run(resource_info['watershed'],
                             resource_info['subbasin'])
-        self.download_resource_from_info(extract_directory, [resource_info])
+        return self.download_resource_from_info(extract_directory,
+                                                [resource_info])
 
     def upload_model_resource(self, upload_file, watershed, subbasin):
         """
@@ -867,17 +2357,70 @@ class RAPIDInputDatasetManager(CKANDatasetManager):
                                              'zip')
         os.remove(upload_file)
         return resource_info
-        
-    def sync_dataset(self, extract_directory):
+
+    def apply_deltas(self, local_directory, manifest, dataset_info):
         """
-        This function syncs the dataset with the directory
+        This function downloads the delta resources in the manifest that
+        are not in the local directory yet and applies them in order.
+        Returns False if the local directory has to be downloaded again
+        (other base, missing delta or file hashes that differ from the
+        manifest after applying the deltas).
+        """
+        local_manifest = read_local_manifest(local_directory)
+        if local_manifest is None or \
+                local_manifest.get('base') != manifest['base']:
+            return False
+        applied_deltas = list(local_manifest.get('deltas', []))
+        if applied_deltas != manifest['deltas'][:len(applied_deltas)]:
+            return False
+        for delta_name in manifest['deltas'][len(applied_deltas):]:
+            delta_resource = self._find_resource(dataset_info['resources'],
+                                                 delta_name)
+            if delta_resource is None:
+                print("Delta {0} not found.".format(delta_name))
+                return False
+            print("APPLY DELTA {0}".format(delta_name))
+            delta_tar_file = os.path.join(os.path.dirname(local_directory),
+                                          "%s.tar.gz" % delta_name)
+            try:
+                self._download_file(delta_resource['url'], delta_tar_file)
+                apply_delta_archive(delta_tar_file, local_directory)
+            except Exception as ex:
+                print(ex)
+                return False
+            finally:
+                self._remove_file(delta_tar_file)
+            applied_deltas.append(delta_name)
+            write_local_manifest(local_directory,
+                                 {'base': manifest['base'],
+                                  'deltas': applied_deltas})
+        if len(applied_deltas) > len(local_manifest.get('deltas', [])) and \
+                build_manifest(local_directory) != manifest['files']:
+            print("Files in {0} differ from the manifest."
+                  .format(local_directory))
+            # the directory is not at any version of the manifest
+            self._remove_file(os.path.join(local_directory,
+                                           LOCAL_MANIFEST_FILE))
+            return False
+        write_local_manifest(local_directory, manifest)
+        return True
+
+    def sync_dataset(self, extract_directory, incremental=False):
+        """
+        This function syncs the dataset with the directory.
+
+        In incremental mode local folders that were downloaded from the
+        same full upload only download and apply the new delta resources.
         """
         # Use the json module to load CKAN's response into a dictionary.
         dataset_info = self.get_dataset_info()
         if dataset_info:
-            # get list of resources on CKAN
-            current_ckan_resources = [d for d in dataset_info['resources']
-                                      if 'watershed' in d and 'subbasin' in d]
+            # get list of resources on CKAN (manifests and deltas are
+            # applied to the full resources)
+            current_ckan_resources = \
+                [d for d in dataset_info['resources']
+                 if 'watershed' in d and 'subbasin' in d and
+                 d.get('rapid_resource_type', 'full') == 'full']
 
             # get list of watersheds and subbasins on local instance
             current_local_resources = []
@@ -918,7 +2461,22 @@ class RAPIDInputDatasetManager(CKANDatasetManager):
                           .format(local_resource['watershed'],
                                   local_resource['subbasin']))
                     rmtree(local_directory)
-                elif datetime.datetime.strptime(
+                    continue
+
+                if incremental:
+                    manifest = self.download_manifest(
+                        ckan_resource[0]['name'], dataset_info)
+                    if manifest is not None:
+                        if self.apply_deltas(local_directory, manifest,
+                                             dataset_info):
+                            continue
+                        print("LOCAL OUTDATED DELETE {0} {1}"
+                              .format(local_resource['watershed'],
+                                      local_resource['subbasin']))
+                        rmtree(local_directory)
+                        continue
+
+                if datetime.datetime.strptime(
                         ckan_resource[0]['created'].split(".")[0],
                         "%Y-%m-%dT%H:%M:%S") > date_compare:
                     # 2015-05-12T14:01:08.572338
@@ -933,24 +2491,46 @@ class RAPIDInputDatasetManager(CKANDatasetManager):
                 print("ATTEMPT DOWNLOAD {0} {1}"
                       .format(ckan_resource['watershed'],
                               ckan_resource['subbasin']))
-                self.download_model_resource(
-                    ckan_resource,
+                local_directory = \
                     os.path.join(extract_directory,
                                  "%s-%s" % (ckan_resource['watershed'],
-                                            ckan_resource['subbasin'])))
+                                            ckan_resource['subbasin']))
+                num_downloaded = self.download_model_resource(ckan_resource,
+                                                              local_directory)
+                if num_downloaded > 0:
+                    # a full download is at the base of the manifest and
+                    # the deltas uploaded since are applied on top of it
+                    manifest = self.download_manifest(ckan_resource['name'],
+                                                      dataset_info)
+                    if manifest is not None:
+                        write_local_manifest(local_directory,
+                                             {'base': manifest['base'],
+                                              'deltas': []})
+                        self.apply_deltas(local_directory, manifest,
+                                          dataset_info)
 
 
 # -----------------------------------------------------------------------------
 # Main GeoServer Dataset Manager Class
 # -----------------------------------------------------------------------------
+@profiled
 class GeoServerDatasetManager(object):
     """
     This class is used to upload files to a GeoServer and remove files 
     from a geoserver for the Streamflow Prediction Tool
     """
-    def __init__(self, engine_url, username, password, app_instance_id):
+    def __init__(self, engine_url, username, password, app_instance_id,
+                 profiler=None, catalog_ttl=None):
         """
         Initialize and validate the GeoServer credentials
+
+        profiler (profiling.OperationProfiler or True) writes a profile of
+        each public operation (see CKANDatasetManager).
+
+        catalog_ttl (seconds) keeps a snapshot of the names in the
+        workspace (geoserver_catalog.GeoServerCatalogSnapshot) refreshed
+        after catalog_ttl seconds, so the workspace is only created if it
+        is missing and deletes of objects that do not exist are skipped.
         """
         if engine_url.endswith('/'):
             engine_url = engine_url[:-1]
@@ -967,15 +2547,47 @@ class GeoServerDatasetManager(object):
             raise Exception("Invalid geoserver API endpoint.")
             
         self.engine_url = engine_url
+        self.profiler = get_profiler(profiler)
+        from tethys_dataset_services.engines import \
+            GeoServerSpatialDatasetEngine
         self.dataset_engine = \
             GeoServerSpatialDatasetEngine(endpoint=engine_url,
                                           username=username,
                                           password=password)
         self.dataset_engine.validate()
         self.resource_workspace = 'spt-%s' % app_instance_id
-        self.dataset_engine.create_workspace(
-            workspace_id=self.resource_workspace,
-            uri=app_instance_id)
+        self.catalog = None
+        if catalog_ttl is not None:
+            self.catalog = GeoServerCatalogSnapshot(self.dataset_engine,
+                                                    self.resource_workspace,
+                                                    catalog_ttl)
+        if self.catalog is None or not self.catalog.workspace_exists():
+            self.dataset_engine.create_workspace(
+                workspace_id=self.resource_workspace,
+                uri=app_instance_id)
+            if self.catalog is not None:
+                self.catalog.set_workspace_exists()
+
+    def exists_in_catalog(self, kind, identifier):
+        """
+        False if the catalog snapshot (if there is one) knows that the
+        layers, resources, stores or layer_groups object does not exist
+        """
+        if self.catalog is None:
+            return True
+        return self.catalog.exists(kind, identifier)
+
+    def _update_catalog(self, identifier, exists, kinds=CATALOG_KINDS):
+        """
+        Records our own write of an object in the catalog snapshot
+        """
+        if self.catalog is None:
+            return
+        for kind in kinds:
+            if exists:
+                self.catalog.add(kind, identifier)
+            else:
+                self.catalog.remove(kind, identifier)
 
     @staticmethod
     def check_shapefile_input_files(shp_files):
@@ -1067,30 +2679,44 @@ class GeoServerDatasetManager(object):
         if not result['success']:
             print(result['error'])
             return None, None
+        # the store, resource and layer are named after the resource
+        self._update_catalog(layer_name, True,
+                             ('layers', 'resources', 'stores'))
         return layer_name, result['result']
         
     def purge_remove_geoserver_layer(self, layer_id):
         """
         completely remove geoserver layer
         """
+        if not any(self.exists_in_catalog(kind, layer_id)
+                   for kind in ('layers', 'resources', 'stores')):
+            print("Layer {0} not found. Skipping ...".format(layer_id))
+            return
+
         def delete_old_layer(a_layer_id):
             """
             Deletes old layer in geoserver
             """
             # delete old layer
             print("Deleting old geoserver layer ...")
-            layer_result = self.dataset_engine.delete_layer(a_layer_id)
-            if layer_result:
-                if not layer_result['success']:
-                    print(layer_result)
-            resource_result = self.dataset_engine.delete_resource(a_layer_id)
-            if resource_result:
-                if not resource_result['success']:
-                    print(resource_result)
-            store_result = self.dataset_engine.delete_store(a_layer_id)
-            if store_result:
-                if not store_result['success']:
-                    print(store_result)
+            if self.exists_in_catalog('layers', a_layer_id):
+                layer_result = self.dataset_engine.delete_layer(a_layer_id)
+                if layer_result:
+                    if not layer_result['success']:
+                        print(layer_result)
+            if self.exists_in_catalog('resources', a_layer_id):
+                resource_result = \
+                    self.dataset_engine.delete_resource(a_layer_id)
+                if resource_result:
+                    if not resource_result['success']:
+                        print(resource_result)
+            if self.exists_in_catalog('stores', a_layer_id):
+                store_result = self.dataset_engine.delete_store(a_layer_id)
+                if store_result:
+                    if not store_result['success']:
+                        print(store_result)
+            self._update_catalog(a_layer_id, False,
+                                 ('layers', 'resources', 'stores'))
 
         delete_old_layer(layer_id)
         print("Uploading empty file (becuase it does not delete on disk)")
@@ -1108,9 +2734,14 @@ class GeoServerDatasetManager(object):
         """
         completely remove geoserver layer group and all assocated layers
         """
+        if not self.exists_in_catalog('layer_groups', layer_group_id):
+            print("Layer group {0} not found. Skipping ..."
+                  .format(layer_group_id))
+            return
         layer_group_info = self.dataset_engine.get_layer_group(layer_group_id)
         if layer_group_info['success']: 
             self.dataset_engine.delete_layer_group(layer_group_id)
+            self._update_catalog(layer_group_id, False, ('layer_groups',))
             for layer in layer_group_info['result']['layers']:
                 self.purge_remove_geoserver_layer(self.get_layer_name(layer))
 
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""delta.py
+    spt_dataset_manager
+
+    File manifests and delta archives used for incremental RAPID input
+    uploads and downloads.
+
+    License: BSD-3 Clause
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+# name of the file in a delta archive listing the deleted files
+DELTA_INFO_FILE = "_rapid_delta.json"
+# name of the file in a local folder with the manifest it matches
+LOCAL_MANIFEST_FILE = ".rapid_manifest.json"
+
+
+def hash_file(file_path, block_size=1048576):
+    """
+    Returns the SHA-256 hex digest of a file
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as hash_input:
+        for block in iter(lambda: hash_input.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def build_manifest(directory):
+    """
+    Returns {relative_path: sha256} for all files in the directory
+    (relative paths use '/')
+    """
+    manifest = {}
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if file_name in (LOCAL_MANIFEST_FILE, DELTA_INFO_FILE):
+                continue
+            file_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(file_path, directory)\
+                              .replace(os.sep, '/')
+            manifest[relative_path] = hash_file(file_path)
+    return manifest
+
+
+def diff_manifests(old_files, new_files):
+    """
+    Returns the sorted lists of changed (or added) and deleted files
+    """
+    changed_files = sorted(relative_path for relative_path, file_hash
+                           in new_files.items()
+                           if old_files.get(relative_path) != file_hash)
+    deleted_files = sorted(relative_path for relative_path in old_files
+                           if relative_path not in new_files)
+    return changed_files, deleted_files
+
+
+def write_delta_archive(output_tar_file, directory, changed_files,
+                        deleted_files):
+    """
+    Packages the changed files and the list of deleted files into
+    a tar.gz file
+    """
+    with tarfile.open(output_tar_file, "w:gz") as tar:
+        for relative_path in changed_files:
+            tar.add(os.path.join(directory, *relative_path.split('/')),
+                    arcname=relative_path)
+        delta_info = json.dumps({'deleted': deleted_files}).encode("utf-8")
+        delta_info_tar = tarfile.TarInfo(DELTA_INFO_FILE)
+        delta_info_tar.size = len(delta_info)
+        tar.addfile(delta_info_tar, io.BytesIO(delta_info))
+    return output_tar_file
+
+
+def apply_delta_archive(archive_path, directory):
+    """
+    Extracts a delta archive over the directory and removes the files
+    it lists as deleted
+    """
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(directory)
+    delta_info_path = os.path.join(directory, DELTA_INFO_FILE)
+    with open(delta_info_path) as delta_info_file:
+        delta_info = json.load(delta_info_file)
+    os.remove(delta_info_path)
+    for relative_path in delta_info['deleted']:
+        try:
+            os.remove(os.path.join(directory, *relative_path.split('/')))
+        except OSError:
+            pass
+
+
+def read_local_manifest(directory):
+    """
+    Returns the manifest the local directory was synced to or None
+    """
+    try:
+        with open(os.path.join(directory, LOCAL_MANIFEST_FILE)) \
+                as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_local_manifest(directory, manifest):
+    """
+    Records the manifest the local directory was synced to
+    """
+    with open(os.path.join(directory, LOCAL_MANIFEST_FILE), 'w') \
+            as manifest_file:
+        json.dump(manifest, manifest_file)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""discovery.py
+    spt_dataset_manager
+
+    Lazy discovery of the forecast output directories to upload
+    (<source_directory>/<watershed>-<subbasin>/<date_string>/<files>).
+
+    License: BSD-3 Clause
+"""
+from collections import namedtuple
+import datetime
+import json
+import os
+
+try:
+    from os import scandir
+except ImportError:  # Python 2
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+UploadWorkItem = namedtuple('UploadWorkItem',
+                            ['watershed', 'subbasin', 'date_string', 'date',
+                             'directory', 'files'])
+
+
+def iter_directory(directory):
+    """
+    Yields the (name, path, is_directory) of the entries in a directory
+    without a stat call per entry where the file system reports the type
+    """
+    if scandir is None:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            yield name, path, os.path.isdir(path)
+        return
+    for entry in scandir(directory):
+        try:
+            is_directory = entry.is_dir()
+        except OSError:
+            continue
+        yield entry.name, entry.path, is_directory
+
+
+def discover_upload_work(source_directory, parse_date, watersheds=None,
+                         start_date=None, end_date=None, newer_than=None):
+    """
+    Yields an UploadWorkItem for each date directory to upload as it is
+    found. Watershed folders (<watershed>-<subbasin>) not in watersheds
+    (a list of (watershed, subbasin)) and date directories outside of
+    [start_date, end_date] or not after the watershed's date in
+    newer_than ({(watershed, subbasin): date}) are skipped without being
+    listed. parse_date turns a date directory name into a datetime
+    (directories it raises a ValueError for are skipped).
+    """
+    if watersheds is not None:
+        watersheds = set((watershed.lower(), subbasin.lower())
+                         for watershed, subbasin in watersheds)
+    for folder_name, watershed_directory, is_directory in \
+            iter_directory(source_directory):
+        folder_split = folder_name.lower().split("-")
+        if not is_directory or len(folder_split) < 2:
+            continue
+        watershed, subbasin = folder_split[0], folder_split[1]
+        if watersheds is not None and (watershed, subbasin) not in watersheds:
+            continue
+        watershed_newer_than = (newer_than or {}).get((watershed, subbasin))
+        for date_string, date_directory, is_directory in \
+                iter_directory(watershed_directory):
+            if not is_directory:
+                continue
+            try:
+                date = parse_date(date_string)
+            except ValueError:
+                continue
+            if (start_date is not None and date < start_date) or \
+                    (end_date is not None and date > end_date) or \
+                    (watershed_newer_than is not None and
+                     date <= watershed_newer_than):
+                continue
+            yield UploadWorkItem(watershed, subbasin, date_string, date,
+                                 date_directory,
+                                 sorted(path for _, path, is_directory
+                                        in iter_directory(date_directory)
+                                        if not is_directory))
+
+
+class UploadWatermark(object):
+    """
+    Stores the date of the newest cycle of each watershed uploaded by the
+    last successful run in a JSON file so the next run only visits newer
+    cycles
+    """
+    DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+    def __init__(self, watermark_file):
+        self.watermark_file = watermark_file
+
+    def load(self):
+        """
+        Returns the watermark dates as {(watershed, subbasin): date}
+        """
+        try:
+            with open(self.watermark_file) as watermark_file:
+                watermark_dates = json.load(watermark_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        return dict((tuple(folder_name.split("-", 1)),
+                     datetime.datetime.strptime(date_string,
+                                                self.DATE_FORMAT))
+                    for folder_name, date_string in watermark_dates.items())
+
+    def save(self, newest_dates):
+        """
+        Moves the watermark forward to the newest dates
+        ({(watershed, subbasin): date})
+        """
+        watermark_dates = self.load()
+        for watershed_subbasin, newest_date in newest_dates.items():
+            if newest_date > watermark_dates.get(watershed_subbasin,
+                                                 newest_date.min):
+                watermark_dates[watershed_subbasin] = newest_date
+        with open("%s.tmp" % self.watermark_file, 'w') as watermark_file:
+            json.dump(dict(("%s-%s" % watershed_subbasin,
+                            date.strftime(self.DATE_FORMAT))
+                           for watershed_subbasin, date
+                           in watermark_dates.items()),
+                      watermark_file)
+        os.rename("%s.tmp" % self.watermark_file, self.watermark_file)
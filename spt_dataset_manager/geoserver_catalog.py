@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""geoserver_catalog.py
+    spt_dataset_manager
+
+    Local snapshot of the names in a GeoServer workspace so existence
+    checks do not need a REST call each.
+
+    License: BSD-3 Clause
+"""
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+# kinds of catalog objects in the snapshot
+CATALOG_KINDS = ('layers', 'resources', 'stores', 'layer_groups')
+
+
+class GeoServerCatalogSnapshot(object):
+    """
+    The names of the layers, resources, stores and layer groups of a
+    workspace, fetched with one bulk list call per kind and refetched
+    ttl seconds later. The manager adds and removes the names it writes,
+    so the snapshot stays current between refreshes.
+
+    exists(kind, identifier) is only False for objects of the workspace
+    missing from the snapshot and workspace_exists() is only True for a
+    workspace in the snapshot. If a list call fails, both fall back to
+    the REST calls (exists is True and workspace_exists is False).
+    """
+    def __init__(self, dataset_engine, workspace, ttl=300):
+        self.dataset_engine = dataset_engine
+        self.workspace = workspace
+        self.ttl = ttl
+        self._names = None
+        self._workspace_exists = None
+        self._fetched_time = None
+        self._lock = threading.Lock()
+
+    def _get_name(self, identifier):
+        """
+        Returns the name of a "workspace:name" identifier in the
+        workspace or None for other workspaces (plain names are in the
+        default workspace of the server)
+        """
+        if ":" not in identifier:
+            return None
+        workspace, name = identifier.split(":", 1)
+        if workspace != self.workspace:
+            return None
+        return name
+
+    @staticmethod
+    def _list_names(response_dict):
+        if not response_dict or not response_dict.get('success'):
+            raise IOError("GeoServer list failed: {0}"
+                          .format((response_dict or {}).get('error')))
+        return response_dict['result']
+
+    def refresh(self):
+        """
+        Fetches the names in the workspace
+        """
+        with self._lock:
+            self._fetched_time = _clock()
+            try:
+                workspace_names = self._list_names(
+                    self.dataset_engine.list_workspaces())
+                self._workspace_exists = self.workspace in workspace_names
+                if not self._workspace_exists:
+                    self._names = dict((kind, set())
+                                       for kind in CATALOG_KINDS)
+                    return
+                layer_prefix = "{0}:".format(self.workspace)
+                names = {
+                    'layers': set(
+                        layer_name[len(layer_prefix):] for layer_name in
+                        self._list_names(self.dataset_engine.list_layers())
+                        if layer_name.startswith(layer_prefix)),
+                    'resources': set(self._list_names(
+                        self.dataset_engine.list_resources(
+                            workspace=self.workspace))),
+                    'stores': set(self._list_names(
+                        self.dataset_engine.list_stores(
+                            workspace=self.workspace))),
+                    # only the groups of the workspace
+                    'layer_groups': set(
+                        layer_group.name for layer_group in
+                        self.dataset_engine.catalog.get_layergroups(
+                            workspaces=[self.workspace])),
+                }
+            except Exception as ex:
+                print("GeoServer catalog snapshot failed: {0}".format(ex))
+                self._names = None
+                self._workspace_exists = None
+                return
+            self._names = names
+
+    def invalidate(self):
+        """
+        Refetches the names on the next check
+        """
+        with self._lock:
+            self._fetched_time = None
+
+    def _get_names(self):
+        if self._fetched_time is None or \
+                _clock() - self._fetched_time > self.ttl:
+            self.refresh()
+        return self._names
+
+    def workspace_exists(self):
+        """
+        True if the workspace is known to exist (False if the snapshot
+        failed, so the workspace is created)
+        """
+        self._get_names()
+        return self._workspace_exists is True
+
+    def exists(self, kind, identifier):
+        """
+        False if the object of the kind (layers, resources, stores or
+        layer_groups) with the identifier is known not to exist
+        """
+        name = self._get_name(identifier)
+        names = self._get_names()
+        if name is None or names is None:
+            return True
+        with self._lock:
+            return name in names[kind]
+
+    def add(self, kind, identifier):
+        """
+        Records an object created in the workspace
+        """
+        name = self._get_name(identifier)
+        with self._lock:
+            if name is not None and self._names is not None:
+                self._names[kind].add(name)
+
+    def remove(self, kind, identifier):
+        """
+        Records an object deleted from the workspace
+        """
+        name = self._get_name(identifier)
+        with self._lock:
+            if name is not None and self._names is not None:
+                self._names[kind].discard(name)
+
+    def set_workspace_exists(self):
+        """
+        Records that the workspace was created
+        """
+        with self._lock:
+            if self._names is not None:
+                self._workspace_exists = True
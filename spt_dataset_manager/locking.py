@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""locking.py
+    spt_dataset_manager
+
+    Lock files to coordinate processes (and threads) that share
+    directories on the same host.
+
+    License: BSD-3 Clause
+"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# name of the directory with the lock files next to the locked paths
+LOCK_DIRECTORY = ".locks"
+
+
+def get_lock_path(path):
+    """
+    Returns the lock file of a file or directory. The lock files are kept
+    in a directory next to it, so they are never written into the
+    directory that is locked.
+    """
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), LOCK_DIRECTORY,
+                        "%s.lock" % os.path.basename(path))
+
+
+class FileLock(object):
+    """
+    Exclusive (or shared) lock held on a lock file. Each FileLock opens
+    the file itself so separate threads in one process exclude each other
+    as well. Shared locks are exclusive on Windows.
+
+    The holder of an exclusive lock can remove the lock file when it
+    releases the lock; callers that were waiting on the removed file
+    notice it and lock the new one.
+    """
+    def __init__(self, lock_path, shared=False):
+        self.lock_path = lock_path
+        self.shared = shared
+        self._lock_file = None
+
+    def _is_current(self, lock_file):
+        """
+        True if the locked file is still the file at the lock path
+        """
+        try:
+            path_stat = os.stat(self.lock_path)
+        except OSError:
+            return False
+        file_stat = os.fstat(lock_file.fileno())
+        return (path_stat.st_dev, path_stat.st_ino) == \
+            (file_stat.st_dev, file_stat.st_ino)
+
+    def acquire(self, blocking=True):
+        """
+        Acquires the lock. Returns False if blocking is False and the lock
+        is held elsewhere.
+        """
+        lock_directory = os.path.dirname(self.lock_path)
+        if lock_directory and not os.path.exists(lock_directory):
+            try:
+                os.makedirs(lock_directory)
+            except OSError:
+                pass
+        while True:
+            lock_file = open(self.lock_path, 'a+')
+            try:
+                if fcntl is not None:
+                    flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+                    if not blocking:
+                        flags |= fcntl.LOCK_NB
+                    fcntl.flock(lock_file.fileno(), flags)
+                else:
+                    lock_file.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(lock_file.fileno(),
+                                           msvcrt.LK_NBLCK, 1)
+                            break
+                        except (IOError, OSError):
+                            if not blocking:
+                                raise
+                            time.sleep(0.1)
+            except (IOError, OSError):
+                lock_file.close()
+                if blocking:
+                    raise
+                return False
+            # open files cannot be removed on Windows
+            if fcntl is None or self._is_current(lock_file):
+                break
+            # the previous holder removed the lock file
+            lock_file.close()
+        self._lock_file = lock_file
+        return True
+
+    def release(self, remove=False):
+        """
+        Releases the lock. With remove the lock file is deleted first
+        (only for exclusive locks, which no one else holds).
+        """
+        if self._lock_file is None:
+            return
+        try:
+            if remove and not self.shared and fcntl is not None:
+                try:
+                    os.remove(self.lock_path)
+                except OSError:
+                    pass
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._lock_file.seek(0)
+                msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def locked(self):
+        """
+        True if this instance holds the lock
+        """
+        return self._lock_file is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+        return False
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""notifications.py
+    spt_dataset_manager
+
+    Push notifications for complete forecast cycles. The upload managers
+    send a cycle complete event to their sinks (webhook, Unix socket or
+    file queue) and a CycleListener starts the download as soon as the
+    event arrives instead of polling CKAN.
+
+    License: BSD-3 Clause
+"""
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import datetime
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import (StreamRequestHandler, ThreadingMixIn,
+                              UnixStreamServer)
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import (StreamRequestHandler, ThreadingMixIn,
+                              UnixStreamServer)
+
+CYCLE_COMPLETE_EVENT = 'cycle_complete'
+
+# numbers the queue files written by this process
+_queue_file_counter = itertools.count()
+
+
+def create_cycle_complete_event(model_name, watershed, subbasin,
+                                date_string, dataset_name, num_resources):
+    """
+    Returns the event announcing that all of the resources of a forecast
+    cycle are uploaded
+    """
+    return {
+        'event': CYCLE_COMPLETE_EVENT,
+        'model': model_name,
+        'watershed': watershed,
+        'subbasin': subbasin,
+        'date_string': date_string,
+        'dataset_name': dataset_name,
+        'num_resources': num_resources,
+        'published': datetime.datetime.utcnow()
+                             .strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+
+# -----------------------------------------------------------------------------
+# Sinks
+# -----------------------------------------------------------------------------
+class WebhookSink(object):
+    """
+    POSTs the events as JSON to a URL
+    """
+    def __init__(self, url, headers=None, timeout=10, session=None):
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.session = session
+
+    def send(self, event):
+        """
+        Sends the event and raises an exception if it was not accepted
+        """
+        if self.session is not None:
+            post = self.session.post
+        else:
+            from requests import post
+        r = post(self.url, json=event, headers=self.headers,
+                 timeout=self.timeout)
+        r.raise_for_status()
+
+
+class UnixSocketSink(object):
+    """
+    Writes the events as lines of JSON to a Unix stream socket (e.g. a
+    CycleListener on the same host)
+    """
+    def __init__(self, socket_path, timeout=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def send(self, event):
+        """
+        Sends the event
+        """
+        event_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            event_socket.settimeout(self.timeout)
+            event_socket.connect(self.socket_path)
+            event_socket.sendall((json.dumps(event) + "\n").encode('utf-8'))
+        finally:
+            event_socket.close()
+
+
+class FileQueueSink(object):
+    """
+    Writes each event to a JSON file in a queue directory (e.g. on a
+    shared file system) that consumers process in order with
+    CycleListener.process_file_queue
+    """
+    def __init__(self, queue_directory):
+        self.queue_directory = queue_directory
+        try:
+            os.makedirs(queue_directory)
+        except OSError:
+            pass
+
+    def send(self, event):
+        """
+        Adds the event to the queue
+        """
+        event_path = os.path.join(
+            self.queue_directory,
+            "{0:.6f}-{1}-{2}.json".format(time.time(), os.getpid(),
+                                          next(_queue_file_counter)))
+        with open("%s.tmp" % event_path, 'w') as event_file:
+            json.dump(event, event_file)
+        # atomic so consumers never read a partial event
+        os.rename("%s.tmp" % event_path, event_path)
+
+
+# -----------------------------------------------------------------------------
+# Listener
+# -----------------------------------------------------------------------------
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class CycleListener(object):
+    """
+    Downloads the cycles announced by cycle complete events with the
+    manager's download_cycle (ECMWFRAPIDDatasetManager or
+    WRFHydroHRRRDatasetManager, copied for each download).
+
+    Events for other models or (watershed, subbasin) pairs not in
+    watersheds are ignored. Events received with serve_webhook or
+    serve_unix_socket are downloaded on max_workers threads.
+    """
+    def __init__(self, manager, main_extract_directory, watersheds=None,
+                 max_workers=2):
+        self.manager = copy.copy(manager)
+        self.main_extract_directory = main_extract_directory
+        self.watersheds = None
+        if watersheds is not None:
+            self.watersheds = set((watershed.lower(), subbasin.lower())
+                                  for watershed, subbasin in watersheds)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._servers = []
+
+    def handle_event(self, event):
+        """
+        Downloads the cycle of the event. Returns the result of
+        download_cycle or None if the event is ignored.
+        """
+        if event.get('event') != CYCLE_COMPLETE_EVENT or \
+                event.get('model') != self.manager.model_name:
+            return None
+        watershed_subbasin = (event['watershed'].lower(),
+                              event['subbasin'].lower())
+        if self.watersheds is not None and \
+                watershed_subbasin not in self.watersheds:
+            return None
+        try:
+            os.makedirs(self.main_extract_directory)
+        except OSError:
+            pass
+        return copy.copy(self.manager).download_cycle(
+            watershed_subbasin[0], watershed_subbasin[1],
+            event['date_string'], self.main_extract_directory)
+
+    def submit_event(self, event):
+        """
+        Downloads the cycle of the event in the background and returns
+        the future
+        """
+        def handle():
+            try:
+                return self.handle_event(event)
+            except Exception as ex:
+                print("Download for event {0} failed: {1}".format(event, ex))
+        return self.executor.submit(handle)
+
+    def process_file_queue(self, queue_directory):
+        """
+        Downloads the cycles of the events in a FileQueueSink directory
+        (oldest first) and removes the events. Returns the (event, result)
+        of each event.
+        """
+        results = []
+        for file_name in sorted(os.listdir(queue_directory)):
+            if not file_name.endswith(".json"):
+                continue
+            event_path = os.path.join(queue_directory, file_name)
+            try:
+                with open(event_path) as event_file:
+                    event = json.load(event_file)
+            except (IOError, OSError, ValueError) as ex:
+                print("Invalid event {0}: {1}".format(file_name, ex))
+                continue
+            results.append((event, self.handle_event(event)))
+            try:
+                os.remove(event_path)
+            except OSError:
+                pass
+        return results
+
+    def _start_server(self, server):
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self._servers.append(server)
+        return server
+
+    def serve_webhook(self, host='', port=8080):
+        """
+        Receives the events of WebhookSinks on an HTTP server in a
+        background thread and returns the server
+        """
+        listener = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                content_length = int(self.headers.get('Content-Length', 0))
+                try:
+                    event = json.loads(self.rfile.read(content_length)
+                                       .decode('utf-8'))
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                listener.submit_event(event)
+                self.send_response(202)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return self._start_server(_ThreadingHTTPServer((host, port),
+                                                       WebhookHandler))
+
+    def serve_unix_socket(self, socket_path):
+        """
+        Receives the events of UnixSocketSinks on a Unix socket in a
+        background thread and returns the server
+        """
+        listener = self
+
+        class EventHandler(StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        event = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    listener.submit_event(event)
+
+        if os.path.exists(socket_path):
+            # left behind by a listener that did not shut down
+            os.remove(socket_path)
+        return self._start_server(_ThreadingUnixStreamServer(socket_path,
+                                                             EventHandler))
+
+    def stop(self):
+        """
+        Stops the servers and waits for the running downloads
+        """
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+            if isinstance(server, UnixStreamServer):
+                try:
+                    os.remove(server.server_address)
+                except OSError:
+                    pass
+        self._servers = []
+        self.executor.shutdown()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""partitioning.py
+    spt_dataset_manager
+
+    Strategies grouping the forecast cycles of a watershed into CKAN
+    datasets named <model>-<watershed>-<subbasin>-<partition key>. Fewer,
+    larger datasets keep the search index small.
+
+    License: BSD-3 Clause
+"""
+import datetime
+
+
+def _get_next_month(start):
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+# partition key formats with the end of a partition from its start,
+# tried in order when a dataset name is parsed
+_PARTITION_KEY_FORMATS = (
+    # one ECMWF cycle
+    ("%Y%m%dt%H", lambda start: start),
+    ("%Y%m%d", lambda start: start + datetime.timedelta(days=1)),
+    ("%Y%m", _get_next_month),
+)
+
+# key formats of the partitionings grouping several cycles
+PARTITIONINGS = {
+    'day': "%Y%m%d",
+    'month': "%Y%m",
+}
+
+
+def parse_partition_key(partition_key):
+    """
+    Returns the (start, end) dates of the partition with the key (the
+    last part of a dataset name) of any strategy, so datasets created
+    before the strategy changed are still understood. Raises a
+    ValueError for unknown keys.
+    """
+    for key_format, get_end in _PARTITION_KEY_FORMATS:
+        try:
+            start = datetime.datetime.strptime(partition_key, key_format)
+        except ValueError:
+            continue
+        # strptime also accepts unpadded numbers (201512 as 2015-1-2)
+        if start.strftime(key_format) == partition_key:
+            return start, get_end(start)
+    raise ValueError("Invalid partition key '{0}'".format(partition_key))
+
+
+class DatasetPartitioning(object):
+    """
+    Names the dataset of a forecast date with date.strftime(key_format).
+
+    Custom strategies need get_partition_key(date),
+    get_partition_range(partition_key) returning the (start, end) dates of
+    a partition (datasets ending before a date only hold older cycles) and
+    groups_cycles.
+    """
+    def __init__(self, name, key_format):
+        self.name = name
+        self.key_format = key_format
+
+    def get_partition_key(self, date):
+        """
+        Returns the last part of the name of the dataset of the date
+        """
+        return date.strftime(self.key_format)
+
+    def get_partition_range(self, partition_key):
+        """
+        Returns the (start, end) dates of the partition with the key
+        """
+        return parse_partition_key(partition_key)
+
+    @property
+    def groups_cycles(self):
+        """
+        True if the datasets hold several forecast cycles
+        """
+        return self.name != 'cycle'
+
+
+def get_partitioning(partitioning, cycle_key_format):
+    """
+    Returns the strategy for the partitioning argument of a manager:
+    "cycle" (or None) for the model's own dataset per cycle
+    (cycle_key_format), "day", "month" or a DatasetPartitioning
+    """
+    if partitioning is None or partitioning == 'cycle':
+        return DatasetPartitioning('cycle', cycle_key_format)
+    if partitioning in PARTITIONINGS:
+        return DatasetPartitioning(partitioning, PARTITIONINGS[partitioning])
+    if hasattr(partitioning, 'get_partition_key'):
+        return partitioning
+    raise ValueError("Invalid partitioning '{0}'. Valid partitionings: "
+                     "cycle, day, month".format(partitioning))
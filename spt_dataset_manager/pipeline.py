@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""pipeline.py
+    spt_dataset_manager
+
+    Two stage producer/consumer pipeline used to compress the next file
+    while the previous one uploads.
+
+    License: BSD-3 Clause
+"""
+import threading
+
+try:
+    from queue import Queue, Full
+except ImportError:  # Python 2
+    from Queue import Queue, Full
+
+_END_OF_ITEMS = object()
+
+
+def run_pipeline(items, produce, consume, queue_depth=2):
+    """
+    Runs produce(item) for each item in a background thread and
+    consume(item, product) in the calling thread, in order. At most
+    queue_depth products wait between the stages, which bounds the
+    scratch disk and memory used by the producer.
+
+    If produce raises for an item, consume is skipped for it and the
+    error is printed. Returns the list of consume results.
+    """
+    product_queue = Queue(maxsize=max(1, queue_depth))
+    stop_event = threading.Event()
+
+    def put(entry):
+        # give up when the consumer stopped so the thread can exit
+        while not stop_event.is_set():
+            try:
+                product_queue.put(entry, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    def producer():
+        for item in items:
+            try:
+                entry = (item, produce(item), None)
+            except Exception as ex:
+                entry = (item, None, ex)
+            if not put(entry):
+                return
+        put((_END_OF_ITEMS, None, None))
+
+    producer_thread = threading.Thread(target=producer)
+    producer_thread.daemon = True
+    producer_thread.start()
+
+    results = []
+    try:
+        while True:
+            item, product, error = product_queue.get()
+            if item is _END_OF_ITEMS:
+                break
+            if error is not None:
+                print(error)
+                continue
+            results.append(consume(item, product))
+    finally:
+        stop_event.set()
+        producer_thread.join()
+    return results
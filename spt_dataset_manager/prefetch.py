@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""prefetch.py
+    spt_dataset_manager
+
+    Downloads new forecast cycles in the background shortly after they
+    are expected to be published.
+
+    License: BSD-3 Clause
+"""
+import copy
+import datetime
+import os
+import threading
+
+
+class CycleSchedule(object):
+    """
+    The cadence of a model's forecast cycles.
+
+    Cycles start every interval (from midnight UTC) and are expected to be
+    uploaded publication_delay after they start. A cycle is polled every
+    poll_interval after that until it is downloaded or older than
+    give_up_after. format_cycle returns the date_string of a cycle start
+    and format_local_name the name of the downloaded cycle in the
+    watershed folder of the main extract directory (the date_string by
+    default).
+    """
+    def __init__(self, interval, publication_delay, poll_interval,
+                 give_up_after, format_cycle, format_local_name=None):
+        self.interval = interval
+        self.publication_delay = publication_delay
+        self.poll_interval = poll_interval
+        self.give_up_after = give_up_after
+        self.format_cycle = format_cycle
+        self.format_local_name = format_local_name or (lambda date_string:
+                                                       date_string)
+
+    def get_cycle_start(self, time):
+        """
+        Returns the start of the cycle containing the time
+        """
+        midnight = datetime.datetime(time.year, time.month, time.day)
+        interval_seconds = int(self.interval.total_seconds())
+        seconds = int((time - midnight).total_seconds())
+        return midnight + datetime.timedelta(
+            seconds=seconds - seconds % interval_seconds)
+
+    def get_due_cycles(self, now):
+        """
+        Returns the starts of the cycles expected to be published by now
+        that are not too old to poll, newest first
+        """
+        cycle_start = self.get_cycle_start(now - self.publication_delay)
+        due_cycles = []
+        while now - cycle_start <= self.give_up_after:
+            due_cycles.append(cycle_start)
+            cycle_start -= self.interval
+        return due_cycles
+
+    def get_next_publication(self, now):
+        """
+        Returns the time the next cycle is expected to be published
+        """
+        cycle_start = self.get_cycle_start(now - self.publication_delay)
+        return cycle_start + self.interval + self.publication_delay
+
+
+def _format_ecmwf_cycle(cycle_start):
+    return '%s.%s' % (cycle_start.strftime("%Y%m%d"),
+                      '1200' if cycle_start.hour > 11 else '0')
+
+
+# ECMWF forecasts at 00 and 12 UTC, downloaded with
+# ECMWFRAPIDDatasetManager.download_recent_resource
+ECMWF_SCHEDULE = CycleSchedule(
+    interval=datetime.timedelta(hours=12),
+    publication_delay=datetime.timedelta(hours=6),
+    poll_interval=datetime.timedelta(minutes=10),
+    give_up_after=datetime.timedelta(days=1),
+    format_cycle=_format_ecmwf_cycle)
+
+
+def _format_wrf_hydro_local_name(date_string):
+    return "RapidResult_%s_CF.nc" % date_string
+
+
+# hourly WRF-Hydro HRRR forecasts, downloaded with
+# WRFHydroHRRRDatasetManager.download_recent_resource
+WRF_HYDRO_SCHEDULE = CycleSchedule(
+    interval=datetime.timedelta(hours=1),
+    publication_delay=datetime.timedelta(hours=1),
+    poll_interval=datetime.timedelta(minutes=2),
+    give_up_after=datetime.timedelta(hours=6),
+    format_cycle=lambda cycle_start: cycle_start.strftime("%Y%m%dT%H%MZ"),
+    format_local_name=_format_wrf_hydro_local_name)
+
+
+class PrefetchScheduler(object):
+    """
+    Downloads the complete cycles of a model for a set of
+    (watershed, subbasin) pairs as they are published, so reads find
+    them on the local disk.
+
+    The manager (ECMWFRAPIDDatasetManager or WRFHydroHRRRDatasetManager)
+    is copied so the caller can keep using it. Nothing is polled between
+    the download of a cycle and the expected publication of the next one.
+    Cycles already in the main extract directory are not queried on CKAN,
+    so a new scheduler in each run (e.g. from a cron job) skips the
+    cycles downloaded by the previous runs. Use run_pending from a cron
+    job or start/stop for a background thread.
+    """
+    def __init__(self, manager, watersheds, main_extract_directory,
+                 schedule):
+        self.manager = copy.copy(manager)
+        self.watersheds = [(watershed.lower(), subbasin.lower())
+                           for watershed, subbasin in watersheds]
+        self.main_extract_directory = main_extract_directory
+        self.schedule = schedule
+        self._completed = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def is_downloaded(self, watershed, subbasin, date_string):
+        """
+        True if the cycle is in the main extract directory
+        """
+        return os.path.exists(
+            os.path.join(self.main_extract_directory,
+                         "{0}-{1}".format(watershed, subbasin),
+                         self.schedule.format_local_name(date_string)))
+
+    def run_pending(self, now=None):
+        """
+        Polls the due cycles that are not downloaded yet. Returns the
+        (watershed, subbasin, date_string) of the cycles downloaded.
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        due_cycles = [self.schedule.format_cycle(cycle_start)
+                      for cycle_start in self.schedule.get_due_cycles(now)]
+        # forget cycles that are no longer polled
+        self._completed = set(cycle for cycle in self._completed
+                              if cycle[2] in due_cycles)
+        downloaded_cycles = []
+        for watershed, subbasin in self.watersheds:
+            for date_string in due_cycles:
+                cycle = (watershed, subbasin, date_string)
+                if cycle not in self._completed and \
+                        self.is_downloaded(*cycle):
+                    self._completed.add(cycle)
+                if cycle in self._completed:
+                    # older cycles are not needed once a newer one is here
+                    break
+                try:
+                    num_downloaded = self.manager.download_cycle(
+                        watershed, subbasin, date_string,
+                        self.main_extract_directory)
+                except Exception as ex:
+                    print("Prefetch of {0} failed: {1}".format(cycle, ex))
+                    continue
+                if num_downloaded:
+                    self._completed.add(cycle)
+                    if num_downloaded > 0:
+                        downloaded_cycles.append(cycle)
+                    break
+        return downloaded_cycles
+
+    def get_next_run(self, now=None):
+        """
+        Returns the time of the next poll: after the poll interval while
+        a due cycle is missing, otherwise at the next publication
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        newest_cycle = \
+            self.schedule.format_cycle(self.schedule.get_due_cycles(now)[0])
+        if any((watershed, subbasin, newest_cycle) not in self._completed
+               for watershed, subbasin in self.watersheds):
+            return now + self.schedule.poll_interval
+        return self.schedule.get_next_publication(now)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.run_pending()
+            now = datetime.datetime.utcnow()
+            wait_seconds = (self.get_next_run(now) - now).total_seconds()
+            self._stop_event.wait(max(1, wait_seconds))
+
+    def start(self):
+        """
+        Starts prefetching in a background thread
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
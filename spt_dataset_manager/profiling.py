@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""profiling.py
+    spt_dataset_manager
+
+    Opt-in profiling of the manager operations. Set the
+    SPT_DATASET_MANAGER_PROFILE environment variable to a directory (or
+    pass profiler=True or an OperationProfiler to a manager) to write a
+    profile for every public operation.
+
+    License: BSD-3 Clause
+"""
+import functools
+import inspect
+import itertools
+import os
+import threading
+import time
+
+# directory to write profiles to for all managers
+PROFILE_ENVIRONMENT_VARIABLE = 'SPT_DATASET_MANAGER_PROFILE'
+# "cprofile" (default) or "pyinstrument" (sampling)
+PROFILER_ENVIRONMENT_VARIABLE = 'SPT_DATASET_MANAGER_PROFILER'
+
+_clock = getattr(time, 'monotonic', time.time)
+# numbers the profile files of all profilers in the process
+_profile_counter = itertools.count()
+
+
+class OperationProfiler(object):
+    """
+    Profiles operations with cProfile (a .prof file for pstats or
+    snakeviz) or the pyinstrument sampling profiler (a .html file) and
+    writes one file per operation to output_directory. The duration of
+    every operation is also appended to operations.log.
+
+    Only the outermost operation of a thread is profiled, so operations
+    calling other operations are written once. cProfile can only profile
+    one thread at a time on Python 3.12+; other threads then run their
+    operations without a profile.
+    """
+    def __init__(self, output_directory, profiler='cprofile'):
+        if profiler not in ('cprofile', 'pyinstrument'):
+            raise ValueError("Invalid profiler '{0}'. Valid profilers: "
+                             "cprofile, pyinstrument".format(profiler))
+        if profiler == 'pyinstrument':
+            try:
+                import pyinstrument
+            except ImportError:
+                raise ImportError("pyinstrument is required for sampling "
+                                  "profiles. Install it or use cprofile.")
+        self.output_directory = output_directory
+        self.profiler = profiler
+        try:
+            os.makedirs(output_directory)
+        except OSError:
+            pass
+        self._local = threading.local()
+        self._log_lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Returns the profiler configured with the environment variables
+        or None if profiling is not enabled
+        """
+        output_directory = os.environ.get(PROFILE_ENVIRONMENT_VARIABLE)
+        if not output_directory:
+            return None
+        return cls(output_directory,
+                   os.environ.get(PROFILER_ENVIRONMENT_VARIABLE, 'cprofile'))
+
+    def _get_profile_path(self, operation_name, extension):
+        return os.path.join(self.output_directory,
+                            "{0}-{1}-{2}-{3}.{4}"
+                            .format(operation_name,
+                                    time.strftime("%Y%m%dT%H%M%S"),
+                                    os.getpid(), next(_profile_counter),
+                                    extension))
+
+    def _log(self, operation_name, elapsed_seconds, profile_path):
+        with self._log_lock:
+            with open(os.path.join(self.output_directory, "operations.log"),
+                      'a') as log_file:
+                log_file.write("{0}\t{1}\t{2:.3f}\t{3}\n"
+                               .format(time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                       operation_name, elapsed_seconds,
+                                       profile_path or ""))
+
+    def _start(self):
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profile = Profiler()
+            profile.start()
+            return profile
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another thread is being profiled (Python 3.12+)
+            return None
+        return profile
+
+    def _stop(self, profile, operation_name):
+        if self.profiler == 'pyinstrument':
+            profile.stop()
+            profile_path = self._get_profile_path(operation_name, "html")
+            with open(profile_path, 'w') as profile_file:
+                profile_file.write(profile.output_html())
+        else:
+            profile.disable()
+            profile_path = self._get_profile_path(operation_name, "prof")
+            profile.dump_stats(profile_path)
+        return profile_path
+
+    def run(self, operation_name, function, *args, **kwargs):
+        """
+        Calls the function and profiles it if it is the outermost
+        operation of the thread
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+        self._local.depth = 1
+        profile = self._start()
+        start_time = _clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed_seconds = _clock() - start_time
+            profile_path = None
+            try:
+                if profile is not None:
+                    profile_path = self._stop(profile, operation_name)
+                self._log(operation_name, elapsed_seconds, profile_path)
+            except Exception as ex:
+                print("Profile of {0} not written: {1}"
+                      .format(operation_name, ex))
+            self._local.depth = 0
+
+
+def get_profiler(profiler):
+    """
+    Returns the profiler for the profiler argument of a manager: an
+    OperationProfiler, True for the environment variable settings (with
+    a profiles directory in the working directory as default), None to
+    use the environment variables only or False to disable profiling
+    """
+    if profiler is False:
+        return None
+    if profiler is None:
+        return OperationProfiler.from_environment()
+    if profiler is True:
+        return OperationProfiler.from_environment() or \
+            OperationProfiler(os.path.abspath("spt_profiles"))
+    return profiler
+
+
+def _profile_method(operation_name, method):
+    @functools.wraps(method)
+    def profiled_method(self, *args, **kwargs):
+        profiler = self.__dict__.get('profiler')
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        return profiler.run(operation_name, method, self, *args, **kwargs)
+    return profiled_method
+
+
+def profiled(cls):
+    """
+    Class decorator that profiles the public methods defined in the class
+    when the instance has a profiler (one attribute lookup otherwise)
+    """
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(attribute):
+            continue
+        setattr(cls, name,
+                _profile_method("{0}.{1}".format(cls.__name__, name),
+                                attribute))
+    return cls
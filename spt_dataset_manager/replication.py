@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""replication.py
+    spt_dataset_manager
+
+    Replicates uploads to several CKAN endpoints and downloads from the
+    fastest one.
+
+    License: BSD-3 Clause
+"""
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+# manager state copied from the primary manager before each upload
+_UPLOAD_STATE = ('watershed', 'subbasin', 'date_string', 'date',
+                 'dataset_name', 'resource_name')
+
+
+class ReplicatedDatasetManager(object):
+    """
+    Wraps one CKAN dataset manager per endpoint (the first one is the
+    primary) and behaves like a single manager:
+
+    * The zip/upload methods run once on the primary, so archives are
+      built once. The primary's replicator hook sends every
+      upload_resource (register_resources and patch_dataset_extras)
+      call to all of the endpoints concurrently. The outcome per
+      endpoint is kept in upload_status. Failed uploads are journaled
+      per endpoint and retry_pending replays them on their own endpoint.
+    * The CKAN read methods in FASTEST_METHODS run on the endpoint with
+      the lowest measured latency and fail over to the next endpoint on
+      an exception. The lookups in FAILOVER_ON_NONE also fail over when
+      they return None (not found or failed request).
+    * Other methods (e.g. initialize_run) are called on every endpoint.
+    """
+    PRIMARY_PREFIXES = ('zip_upload', 'upload', 'make_',
+                        'patch_dataset_extras', 'register_resources')
+    FASTEST_METHODS = frozenset((
+        'download_cycle',
+        'download_manifest',
+        'download_model_resource',
+        'download_prediction_dataset',
+        'download_prediction_resource',
+        'download_recent_resource',
+        'download_recent_resources',
+        'download_recent_warning_points',
+        'download_resource',
+        'download_resource_from_info',
+        'get_dataset_extras',
+        'get_dataset_id',
+        'get_dataset_info',
+        'get_dataset_summary',
+        'get_resource_info',
+        'get_warning_points_summary',
+        'search_dataset_summaries',
+        'sync_dataset',
+    ))
+    FAILOVER_ON_NONE = frozenset((
+        'get_dataset_extras',
+        'get_dataset_id',
+        'get_dataset_info',
+        'get_dataset_summary',
+        'get_resource_info',
+    ))
+
+    def __init__(self, managers, latency_ttl=300, latency_timeout=10):
+        if not managers:
+            raise ValueError("At least one manager is required.")
+        object.__setattr__(self, 'managers', list(managers))
+        object.__setattr__(self, 'latency_ttl', latency_ttl)
+        object.__setattr__(self, 'latency_timeout', latency_timeout)
+        object.__setattr__(self, 'upload_status',
+                           dict((manager.engine_url,
+                                 {'succeeded': 0, 'skipped': 0, 'failed': 0,
+                                  'last_error': None})
+                                for manager in self.managers))
+        object.__setattr__(self, '_latencies', {})
+        # calls to upload_resource, register_resources and
+        # patch_dataset_extras by the primary's own methods go to every
+        # endpoint
+        self.primary.replicator = self
+
+    @classmethod
+    def from_endpoints(cls, manager_class, endpoints, *args, **kwargs):
+        """
+        Creates a manager of manager_class for each endpoint given as
+        (engine_url, api_key); the other arguments are passed to all
+        """
+        return cls([manager_class(engine_url, api_key, *args, **kwargs)
+                    for engine_url, api_key in endpoints])
+
+    @property
+    def primary(self):
+        """
+        The manager for the first endpoint
+        """
+        return self.managers[0]
+
+    def __copy__(self):
+        managers = [copy.copy(manager) for manager in self.managers]
+        replicated = ReplicatedDatasetManager(managers, self.latency_ttl,
+                                              self.latency_timeout)
+        object.__setattr__(replicated, 'upload_status', self.upload_status)
+        object.__setattr__(replicated, '_latencies', self._latencies)
+        return replicated
+
+    def upload_resource_to_all(self, file_path, overwrite=False,
+                                file_format='tar.gz', resource_name=None,
+                                extras=None):
+        """
+        Uploads the file to all of the endpoints at once and returns the
+        result from the primary endpoint
+        """
+        primary = self.primary
+        if resource_name is None:
+            resource_name = primary.resource_name
+        upload_state = dict((name, getattr(primary, name, None))
+                            for name in _UPLOAD_STATE)
+
+        def upload(manager):
+            for name, value in upload_state.items():
+                setattr(manager, name, value)
+            try:
+                result = manager._upload_resource(file_path, overwrite,
+                                                  file_format, resource_name,
+                                                  extras)
+            except Exception as ex:
+                print("Upload to {0} failed: {1}"
+                      .format(manager.engine_url, ex))
+                manager._record_failed_upload(file_path, overwrite,
+                                              file_format, resource_name, ex,
+                                              extras)
+                return None, ex
+            if result is not None and not result['success']:
+                manager._record_failed_upload(file_path, overwrite,
+                                              file_format, resource_name,
+                                              result.get('error'), extras)
+                return result, result.get('error')
+            return result, None
+
+        with ThreadPoolExecutor(max_workers=len(self.managers)) as executor:
+            results = list(executor.map(upload, self.managers))
+        for manager, (result, error) in zip(self.managers, results):
+            status = self.upload_status[manager.engine_url]
+            if error is not None:
+                status['failed'] += 1
+                status['last_error'] = str(error)
+            elif result is None:
+                status['skipped'] += 1
+            else:
+                status['succeeded'] += 1
+        return results[0][0]
+
+    def register_resources_on_all(self, resources, overwrite=False,
+                                   file_paths=None):
+        """
+        Registers the resources (stored once in the shared storage or
+        uploaded from file_paths) on all of the endpoints at once and
+        returns the result from the primary endpoint. Failed uploads to
+        the other endpoints are added to their retry journals.
+        """
+        primary = self.primary
+        upload_state = dict((name, getattr(primary, name, None))
+                            for name in _UPLOAD_STATE)
+
+        def register(manager):
+            for name, value in upload_state.items():
+                setattr(manager, name, value)
+            try:
+                result = manager._register_resources(resources, overwrite,
+                                                     file_paths)
+                error = None
+                if result is not None and not result['success']:
+                    error = result.get('error')
+            except Exception as ex:
+                print("Registration on {0} failed: {1}"
+                      .format(manager.engine_url, ex))
+                result = None
+                error = ex
+            if error is not None and file_paths is not None and \
+                    manager is not primary:
+                # the caller journals the uploads to the primary
+                for resource, file_path in zip(resources, file_paths):
+                    manager._record_failed_upload(file_path, overwrite,
+                                                  resource['format'],
+                                                  resource['name'], error,
+                                                  resource)
+            return result, error
+
+        with ThreadPoolExecutor(max_workers=len(self.managers)) as executor:
+            results = list(executor.map(register, self.managers))
+        for manager, (result, error) in zip(self.managers, results):
+            status = self.upload_status[manager.engine_url]
+            if error is not None:
+                status['failed'] += len(resources)
+                status['last_error'] = str(error)
+            elif result is None:
+                status['skipped'] += len(resources)
+            else:
+                status['succeeded'] += len(resources)
+        if results[0][1] is not None and results[0][0] is None:
+            raise results[0][1]
+        return results[0][0]
+
+    def patch_dataset_extras_on_all(self, extras):
+        """
+        Updates the dataset metadata on all of the endpoints and returns
+        the result from the primary endpoint
+        """
+        primary = self.primary
+        upload_state = dict((name, getattr(primary, name, None))
+                            for name in _UPLOAD_STATE)
+        results = []
+        for manager in self.managers:
+            for name, value in upload_state.items():
+                setattr(manager, name, value)
+            try:
+                results.append(manager._patch_dataset_extras(extras))
+            except Exception as ex:
+                print("Metadata update on {0} failed: {1}"
+                      .format(manager.engine_url, ex))
+                results.append(None)
+        return results[0]
+
+    def retry_pending(self):
+        """
+        Replays the failed uploads in the retry journal on the endpoints
+        they failed on and returns the names of the resources that
+        succeeded and failed
+        """
+        retry_results = {'succeeded': [], 'failed': []}
+        for manager in self.managers:
+            manager_results = manager.retry_pending()
+            for outcome in ('succeeded', 'failed'):
+                retry_results[outcome] += manager_results[outcome]
+            # the replayed uploads were counted as failed
+            num_replayed = len(manager_results['succeeded'])
+            status = self.upload_status[manager.engine_url]
+            status['succeeded'] += num_replayed
+            status['failed'] = max(0, status['failed'] - num_replayed)
+        return retry_results
+
+    def measure_latency(self, manager):
+        """
+        Measures the round trip time of a lightweight API call
+        """
+        if manager.http_session is not None:
+            get = manager.http_session.get
+        else:
+            from requests import get
+        start_time = _clock()
+        try:
+            r = get('%s/status_show' % manager.engine_url,
+                    timeout=self.latency_timeout)
+            r.raise_for_status()
+            latency = _clock() - start_time
+        except Exception as ex:
+            print("Endpoint {0} unavailable: {1}"
+                  .format(manager.engine_url, ex))
+            latency = float('inf')
+        self._latencies[manager.engine_url] = (latency, _clock())
+        return latency
+
+    def get_managers_by_latency(self):
+        """
+        Returns the managers sorted from the lowest to highest latency,
+        measuring the endpoints that have no recent measurement
+        """
+        now = _clock()
+        for manager in self.managers:
+            measurement = self._latencies.get(manager.engine_url)
+            if measurement is None or now - measurement[1] > self.latency_ttl:
+                self.measure_latency(manager)
+        return sorted(self.managers,
+                      key=lambda manager:
+                      self._latencies[manager.engine_url][0])
+
+    def _call_fastest(self, method_name, *args, **kwargs):
+        """
+        Calls the method on the fastest endpoint and fails over to the
+        next fastest when it raises (or returns None for the methods in
+        FAILOVER_ON_NONE). Raises the last error if all of them raise.
+        """
+        result = None
+        error = None
+        for manager in self.get_managers_by_latency():
+            try:
+                result = getattr(manager, method_name)(*args, **kwargs)
+            except Exception as ex:
+                print("{0} failed on {1}: {2}"
+                      .format(method_name, manager.engine_url, ex))
+                self._latencies[manager.engine_url] = (float('inf'),
+                                                       _clock())
+                error = ex
+                continue
+            if result is not None or \
+                    method_name not in self.FAILOVER_ON_NONE:
+                return result
+            error = None
+            print("{0} returned no result from {1}. Trying next endpoint ..."
+                  .format(method_name, manager.engine_url))
+        if error is not None:
+            raise error
+        return result
+
+    def _call_all(self, method_name, *args, **kwargs):
+        """
+        Calls the method on every endpoint and returns the primary result
+        """
+        results = [getattr(manager, method_name)(*args, **kwargs)
+                   for manager in self.managers]
+        return results[0]
+
+    def __getattr__(self, name):
+        attribute = getattr(self.managers[0], name)
+        if not callable(attribute):
+            return attribute
+        if name.startswith(self.PRIMARY_PREFIXES):
+            return attribute
+        if name in self.FASTEST_METHODS:
+            return lambda *args, **kwargs: \
+                self._call_fastest(name, *args, **kwargs)
+        return lambda *args, **kwargs: self._call_all(name, *args, **kwargs)
+
+    def __setattr__(self, name, value):
+        for manager in self.managers:
+            setattr(manager, name, value)
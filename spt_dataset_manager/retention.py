@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""retention.py
+    spt_dataset_manager
+
+    Removes old forecast cycles from the local extract directories to keep
+    a number of cycles per watershed and/or a byte budget.
+
+    License: BSD-3 Clause
+"""
+from contextlib import contextmanager
+import json
+import os
+from shutil import rmtree
+
+from .locking import FileLock, get_lock_path
+
+# name of the index file in a main extract directory
+INDEX_FILE = ".retention.json"
+
+
+def get_cycle_lock_path(cycle_path):
+    """
+    Returns the lock file of a cycle (the same lock file the downloads
+    hold while they write the cycle)
+    """
+    return get_lock_path(cycle_path)
+
+
+@contextmanager
+def reading(cycle_path):
+    """
+    Holds a shared lock on a cycle so it is not removed while it is read
+    """
+    with FileLock(get_cycle_lock_path(cycle_path), shared=True):
+        yield cycle_path
+
+
+def get_path_size(path):
+    """
+    Returns the number of bytes in a file or directory
+    """
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total_bytes = 0
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total_bytes += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total_bytes
+
+
+class ForecastRetention(object):
+    """
+    Keeps the newest keep_cycles cycles of each watershed and/or keeps
+    each main extract directory under max_bytes.
+
+    A cycle is a file or directory in a watershed folder of a main extract
+    directory (main_extract_directory/<watershed>-<subbasin>/<cycle>).
+    The download methods register each cycle after it is downloaded and
+    the sizes are kept in an index file in the main extract directory, so
+    only the new cycle is measured and the tree is never walked.
+
+    The oldest cycles (by name, which starts with the date) are removed
+    first and the newest cycle of a watershed is never removed. A cycle
+    is skipped (and retried at the next registration) while another
+    process or thread holds its lock, i.e. while it is being downloaded
+    or read (see reading).
+    """
+    def __init__(self, keep_cycles=None, max_bytes=None):
+        if keep_cycles is not None and keep_cycles < 1:
+            raise ValueError("keep_cycles must be at least 1.")
+        self.keep_cycles = keep_cycles
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _get_index_path(main_extract_directory):
+        return os.path.join(main_extract_directory, INDEX_FILE)
+
+    def _load_index(self, main_extract_directory):
+        try:
+            with open(self._get_index_path(main_extract_directory)) \
+                    as index_file:
+                return json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_index(self, main_extract_directory, index):
+        index_path = self._get_index_path(main_extract_directory)
+        with open("%s.tmp" % index_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.rename("%s.tmp" % index_path, index_path)
+
+    @staticmethod
+    def _get_lock_path(main_extract_directory):
+        return os.path.join(main_extract_directory, ".retention.lock")
+
+    def register(self, cycle_path):
+        """
+        Adds a downloaded cycle to the index and removes the cycles
+        outside of the retention limits. Returns the removed paths.
+        """
+        cycle_path = os.path.abspath(cycle_path)
+        watershed_directory = os.path.dirname(cycle_path)
+        main_extract_directory = os.path.dirname(watershed_directory)
+        watershed_name = os.path.basename(watershed_directory)
+        cycle_name = os.path.basename(cycle_path)
+        with FileLock(self._get_lock_path(main_extract_directory)):
+            index = self._load_index(main_extract_directory)
+            if os.path.exists(cycle_path):
+                index.setdefault(watershed_name, {})[cycle_name] = \
+                    get_path_size(cycle_path)
+            removed_paths = self._enforce(main_extract_directory, index)
+            self._save_index(main_extract_directory, index)
+        return removed_paths
+
+    def rebuild_index(self, main_extract_directory):
+        """
+        Measures all of the cycles in a main extract directory (e.g. the
+        first time retention is used with existing downloads) and removes
+        the cycles outside of the retention limits
+        """
+        index = {}
+        for watershed_name in os.listdir(main_extract_directory):
+            watershed_directory = os.path.join(main_extract_directory,
+                                               watershed_name)
+            if watershed_name.startswith(".") or \
+                    not os.path.isdir(watershed_directory):
+                continue
+            index[watershed_name] = \
+                dict((cycle_name,
+                      get_path_size(os.path.join(watershed_directory,
+                                                 cycle_name)))
+                     for cycle_name in os.listdir(watershed_directory)
+                     if not cycle_name.startswith("."))
+        with FileLock(self._get_lock_path(main_extract_directory)):
+            removed_paths = self._enforce(main_extract_directory, index)
+            self._save_index(main_extract_directory, index)
+        return removed_paths
+
+    def _remove_cycle(self, main_extract_directory, watershed_name,
+                      cycle_name):
+        """
+        Removes a cycle unless it is locked. Returns True if the cycle
+        is gone.
+        """
+        cycle_path = os.path.join(main_extract_directory, watershed_name,
+                                  cycle_name)
+        cycle_lock = FileLock(get_cycle_lock_path(cycle_path))
+        if not cycle_lock.acquire(blocking=False):
+            print("Cycle {0} is in use. Skipping removal ..."
+                  .format(cycle_path))
+            return False
+        try:
+            print("Removing old cycle {0}".format(cycle_path))
+            if os.path.isdir(cycle_path):
+                rmtree(cycle_path, ignore_errors=True)
+            elif os.path.exists(cycle_path):
+                os.remove(cycle_path)
+        finally:
+            # removed while the lock is held, callers waiting on the
+            # lock file lock a new one (see locking.FileLock)
+            cycle_lock.release(remove=True)
+        return not os.path.exists(cycle_path)
+
+    def _enforce(self, main_extract_directory, index):
+        """
+        Removes cycles outside of the retention limits from the disk and
+        the index. Must be called with the retention lock held.
+        """
+        removable_cycles = []
+        for watershed_name, cycles in index.items():
+            # the newest cycle is always kept
+            removable_cycles += [(cycle_name, watershed_name)
+                                 for cycle_name in sorted(cycles)[:-1]]
+        removable_cycles.sort()
+
+        removed_paths = []
+
+        def remove(watershed_name, cycle_name):
+            if self._remove_cycle(main_extract_directory, watershed_name,
+                                  cycle_name):
+                del index[watershed_name][cycle_name]
+                removed_paths.append(os.path.join(main_extract_directory,
+                                                  watershed_name,
+                                                  cycle_name))
+                return True
+            return False
+
+        if self.keep_cycles is not None:
+            for watershed_name, cycles in index.items():
+                for cycle_name in sorted(cycles)[:-self.keep_cycles]:
+                    remove(watershed_name, cycle_name)
+
+        if self.max_bytes is not None:
+            total_bytes = sum(sum(cycles.values())
+                              for cycles in index.values())
+            for cycle_name, watershed_name in removable_cycles:
+                if total_bytes <= self.max_bytes:
+                    break
+                cycle_bytes = index[watershed_name].get(cycle_name)
+                if cycle_bytes is not None and \
+                        remove(watershed_name, cycle_name):
+                    total_bytes -= cycle_bytes
+
+        for watershed_name in [watershed_name for watershed_name, cycles
+                               in index.items() if not cycles]:
+            del index[watershed_name]
+        return removed_paths
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""retry_journal.py
+    spt_dataset_manager
+
+    On-disk journal of failed uploads so that they can be replayed
+    without rebuilding the archives.
+
+    License: BSD-3 Clause
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+class RetryJournal(object):
+    """
+    Stores failed upload tasks in journal_directory. Each task is a JSON
+    file next to a copy (hard link when possible) of its archive.
+
+    Failed replays are retried with exponential backoff starting at
+    base_delay seconds (capped at max_delay) and are given up after
+    max_attempts.
+    """
+    def __init__(self, journal_directory, max_attempts=8, base_delay=60,
+                 max_delay=6*60*60):
+        self.journal_directory = journal_directory
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        try:
+            os.makedirs(journal_directory)
+        except OSError:
+            pass
+
+    @staticmethod
+    def get_task_id(dataset_name, resource_name, engine_url=None):
+        """
+        Returns the task id for a dataset resource (on the CKAN endpoint
+        when there are several sharing the journal)
+        """
+        task_key = "{0}/{1}".format(dataset_name, resource_name)
+        if engine_url:
+            task_key = "{0}|{1}".format(engine_url, task_key)
+        return hashlib.sha1(task_key.encode("utf-8")).hexdigest()
+
+    def _get_task_path(self, task_id):
+        return os.path.join(self.journal_directory, "%s.json" % task_id)
+
+    def get_archive_path(self, task):
+        """
+        Returns the path to the archive stored for the task
+        """
+        return os.path.join(self.journal_directory, task['archive'])
+
+    def _write_task(self, task):
+        task_path = self._get_task_path(task['id'])
+        temp_task_path = "%s.tmp" % task_path
+        with open(temp_task_path, 'w') as task_file:
+            json.dump(task, task_file, indent=2)
+        # atomic so a crash never leaves a half written task
+        os.rename(temp_task_path, task_path)
+
+    def record(self, archive_path, **task_info):
+        """
+        Adds a failed upload to the journal and keeps its archive.
+        task_info must contain dataset_name and resource_name and should
+        contain the engine_url of the endpoint the upload failed on.
+        """
+        task_id = self.get_task_id(task_info['dataset_name'],
+                                   task_info['resource_name'],
+                                   task_info.get('engine_url'))
+        archive_name = "%s-%s" % (task_id, os.path.basename(archive_path))
+        journal_archive_path = os.path.join(self.journal_directory,
+                                            archive_name)
+        if os.path.abspath(archive_path) != \
+                os.path.abspath(journal_archive_path):
+            if os.path.exists(journal_archive_path):
+                os.remove(journal_archive_path)
+            try:
+                # hard link so the caller can delete the original
+                os.link(archive_path, journal_archive_path)
+            except (AttributeError, OSError):
+                shutil.copy2(archive_path, journal_archive_path)
+
+        task = dict(task_info)
+        task.update({
+            'id': task_id,
+            'archive': archive_name,
+            'attempts': 0,
+            'status': 'pending',
+            'next_attempt': time.time(),
+        })
+        self._write_task(task)
+        print("Upload of {0} recorded in retry journal"
+              .format(task_info['resource_name']))
+        return task
+
+    def get_tasks(self, status=None):
+        """
+        Returns the tasks in the journal sorted by next attempt time
+        """
+        tasks = []
+        for file_name in os.listdir(self.journal_directory):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.journal_directory,
+                                       file_name)) as task_file:
+                    task = json.load(task_file)
+            except (IOError, OSError, ValueError):
+                continue
+            if status is None or task['status'] == status:
+                tasks.append(task)
+        return sorted(tasks, key=lambda task: task['next_attempt'])
+
+    def get_due_tasks(self):
+        """
+        Returns the pending tasks that are ready to be retried
+        """
+        now = time.time()
+        return [task for task in self.get_tasks('pending')
+                if task['next_attempt'] <= now]
+
+    def complete(self, task):
+        """
+        Removes a task and its archive from the journal
+        """
+        for path in (self._get_task_path(task['id']),
+                     self.get_archive_path(task)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def reschedule(self, task, error=None):
+        """
+        Schedules the next attempt of a task that failed again
+        """
+        task['attempts'] += 1
+        task['last_error'] = str(error) if error is not None else None
+        if task['attempts'] >= self.max_attempts:
+            task['status'] = 'failed'
+            print("Giving up on upload of {0} after {1} attempts"
+                  .format(task['resource_name'], task['attempts']))
+        else:
+            task['next_attempt'] = \
+                time.time() + min(self.max_delay,
+                                  self.base_delay * 2 ** (task['attempts']-1))
+        self._write_task(task)
+        return task
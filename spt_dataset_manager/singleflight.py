@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""singleflight.py
+    spt_dataset_manager
+
+    Coalesces concurrent calls for the same key so the work is done once.
+
+    License: BSD-3 Clause
+"""
+import threading
+
+from .locking import FileLock
+
+
+class _Call(object):
+    """
+    An in-flight call that other callers can wait for
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time. Threads that ask for a key that is
+    already running wait for it and get the same result (or exception).
+
+    If a lock_path is given the call also holds a FileLock on it, so
+    callers in other processes wait for the running call to finish before
+    doing their own (which should then find the work already done). The
+    lock file is removed when the call finishes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, lock_path=None):
+        """
+        Runs function for key unless it is already running
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if lock_path:
+                file_lock = FileLock(lock_path)
+                file_lock.acquire()
+                try:
+                    call.result = function()
+                finally:
+                    # callers waiting in other processes lock a new file
+                    file_lock.release(remove=True)
+            else:
+                call.result = function()
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
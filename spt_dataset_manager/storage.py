@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""storage.py
+    spt_dataset_manager
+
+    Object stores for resource payloads. With a storage backend the
+    managers write the payloads to the store and only register their URL
+    with CKAN, and downloads read them directly from the store.
+
+    License: BSD-3 Clause
+"""
+import os
+
+try:
+    from urllib.parse import quote, unquote, urlparse
+    from urllib.request import url2pathname, pathname2url
+except ImportError:  # Python 2
+    from urllib import quote, unquote, url2pathname, pathname2url
+    from urlparse import urlparse
+
+# bytes copied at a time by the file system storage
+_COPY_BUFFER_SIZE = 1048576
+
+
+class FileSystemStorage(object):
+    """
+    Stores payloads in a directory, e.g. a shared or network file system
+    that is also served over HTTP at base_url. Without a base_url the
+    resources get file:// URLs (for hosts that mount the directory).
+    """
+    def __init__(self, root_directory, base_url=None):
+        self.root_directory = os.path.abspath(root_directory)
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def get_url(self, key):
+        """
+        Returns the URL of the object with the key
+        """
+        if self.base_url:
+            return '%s/%s' % (self.base_url, quote(key))
+        return 'file://%s' % pathname2url(self._get_path(key))
+
+    def _get_path(self, key):
+        return os.path.join(self.root_directory, *key.split('/'))
+
+    def _get_key(self, url):
+        """
+        Returns the key of an object URL in this store or None
+        """
+        if self.base_url and url.startswith(self.base_url + '/'):
+            return unquote(url[len(self.base_url) + 1:])
+        if url.startswith('file:'):
+            path = os.path.abspath(url2pathname(urlparse(url).path))
+            if path.startswith(self.root_directory + os.sep):
+                return os.path.relpath(path, self.root_directory)\
+                         .replace(os.sep, '/')
+        return None
+
+    def owns(self, url):
+        """
+        True if the URL is an object in this store
+        """
+        return self._get_key(url) is not None
+
+    @staticmethod
+    def _copy(source_path, destination_path, callback=None):
+        partial_path = "%s.part" % destination_path
+        with open(source_path, 'rb') as source_file, \
+                open(partial_path, 'wb') as destination_file:
+            while True:
+                data = source_file.read(_COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                destination_file.write(data)
+                if callback is not None:
+                    callback(len(data))
+        if os.name == 'nt' and os.path.exists(destination_path):
+            os.remove(destination_path)
+        os.rename(partial_path, destination_path)
+
+    def put(self, file_path, key, callback=None):
+        """
+        Stores the file under the key and returns its URL. callback is
+        called with the number of bytes of each block written.
+        """
+        object_path = self._get_path(key)
+        try:
+            os.makedirs(os.path.dirname(object_path))
+        except OSError:
+            pass
+        self._copy(file_path, object_path, callback)
+        return self.get_url(key)
+
+    def download(self, url, local_file_path, callback=None):
+        """
+        Copies the object with the URL to a local file
+        """
+        self._copy(self._get_path(self._get_key(url)), local_file_path,
+                   callback)
+
+    def delete(self, url):
+        """
+        Removes the object with the URL
+        """
+        try:
+            os.remove(self._get_path(self._get_key(url)))
+        except OSError:
+            pass
+
+
+class S3Storage(object):
+    """
+    Stores payloads in an S3 compatible object store (AWS S3, MinIO,
+    Ceph, ...) with boto3. Large files are transferred in multipart_size
+    parts, max_concurrency at a time.
+
+    The resource URLs are public_base_url/<key> if given, otherwise
+    <endpoint_url>/<bucket>/<key> (or the AWS virtual host URL). The
+    other client_options (e.g. region_name, aws_access_key_id) are passed
+    to boto3.
+    """
+    def __init__(self, bucket, prefix="", endpoint_url=None,
+                 public_base_url=None, multipart_size=16777216,
+                 max_concurrency=8, **client_options):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise ImportError("boto3 is required for S3 storage. "
+                              "Install it or use FileSystemStorage.")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url,
+                                   **client_options)
+        self.transfer_config = \
+            TransferConfig(multipart_threshold=multipart_size,
+                           multipart_chunksize=multipart_size,
+                           max_concurrency=max_concurrency,
+                           use_threads=max_concurrency > 1)
+        if public_base_url:
+            self.base_url = public_base_url.rstrip('/')
+        elif endpoint_url:
+            self.base_url = '%s/%s' % (endpoint_url.rstrip('/'), bucket)
+        else:
+            self.base_url = 'https://%s.s3.amazonaws.com' % bucket
+
+    def _get_object_key(self, key):
+        if self.prefix:
+            return '%s/%s' % (self.prefix, key)
+        return key
+
+    def get_url(self, key):
+        """
+        Returns the URL of the object with the key
+        """
+        return '%s/%s' % (self.base_url, quote(self._get_object_key(key)))
+
+    def _get_key(self, url):
+        if url.startswith(self.base_url + '/'):
+            return unquote(url[len(self.base_url) + 1:])
+        return None
+
+    def owns(self, url):
+        """
+        True if the URL is an object in this store
+        """
+        return self._get_key(url) is not None
+
+    def put(self, file_path, key, callback=None):
+        """
+        Uploads the file under the key (in parallel parts) and returns its
+        URL. callback is called with the number of bytes of each block
+        sent, possibly from several threads.
+        """
+        self.client.upload_file(file_path, self.bucket,
+                                self._get_object_key(key),
+                                Config=self.transfer_config,
+                                Callback=callback)
+        return self.get_url(key)
+
+    def download(self, url, local_file_path, callback=None):
+        """
+        Downloads the object with the URL (in parallel ranges)
+        """
+        self.client.download_file(self.bucket, self._get_key(url),
+                                  local_file_path,
+                                  Config=self.transfer_config,
+                                  Callback=callback)
+
+    def delete(self, url):
+        """
+        Removes the object with the URL
+        """
+        self.client.delete_object(Bucket=self.bucket,
+                                  Key=self._get_key(url))
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""throttle.py
+    spt_dataset_manager
+
+    Bandwidth and concurrency limits for CKAN transfers. One limiter
+    instance can be shared by any number of managers and threads to
+    enforce a global limit.
+
+    License: BSD-3 Clause
+"""
+from collections import deque
+import socket
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+# -----------------------------------------------------------------------------
+# Bandwidth Limiter
+# -----------------------------------------------------------------------------
+class TokenBucket(object):
+    """
+    Token bucket bandwidth limiter.
+
+    rate is in bytes per second and capacity is the largest burst in bytes
+    (defaults to one second worth of data). Consuming more tokens than are
+    available puts the bucket in debt and the caller sleeps until it is
+    paid back, so the long term average never exceeds the rate.
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("The bandwidth rate must be greater than zero.")
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._last_update = _clock()
+        self._lock = threading.Lock()
+
+    def consume(self, num_bytes):
+        """
+        Takes num_bytes from the bucket, sleeping if the bucket is empty
+        """
+        if num_bytes <= 0:
+            return
+        with self._lock:
+            now = _clock()
+            self._tokens = min(self.capacity,
+                               self._tokens +
+                               (now - self._last_update) * self.rate)
+            self._last_update = now
+            self._tokens -= num_bytes
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+# -----------------------------------------------------------------------------
+# Adaptive Concurrency Limiter
+# -----------------------------------------------------------------------------
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Additive increase/multiplicative decrease (AIMD) concurrency limit.
+
+    The limit grows by additive_increase for every limit worth of healthy
+    transfers and is multiplied by decrease_factor when the server is
+    overloaded (5xx responses, timeouts or connection errors) or when the
+    error rate of the last error_window transfers exceeds
+    error_rate_threshold. A transfer is healthy if it succeeded and its
+    latency (per MB when the size is known) is within latency_tolerance
+    times the best latency seen recently.
+    """
+    def __init__(self, initial_limit=2, min_limit=1, max_limit=16,
+                 additive_increase=1.0, decrease_factor=0.5,
+                 latency_tolerance=2.0, error_window=20,
+                 error_rate_threshold=0.2):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.error_rate_threshold = error_rate_threshold
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._baseline_latency = None
+        self._last_decrease = _clock()
+        self._outcomes = deque(maxlen=error_window)
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        """
+        The current number of transfers allowed at once
+        """
+        return int(self._limit)
+
+    def acquire(self):
+        """
+        Waits for a transfer slot and returns the start time
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        return _clock()
+
+    def release(self, start_time, success=True, overloaded=False,
+                num_bytes=None):
+        """
+        Frees a transfer slot and adjusts the limit from its outcome
+        """
+        latency = _clock() - start_time
+        if num_bytes:
+            latency /= max(num_bytes / 1048576.0, 1.0)
+        with self._condition:
+            self._in_flight -= 1
+            self._outcomes.append(success and not overloaded)
+            error_rate = (self._outcomes.count(False) /
+                          float(len(self._outcomes)))
+            if overloaded or error_rate > self.error_rate_threshold:
+                # only back off once for transfers that were started
+                # before the previous decrease
+                if start_time >= self._last_decrease:
+                    self._limit = max(self.min_limit,
+                                      self._limit * self.decrease_factor)
+                    self._last_decrease = _clock()
+                    self._outcomes.clear()
+            elif success:
+                if self._baseline_latency is None or \
+                        latency < self._baseline_latency:
+                    self._baseline_latency = latency
+                else:
+                    # let the baseline drift up slowly so a single fast
+                    # transfer does not pin it forever
+                    self._baseline_latency *= 1.01
+                if latency <= self._baseline_latency * self.latency_tolerance:
+                    self._limit = min(self.max_limit,
+                                      self._limit +
+                                      self.additive_increase / self._limit)
+            self._condition.notify_all()
+
+    def request(self, num_bytes=None):
+        """
+        Returns a context manager holding a transfer slot
+        """
+        return TransferRequest(self, num_bytes)
+
+
+def is_overload_error(error):
+    """
+    Checks if an exception means the server is overloaded
+    """
+    if isinstance(error, socket.timeout):
+        return True
+    try:
+        from requests.exceptions import ConnectionError, Timeout
+    except ImportError:
+        return False
+    return isinstance(error, (ConnectionError, Timeout))
+
+
+class TransferRequest(object):
+    """
+    Context manager for one transfer through an optional
+    AdaptiveConcurrencyLimiter.
+
+    Call set_status_code or set_failed inside the block to report the
+    outcome. Exceptions raised in the block are reported as failures.
+    """
+    def __init__(self, limiter=None, num_bytes=None):
+        self.limiter = limiter
+        self.num_bytes = num_bytes
+        self.success = True
+        self.overloaded = False
+        self._start_time = None
+
+    def set_status_code(self, status_code):
+        """
+        Reports the HTTP status code of the transfer
+        """
+        if status_code >= 500:
+            self.set_failed(overloaded=True)
+        elif status_code >= 400:
+            self.set_failed()
+
+    def set_failed(self, overloaded=False):
+        """
+        Reports a failed transfer
+        """
+        self.success = False
+        self.overloaded = self.overloaded or overloaded
+
+    def __enter__(self):
+        if self.limiter is not None:
+            self._start_time = self.limiter.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_value is not None:
+            self.set_failed(is_overload_error(exc_value))
+        if self.limiter is not None:
+            self.limiter.release(self._start_time, self.success,
+                                 self.overloaded, self.num_bytes)
+        return False
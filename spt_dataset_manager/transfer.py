@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""transfer.py
+    spt_dataset_manager
+
+    Streaming HTTP transfers with progress reporting.
+
+    License: BSD-3 Clause
+"""
+import json
+import os
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+# bytes read from the connection and written to the file at a time
+DEFAULT_DOWNLOAD_BUFFER_SIZE = 1048576
+
+
+class TransferProgress(object):
+    """
+    Tracks the bytes transferred and reports them to an optional
+    callback(name, bytes_transferred, total_bytes,
+    bytes_per_second) at most every callback_interval seconds while data
+    is flowing, and once more at the end. bytes_per_second is measured
+    over the last interval so callers can show live throughput; an upload
+    that stops reporting has stalled.
+
+    Every chunk is charged to the optional bandwidth limiter.
+    """
+    def __init__(self, name, total_bytes, callback=None,
+                 bandwidth_limiter=None, callback_interval=0.5):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.bandwidth_limiter = bandwidth_limiter
+        self.callback_interval = callback_interval
+        self.bytes_transferred = 0
+        self._interval_start = _clock()
+        self._interval_bytes = 0
+
+    def update(self, bytes_transferred):
+        """
+        Records the total number of bytes transferred so far
+        """
+        num_new_bytes = bytes_transferred - self.bytes_transferred
+        if num_new_bytes <= 0:
+            # e.g. the monitor reports the end of the form again
+            return
+        self.bytes_transferred = bytes_transferred
+        if self.bandwidth_limiter is not None:
+            self.bandwidth_limiter.consume(num_new_bytes)
+        self._interval_bytes += num_new_bytes
+        if self.callback is not None:
+            elapsed = _clock() - self._interval_start
+            if elapsed >= self.callback_interval or \
+                    bytes_transferred >= self.total_bytes:
+                self.callback(self.name, bytes_transferred,
+                              self.total_bytes,
+                              self._interval_bytes / max(elapsed, 1e-6))
+                self._interval_start = _clock()
+                self._interval_bytes = 0
+
+    def __call__(self, monitor):
+        # MultipartEncoderMonitor callback
+        self.update(monitor.bytes_read)
+
+
+def stream_upload(url, fields, file_path, upload_file_name, headers=None,
+                  progress_callback=None, bandwidth_limiter=None,
+                  session=None):
+    """
+    POSTs the file as the 'upload' field of a multipart form, reading it
+    in small chunks so memory use does not depend on the file size.
+
+    Returns the status code and the parsed JSON response
+    (None if the response is not JSON).
+    """
+    return stream_upload_files(url, fields,
+                               {'upload': (upload_file_name, file_path)},
+                               headers, progress_callback, bandwidth_limiter,
+                               session)
+
+
+def stream_upload_files(url, fields, upload_files, headers=None,
+                        progress_callback=None, bandwidth_limiter=None,
+                        session=None):
+    """
+    POSTs the files ({field_name: (upload_file_name, file_path)}) in one
+    multipart form like stream_upload. The progress is reported for the
+    whole form.
+    """
+    from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+    if session is None:
+        import requests as session
+
+    form_fields = dict((key, str(value)) for key, value in fields.items())
+    open_files = []
+    try:
+        for field_name, (upload_file_name, file_path) in \
+                sorted(upload_files.items()):
+            open_files.append(open(file_path, 'rb'))
+            form_fields[field_name] = (upload_file_name, open_files[-1],
+                                       'application/octet-stream')
+        if len(upload_files) == 1:
+            progress_name = form_fields[field_name][0]
+        else:
+            progress_name = "{0} files".format(len(upload_files))
+        encoder = MultipartEncoder(fields=form_fields)
+        progress = TransferProgress(progress_name,
+                                    encoder.len,
+                                    progress_callback,
+                                    bandwidth_limiter)
+        monitor = MultipartEncoderMonitor(encoder, progress)
+        request_headers = dict(headers or {})
+        request_headers['Content-Type'] = monitor.content_type
+        r = session.post(url, data=monitor, headers=request_headers)
+    finally:
+        for open_file in open_files:
+            open_file.close()
+    try:
+        return r.status_code, json.loads(r.text)
+    except ValueError:
+        print("Status Code {0}: {1}".format(r.status_code, r.text[:1000]))
+        return r.status_code, None
+
+
+def route_engine_requests(dataset_engine, session):
+    """
+    Sends the API calls of a tethys CkanDatasetEngine (e.g.
+    search_datasets, package_show, execute_api_method) through the session
+    so they reuse its connections. File uploads keep the engine's own
+    request. A session of None restores the engine's requests.
+    """
+    if not hasattr(type(dataset_engine), '_execute_request'):
+        # engine without the private hook (other tethys version)
+        return
+    dataset_engine.__dict__.pop('_execute_request', None)
+    if session is None:
+        return
+    execute_file_request = dataset_engine._execute_request
+
+    def execute_request(url, data, headers, file=None):
+        if file:
+            return execute_file_request(url, data, headers, file)
+        r = session.post(url, data=data, headers=headers)
+        return r.status_code, r.text
+
+    dataset_engine._execute_request = execute_request
+
+
+def _preallocate(output_file, num_bytes):
+    """
+    Reserves the space for the download so the file is not fragmented
+    (where the platform and file system support it)
+    """
+    if not num_bytes or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(output_file.fileno(), 0, num_bytes)
+    except OSError:
+        pass
+
+
+def download_to_file(url, local_file_path, session=None,
+                     bandwidth_limiter=None,
+                     buffer_size=DEFAULT_DOWNLOAD_BUFFER_SIZE,
+                     response_callback=None):
+    """
+    Downloads the url to a file with large reads into one reusable
+    buffer. The file is preallocated from the Content-Length and is not
+    flushed until it is closed. response_callback is called with the
+    response (e.g. to check the status code) before the body is read.
+
+    Raises an IOError if fewer bytes than the Content-Length arrive.
+    Returns the number of bytes written.
+    """
+    if session is None:
+        import requests as session
+    # no content encoding so the bytes can be written as they arrive
+    r = session.get(url, stream=True,
+                    headers={'Accept-Encoding': 'identity'})
+    try:
+        if response_callback is not None:
+            response_callback(r)
+        r.raise_for_status()
+        content_length = int(r.headers.get('content-length', 0)) or None
+        progress = TransferProgress(os.path.basename(local_file_path),
+                                    content_length or 0,
+                                    bandwidth_limiter=bandwidth_limiter)
+        content_encoding = r.headers.get('content-encoding', 'identity')
+        # the http.client response under urllib3 reads directly into the
+        # buffer, urllib3's own readinto copies through a new bytes object.
+        # _fp is private (checked with urllib3 1.26.20 and 2.8.0), so
+        # fall back to urllib3's readinto without it.
+        raw_file = getattr(r.raw, '_fp', None)
+        if not hasattr(raw_file, 'readinto'):
+            raw_file = r.raw
+        bytes_written = 0
+        with open(local_file_path, 'wb') as output_file:
+            _preallocate(output_file, content_length)
+            if content_encoding == 'identity' and \
+                    hasattr(raw_file, 'readinto'):
+                buffer_view = memoryview(bytearray(buffer_size))
+                while True:
+                    num_bytes = raw_file.readinto(buffer_view)
+                    if not num_bytes:
+                        break
+                    output_file.write(buffer_view[:num_bytes])
+                    bytes_written += num_bytes
+                    progress.update(bytes_written)
+                r.raw.release_conn()
+            else:
+                # the server compressed the response anyway
+                for chunk in r.iter_content(chunk_size=buffer_size):
+                    output_file.write(chunk)
+                    bytes_written += len(chunk)
+                    progress.update(bytes_written)
+            if content_length and content_encoding == 'identity' and \
+                    bytes_written != content_length:
+                output_file.truncate(bytes_written)
+                raise IOError("Download of {0} incomplete: {1} of {2} "
+                              "bytes".format(url, bytes_written,
+                                             content_length))
+    finally:
+        r.close()
+    return bytes_written
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""warning_points.py
+    spt_dataset_manager
+
+    Compact summaries of the warning points GeoJSON files stored as
+    dataset metadata so dashboards do not have to download the files.
+
+    License: BSD-3 Clause
+"""
+import json
+from numbers import Number
+
+# name of the dataset extra with the summary of all return periods
+SUMMARY_EXTRA = 'warning_points_summary'
+
+
+def _iter_positions(coordinates):
+    """
+    Yields the (x, y) positions of GeoJSON geometry coordinates
+    """
+    if coordinates and isinstance(coordinates[0], Number):
+        yield coordinates[0], coordinates[1]
+        return
+    for child_coordinates in coordinates or []:
+        for position in _iter_positions(child_coordinates):
+            yield position
+
+
+def summarize_warning_points(geojson_path):
+    """
+    Returns the summary of a warning points GeoJSON file
+    (see summarize_warning_points_data)
+    """
+    with open(geojson_path, 'rb') as geojson_file:
+        return summarize_warning_points_data(geojson_file.read())
+
+
+def summarize_warning_points_data(geojson_data):
+    """
+    Returns the number of warning points, their bounding box
+    [min_x, min_y, max_x, max_y] (None without points) and the highest
+    value of each numeric "peak*" property of the contents of a warning
+    points GeoJSON file
+    """
+    if isinstance(geojson_data, bytes):
+        geojson_data = geojson_data.decode('utf-8')
+    features = json.loads(geojson_data).get('features', [])
+    bbox = None
+    peaks = {}
+    for feature in features:
+        geometry = feature.get('geometry') or {}
+        for x, y in _iter_positions(geometry.get('coordinates')):
+            if bbox is None:
+                bbox = [x, y, x, y]
+            else:
+                bbox = [min(bbox[0], x), min(bbox[1], y),
+                        max(bbox[2], x), max(bbox[3], y)]
+        for name, value in (feature.get('properties') or {}).items():
+            if name.lower().startswith('peak') and \
+                    isinstance(value, Number) and \
+                    not isinstance(value, bool):
+                peaks[name] = max(value, peaks.get(name, value))
+    return {
+        'count': len(features),
+        'bbox': bbox,
+        'peaks': peaks,
+    }
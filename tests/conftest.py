@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""conftest.py
+    spt_dataset_manager
+
+    Stand-in CKAN action API on a local HTTP server for the tests.
+
+    License: BSD-3 Clause
+"""
+from email.parser import BytesParser
+import fnmatch
+import itertools
+import json
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pytest
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _parse_multipart(content_type, body):
+    """
+    Returns the fields of a multipart form (the bytes of file fields)
+    """
+    message = BytesParser().parsebytes(
+        b"Content-Type: " + content_type.encode('ascii') + b"\r\n\r\n" + body)
+    fields = {}
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        value = part.get_payload(decode=True)
+        if part.get_filename() is None:
+            value = value.decode('utf-8')
+        fields[name] = value
+    return fields
+
+
+def _get_query_value(query):
+    # "name:value" queries of the tethys engine
+    if isinstance(query, list):
+        query = query[0]
+    return query.split(":", 1)[1]
+
+
+def _get_query_patterns(query):
+    # "name:value", "name:prefix-*" or "name:(value OR value)"
+    value = _get_query_value(query)
+    if value.startswith("(") and value.endswith(")"):
+        return value[1:-1].split(" OR ")
+    return [value]
+
+
+def _project(dataset, fl):
+    """
+    Returns the fields in fl (comma separated) of a dataset like the
+    CKAN search index (the resource fields as res_* lists)
+    """
+    if not fl:
+        return dict(dataset)
+    document = {}
+    for field in fl.split(","):
+        if field == 'num_resources':
+            document[field] = len(dataset['resources'])
+        elif field.startswith('res_'):
+            document[field] = [resource.get(field[len('res_'):])
+                               for resource in dataset['resources']]
+        elif field in dataset:
+            document[field] = dataset[field]
+    return document
+
+
+class StandInCKAN(object):
+    """
+    Keeps datasets and their resources in memory and answers the CKAN
+    actions the managers use. All POSTs fail with a 503 while fail is
+    True and adding the resources named in fail_resources fails.
+    package_revise is unknown (and status_show reports CKAN 2.8) while
+    revise_supported is False. actions records the names of the actions
+    called and searches the package_search parameters. Searches honour
+    fl like the CKAN search index.
+    """
+    def __init__(self):
+        self.datasets = {}
+        self.uploads = {}
+        self.actions = []
+        self.searches = []
+        self.fail = False
+        self.fail_resources = set()
+        self.revise_supported = True
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, response, status_code=200):
+                body = json.dumps(response).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/api/3'):
+                    return self._reply({'version': 3})
+                if self.path in stand_in.uploads:
+                    body = stand_in.uploads[self.path]
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self._reply({'success': True, 'result': {}})
+
+            def do_POST(self):
+                body = self.rfile.read(
+                    int(self.headers.get('Content-Length', 0)))
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('multipart/form-data'):
+                    data = _parse_multipart(content_type, body)
+                else:
+                    data = json.loads(body.decode('utf-8') or '{}')
+                action = self.path.rsplit('/', 1)[-1]
+                stand_in.actions.append(action)
+                if stand_in.fail:
+                    return self._reply({'success': False,
+                                        'error': {'message': 'unavailable'}},
+                                       503)
+                with stand_in._lock:
+                    response = stand_in.handle(action, data)
+                    if response['success'] and action not in \
+                            ('package_search', 'resource_search',
+                             'package_show'):
+                        stand_in._touch(action, data, response['result'])
+                self._reply(response, 200 if response['success'] else 409)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.base_url = "http://127.0.0.1:{0}".format(
+            self.server.server_port)
+        self.url = "{0}/api/3/action".format(self.base_url)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _new_id(self, prefix):
+        return "{0}-{1}".format(prefix, next(self._ids))
+
+    def _find_dataset(self, id_or_name):
+        for dataset in self.datasets.values():
+            if id_or_name in (dataset['id'], dataset['name']):
+                return dataset
+        return None
+
+    def _create_resource(self, fields):
+        resource = dict((key, value) for key, value in fields.items()
+                        if key not in ('package_id', 'upload'))
+        resource['id'] = self._new_id('resource')
+        if 'upload' in fields:
+            self._store_upload(resource, fields['upload'])
+        return resource
+
+    def _store_upload(self, resource, content):
+        upload_path = "/uploads/{0}/{1}".format(resource['id'],
+                                                resource['name'])
+        self.uploads[upload_path] = content
+        resource['size'] = len(content)
+        resource['url'] = self.base_url + upload_path
+        resource['last_modified'] = self._get_modified_time()
+
+    def _get_modified_time(self):
+        # a new time for every change
+        return "2015-04-05T00:00:00.{0:06d}".format(next(self._ids))
+
+    def _touch(self, action, data, result):
+        """
+        Updates metadata_modified of the dataset changed by an action
+        """
+        if action == 'resource_delete':
+            datasets = list(self.datasets.values())
+        elif action == 'resource_create':
+            datasets = [self._find_dataset(data['package_id'])]
+        else:
+            datasets = [result]
+        for dataset in datasets:
+            dataset['metadata_modified'] = self._get_modified_time()
+
+    def get_resource_names(self, dataset_name):
+        """
+        Returns the names of the resources of a dataset
+        """
+        dataset = self._find_dataset(dataset_name)
+        if dataset is None:
+            return []
+        return [resource['name'] for resource in dataset['resources']]
+
+    def handle(self, action, data):
+        """
+        Returns the response to an action
+        """
+        if action == 'status_show':
+            return {'success': True,
+                    'result': {'ckan_version': '2.10.4' if
+                               self.revise_supported else '2.8.12'}}
+        if action == 'package_search':
+            self.searches.append(data)
+            patterns = _get_query_patterns(data.get('q') or data['fq'])
+            results = [_project(dataset, data.get('fl'))
+                       for dataset in self.datasets.values()
+                       if any(fnmatch.fnmatchcase(dataset['name'], pattern)
+                              for pattern in patterns)]
+            return {'success': True,
+                    'result': {'count': len(results),
+                               'results': results[:data.get('rows')]}}
+        if action == 'package_create':
+            dataset = dict(data, id=self._new_id('dataset'), resources=[],
+                           extras=data.get('extras', []))
+            self.datasets[dataset['id']] = dataset
+            return {'success': True, 'result': dataset}
+        if action == 'package_revise' and \
+                isinstance(data.get('match'), str):
+            # multipart forms send the JSON fields as strings
+            data = dict((key, json.loads(value)
+                         if key in ('match', 'update__resources__extend') or
+                         not key.endswith('__upload') and
+                         value[:1] in ('{', '[') else value)
+                        for key, value in data.items())
+        dataset = self._find_dataset(data.get('id') or
+                                     data.get('package_id') or
+                                     data.get('match', {}).get('id'))
+        if action == 'resource_search':
+            name = _get_query_value(data['query'])
+            results = [resource for dataset in self.datasets.values()
+                       for resource in dataset['resources']
+                       if resource['name'] == name]
+            return {'success': True,
+                    'result': {'count': len(results), 'results': results}}
+        if action == 'resource_delete':
+            for dataset in self.datasets.values():
+                dataset['resources'] = [resource for resource
+                                        in dataset['resources']
+                                        if resource['id'] != data['id']]
+            return {'success': True, 'result': None}
+        if dataset is None:
+            return {'success': False, 'error': {'message': 'Not found'}}
+        if action == 'package_show':
+            return {'success': True, 'result': dataset}
+        if action == 'resource_create':
+            if data['name'] in self.fail_resources:
+                return {'success': False,
+                        'error': {'message': 'unavailable'}}
+            resource = self._create_resource(data)
+            dataset['resources'].append(resource)
+            return {'success': True, 'result': resource}
+        if action == 'package_patch':
+            for key, value in data.items():
+                if key == 'resources':
+                    value = [resource if 'id' in resource else
+                             self._create_resource(resource)
+                             for resource in value]
+                if key != 'id':
+                    dataset[key] = value
+            return {'success': True, 'result': dataset}
+        if action == 'package_revise' and self.revise_supported:
+            return self._revise(dataset, data)
+        return {'success': False,
+                'error': {'message': 'Action name not known: %s' % action}}
+
+    def _revise(self, dataset, data):
+        if any(resource['name'] in self.fail_resources for resource
+               in data.get('update__resources__extend', [])):
+            return {'success': False, 'error': {'message': 'unavailable'}}
+        resources = dataset['resources']
+        for resource in data.get('update__resources__extend', []):
+            resources.append(self._create_resource(resource))
+        for key, value in data.items():
+            if not key.startswith('update__resources__') or \
+                    key == 'update__resources__extend':
+                continue
+            position, _, field = \
+                key[len('update__resources__'):].partition('__')
+            if position.lstrip('-').isdigit():
+                resource = resources[int(position)]
+            else:
+                resource = [resource for resource in resources
+                            if resource['id'].startswith(position)][0]
+            if field == 'upload':
+                self._store_upload(resource, value)
+            else:
+                resource.update(value)
+        return {'success': True, 'result': dataset}
+
+
+@pytest.fixture
+def ckan_servers():
+    """
+    Returns a function starting a StandInCKAN (stopped after the test)
+    """
+    servers = []
+
+    def start_server():
+        server = StandInCKAN()
+        servers.append(server)
+        return server
+    yield start_server
+    for server in servers:
+        server.close()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""test_batch.py
+    spt_dataset_manager
+
+    Tests for the batch job runner.
+
+    License: BSD-3 Clause
+"""
+import json
+import threading
+
+import pytest
+
+from spt_dataset_manager import batch
+
+
+class _FakeManager(object):
+    """
+    Counts its creations and records the jobs it ran
+    """
+    num_created = 0
+
+    def __init__(self, config):
+        _FakeManager.num_created += 1
+        self.config = config
+        self.watershed = None
+
+    def download_recent_resource(self, watershed, subbasin,
+                                 main_extract_directory):
+        print("Downloading {0} {1} ...".format(watershed, subbasin))
+        if watershed == 'missing':
+            raise IOError("Dataset not found")
+        self.watershed = watershed
+        return id(self)
+
+
+@pytest.fixture
+def fake_manager(monkeypatch):
+    monkeypatch.setitem(batch.MANAGER_FACTORIES, 'wrf_hydro', _FakeManager)
+    monkeypatch.setattr(_FakeManager, 'num_created', 0)
+    return _FakeManager
+
+
+def test_manager_pool_copies_per_thread(fake_manager):
+    manager_pool = batch.ManagerPool({'wrf_hydro': {'engine_url': 'url'}},
+                                     parallelism=2)
+    managers = []
+
+    def get_managers():
+        managers.append(manager_pool.get('wrf_hydro'))
+        managers.append(manager_pool.get('wrf_hydro'))
+
+    threads = [threading.Thread(target=get_managers) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # one validated manager and one copy per thread
+    assert fake_manager.num_created == 1
+    assert managers[0] is managers[1]
+    assert managers[2] is managers[3]
+    assert managers[0] is not managers[2]
+    assert managers[0].config is managers[2].config
+
+
+def test_manager_pool_errors(fake_manager):
+    manager_pool = batch.ManagerPool({'wrf_hydro': {},
+                                      'other': {'type': 'invalid'}})
+    with pytest.raises(KeyError):
+        manager_pool.get_manager_type('ecmwf')
+    with pytest.raises(ValueError):
+        manager_pool.get_manager_type('other')
+
+
+def test_load_job_spec(tmpdir):
+    spec_path = tmpdir.join('jobs.json')
+    spec_path.write(json.dumps({'parallelism': 2, 'jobs': []}))
+    assert batch.load_job_spec(str(spec_path)) == {'parallelism': 2,
+                                                   'jobs': []}
+
+    yaml = pytest.importorskip("yaml")
+    spec_path = tmpdir.join('jobs.yml')
+    spec_path.write(yaml.safe_dump({'jobs': [{'manager': 'ecmwf'}]}))
+    assert batch.load_job_spec(str(spec_path)) == \
+        {'jobs': [{'manager': 'ecmwf'}]}
+
+
+def test_parse_job_date():
+    assert batch._parse_job_date(None) is None
+    assert batch._parse_job_date('2015-04-05').day == 5
+    assert batch._parse_job_date('2015-04-05T12:00:00').hour == 12
+    with pytest.raises(ValueError):
+        batch._parse_job_date('04/05/2015')
+
+
+def _write_spec(tmpdir, jobs):
+    spec_path = tmpdir.join('jobs.json')
+    spec_path.write(json.dumps({
+        'managers': {'wrf_hydro': {'engine_url': 'url'}},
+        'jobs': jobs,
+    }))
+    return str(spec_path)
+
+
+def test_main_writes_only_summary_to_stdout(tmpdir, capsys, fake_manager):
+    spec_path = _write_spec(tmpdir, [
+        {'manager': 'wrf_hydro', 'action': 'download', 'watershed': 'usa',
+         'subbasin': 'usa', 'main_extract_directory': str(tmpdir)},
+    ])
+
+    assert batch.main([spec_path, '--parallelism', '2']) == 0
+
+    output = capsys.readouterr()
+    summary = json.loads(output.out)
+    assert summary['parallelism'] == 2
+    assert (summary['total'], summary['succeeded'], summary['failed']) == \
+        (1, 1, 0)
+    assert summary['jobs'][0]['status'] == 'success'
+    assert "Downloading usa usa ..." in output.err
+
+
+def test_main_exit_code_for_failed_jobs(tmpdir, capsys, fake_manager):
+    spec_path = _write_spec(tmpdir, [
+        {'manager': 'wrf_hydro', 'action': 'download',
+         'watershed': 'missing', 'subbasin': 'usa',
+         'main_extract_directory': str(tmpdir)},
+        {'manager': 'wrf_hydro', 'action': 'sync'},
+        {'manager': 'ecmwf', 'action': 'download'},
+    ])
+    summary_path = str(tmpdir.join('summary.json'))
+
+    assert batch.main([spec_path, '--summary-file', summary_path]) == 1
+
+    assert capsys.readouterr().out == ""
+    with open(summary_path) as summary_file:
+        summary = json.load(summary_file)
+    assert summary['failed'] == 3
+    assert [job['error'].split(":")[0] for job in summary['jobs']] == \
+        ['OSError', 'ValueError', 'KeyError']
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""test_cache.py
+    spt_dataset_manager
+
+    Tests for the archive cache.
+
+    License: BSD-3 Clause
+"""
+import os
+
+import pytest
+
+from spt_dataset_manager.cache import ArchiveCache
+
+_RESOURCE_INFO = {'id': 'resource-1', 'url': 'http://ckan/resource-1.zip',
+                  'created': '2015-04-05T12:00:00'}
+
+
+def _write(file_path, content):
+    with open(file_path, 'wb') as output_file:
+        output_file.write(content)
+
+
+def test_checkout_survives_eviction(tmpdir):
+    cache = ArchiveCache(str(tmpdir.join('cache')), max_bytes=0)
+    archive_path = str(tmpdir.join('download.zip'))
+    _write(archive_path, b'archive')
+    object_path = cache.put(_RESOURCE_INFO, archive_path)
+    assert not os.path.exists(archive_path)
+
+    checkout_path = str(tmpdir.join('extract.zip'))
+    assert cache.checkout(_RESOURCE_INFO, checkout_path)
+    # another process evicts the archive before it is extracted
+    os.remove(object_path)
+    with open(checkout_path, 'rb') as checkout_file:
+        assert checkout_file.read() == b'archive'
+
+
+def test_checkout_missing_or_changed_resource(tmpdir):
+    cache = ArchiveCache(str(tmpdir.join('cache')))
+    checkout_path = str(tmpdir.join('extract.zip'))
+    assert not cache.checkout(_RESOURCE_INFO, checkout_path)
+
+    archive_path = str(tmpdir.join('download.zip'))
+    _write(archive_path, b'archive')
+    cache.put(_RESOURCE_INFO, archive_path)
+    changed_info = dict(_RESOURCE_INFO, created='2015-04-06T00:00:00')
+    assert not cache.checkout(changed_info, checkout_path)
+    assert not os.path.exists(checkout_path)
+
+
+def test_overwritten_resource_is_not_served(tmpdir):
+    cache = ArchiveCache(str(tmpdir.join('cache')))
+    # a summary from the search index at a stable storage URL
+    resource_info = {'url': 'http://store/cycle/resource.tar.gz',
+                     'last_modified': '2015-04-05T12:00:00'}
+    archive_path = str(tmpdir.join('download.zip'))
+    _write(archive_path, b'archive')
+    cache.put(resource_info, archive_path)
+    assert cache.get(resource_info) is not None
+
+    for changed_field in ({'last_modified': '2015-04-05T13:00:00'},
+                          {'size': 100}):
+        assert cache.get(dict(resource_info, **changed_field)) is None
+
+
+def test_eviction_removes_least_recently_used(tmpdir, monkeypatch):
+    from spt_dataset_manager import cache as cache_module
+    walk_calls = []
+    walk = cache_module.os.walk
+    monkeypatch.setattr(cache_module.os, 'walk',
+                        lambda *args: walk_calls.append(args) or walk(*args))
+    cache = ArchiveCache(str(tmpdir.join('cache')), max_bytes=3500)
+    object_paths = []
+
+    def put(number):
+        archive_path = str(tmpdir.join('download.zip'))
+        _write(archive_path, os.urandom(1000))
+        object_paths.append(
+            cache.put(dict(_RESOURCE_INFO, id='resource-%d' % number),
+                      archive_path))
+
+    for number in range(3):
+        put(number)
+        os.utime(object_paths[-1], (number, number))
+    # only the new cache is listed, then the running size is used
+    assert len(walk_calls) == 1
+    assert cache.get(dict(_RESOURCE_INFO, id='resource-0')) is not None
+
+    put(3)
+    assert len(walk_calls) == 2
+    # resource-1 was used least recently (resource-0 was read by get)
+    assert [os.path.exists(object_path) for object_path in object_paths] \
+        == [True, False, True, True]
+
+
+def test_manager_downloads_overwritten_stored_resource(tmpdir,
+                                                       ckan_servers):
+    pytest.importorskip("tethys_dataset_services")
+    from spt_dataset_manager.dataset_manager import \
+        WRFHydroHRRRDatasetManager
+    from spt_dataset_manager.storage import FileSystemStorage
+    ckan = ckan_servers()
+    manager = WRFHydroHRRRDatasetManager(
+        ckan.url, 'key',
+        storage=FileSystemStorage(str(tmpdir.join('store'))),
+        archive_cache=ArchiveCache(str(tmpdir.join('cache'))))
+    manager.initialize_run('usa', 'usa', '20150405T2300Z')
+    forecast_directory = tmpdir.mkdir('forecast')
+
+    urls = []
+    for number, content in enumerate(('first', 'second')):
+        forecast_directory.join('Qout.nc').write(content)
+        manager.zip_upload_directory(str(forecast_directory),
+                                     overwrite=True)
+        resources = manager.get_dataset_summary()['resources']
+        urls.append(resources[0]['url'])
+        extract_directory = tmpdir.join('extract%d' % number)
+        manager.download_resource_from_info(str(extract_directory),
+                                            resources)
+        assert extract_directory.join('Qout.nc').read() == content
+    assert urls[0] == urls[1]
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""test_ecmwf.py
+    spt_dataset_manager
+
+    Tests for the ECMWF forecast uploads.
+
+    License: BSD-3 Clause
+"""
+import datetime
+import json
+import os
+
+import pytest
+
+pytest.importorskip("tethys_dataset_services")
+
+from spt_dataset_manager.dataset_manager import ECMWFRAPIDDatasetManager
+
+
+def _write_cycles(source_directory, date_strings, num_ensembles=2,
+                  folder_name='nile-basin'):
+    for date_string in date_strings:
+        cycle_directory = source_directory.join(folder_name, date_string)
+        for ensemble_number in range(1, num_ensembles + 1):
+            cycle_directory.ensure('Qout_nile_%d.nc' % ensemble_number)\
+                .write('qout')
+
+
+def test_watermark_stops_at_failed_cycle(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    watermark_file = str(tmpdir.join('watermark.json'))
+    # complete cycles
+    _write_cycles(source_directory, ('20150404.0', '20150404.12',
+                                     '20150405.0'), 52)
+
+    ckan.fail_resources.add('erfp-nile-basin-20150404.12-2')
+    manager.zip_upload_resources(str(source_directory),
+                                 watermark_file=watermark_file)
+    with open(watermark_file) as watermark:
+        assert json.load(watermark) == {'nile-basin': '2015-04-04T00:00:00'}
+
+    ckan.fail_resources.clear()
+    manager.zip_upload_resources(str(source_directory),
+                                 watermark_file=watermark_file)
+    with open(watermark_file) as watermark:
+        assert json.load(watermark) == {'nile-basin': '2015-04-05T00:00:00'}
+
+
+def test_watermark_stops_at_partial_cycle(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    watermark_file = str(tmpdir.join('watermark.json'))
+    _write_cycles(source_directory, ('20150404.0',), 52)
+    # the newest cycle is still being written
+    _write_cycles(source_directory, ('20150404.12',), 20)
+    manager.zip_upload_resources(str(source_directory),
+                                 watermark_file=watermark_file)
+    with open(watermark_file) as watermark:
+        assert json.load(watermark) == {'nile-basin': '2015-04-04T00:00:00'}
+
+    _write_cycles(source_directory, ('20150404.12',), 52)
+    manager.zip_upload_resources(str(source_directory),
+                                 watermark_file=watermark_file)
+    with open(watermark_file) as watermark:
+        assert json.load(watermark) == {'nile-basin': '2015-04-04T12:00:00'}
+    assert len(ckan.get_resource_names(manager.dataset_name)) == 52
+
+
+def test_unchanged_warning_points_summary_is_not_patched(tmpdir,
+                                                          ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    _write_cycles(source_directory, ('20150404.0',))
+    source_directory.join('nile-basin', '20150404.0',
+                          'return_10_points.geojson').write(json.dumps({
+                              'features': [{
+                                  'geometry': {'type': 'Point',
+                                               'coordinates': [30.1, 1.5]},
+                                  'properties': {'peak': 12.5}}]}))
+
+    manager.zip_upload_resources(str(source_directory))
+    assert ckan.actions.count('package_patch') == 1
+    manager.zip_upload_resources(str(source_directory))
+    assert ckan.actions.count('package_patch') == 1
+    summary = json.loads(manager.get_dataset_extras()[
+        manager.get_summary_extra_key()])
+    assert summary['return_periods']['10']['count'] == 1
+
+
+def test_warning_points_summary_is_stored_on_upload(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    _write_cycles(source_directory, ('20150404.0',))
+    cycle_directory = source_directory.join('nile-basin', '20150404.0')
+    for return_period, coordinates, peak in ((2, [[30.1, 1.5],
+                                                  [31.5, -0.5]], 7),
+                                             (10, [[30.5, 1.0]], 12.5)):
+        cycle_directory.join('return_%d_points.geojson' % return_period)\
+            .write(json.dumps({'features': [{
+                'geometry': {'type': 'Point', 'coordinates': position},
+                'properties': {'peak': peak, 'comid': 1}}
+                for position in coordinates]}))
+    manager.zip_upload_resources(str(source_directory))
+
+    return_periods = {
+        '2': {'count': 2, 'bbox': [30.1, -0.5, 31.5, 1.5],
+              'peaks': {'peak': 7}},
+        '10': {'count': 1, 'bbox': [30.5, 1.0, 30.5, 1.0],
+               'peaks': {'peak': 12.5}},
+    }
+    dataset = manager.get_dataset_info()
+    for resource in dataset['resources']:
+        if 'warning_points' in resource['name']:
+            return_period = resource['name'].split('_')[-1]
+            assert json.loads(resource['warning_points_summary']) == \
+                return_periods[return_period]
+    assert [extra['key'] for extra in dataset['extras']] == \
+        [manager.get_summary_extra_key()]
+    assert manager.get_warning_points_summary('Nile', 'Basin',
+                                              '20150404.0') == \
+        {'forecast_date': '20150404.0', 'return_periods': return_periods}
+    assert manager.get_warning_points_summary('nile', 'basin',
+                                              '20150404.1200') is None
+
+
+def test_summaries_use_projected_search_fields(tmpdir, ckan_servers):
+    from spt_dataset_manager.dataset_manager import ResourceSummary
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    _write_cycles(source_directory, ('20150404.0', '20150404.12'))
+    manager.zip_upload_resources(str(source_directory))
+    del ckan.searches[:]
+
+    manager.initialize_run_ecmwf('nile', 'basin', '20150404.0')
+    summary = manager.get_dataset_summary()
+
+    # the search index fields only, no resource dictionaries
+    assert ckan.searches[0]['fl'] == \
+        "id,name,num_resources,metadata_modified," \
+        "res_name,res_url,res_format"
+    assert summary['num_resources'] == 2
+    assert all(isinstance(resource, ResourceSummary)
+               for resource in summary['resources'])
+    resources = manager._get_dataset_resources()
+    assert [(resource['name'], resource['url'], resource['format'])
+            for resource in summary['resources']] == \
+        [(resource['name'], resource['url'], resource['format'])
+         for resource in resources]
+
+    dataset_names = [manager.dataset_name]
+    manager.initialize_run_ecmwf('nile', 'basin', '20150404.12')
+    dataset_names.append(manager.dataset_name)
+    del ckan.searches[:]
+    summaries = manager.search_dataset_summaries(dataset_names + ['other'])
+    assert len(ckan.searches) == 1
+    assert sorted(summaries) == sorted(dataset_names)
+    assert [resource['name'] for resource in
+            summaries[manager.dataset_name]['resources']] == \
+        ['erfp-nile-basin-20150404.12-1', 'erfp-nile-basin-20150404.12-2']
+
+
+def _get_recent_date_strings(num_cycles):
+    # the date_strings of download_recent_resources, newest first
+    now = datetime.datetime.utcnow()
+    date_strings = []
+    for iteration in range(num_cycles):
+        today = now - datetime.timedelta(hours=12 * iteration)
+        date_strings.append('%s.%s' % (today.strftime("%Y%m%d"),
+                                       '12' if today.hour > 11 else '0'))
+    return date_strings
+
+
+def test_recent_cycles_of_many_watersheds(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    newest_cycle, older_cycle = _get_recent_date_strings(2)
+    _write_cycles(source_directory, (older_cycle,), 52)
+    # the newest nile cycle is partial and the amazon one is complete
+    _write_cycles(source_directory, (newest_cycle,), 20)
+    _write_cycles(source_directory, (newest_cycle,), 52, 'amazon-basin')
+    manager.zip_upload_resources(str(source_directory))
+
+    extract_directory = tmpdir.mkdir('extract')
+    num_searches = len(ckan.searches)
+    results = manager.download_recent_resources(
+        [('Nile', 'Basin'), ('amazon', 'basin'), ('congo', 'basin')],
+        str(extract_directory))
+    download_date_strings = [date_string.replace('.12', '.1200')
+                             for date_string in (newest_cycle, older_cycle)]
+    assert results == [
+        {'watershed': 'nile', 'subbasin': 'basin',
+         'date_string': download_date_strings[1], 'downloaded': 52},
+        {'watershed': 'amazon', 'subbasin': 'basin',
+         'date_string': download_date_strings[0], 'downloaded': 52},
+        {'watershed': 'congo', 'subbasin': 'basin',
+         'date_string': None, 'downloaded': 0},
+    ]
+    # one combined search per cycle for all of the watersheds
+    assert len(ckan.searches) - num_searches == 12
+    for result in results[:2]:
+        cycle_directory = extract_directory.join(
+            '%s-basin' % result['watershed'], result['date_string'])
+        assert len(os.listdir(str(cycle_directory))) == 52
+
+    assert [result['downloaded'] for result in
+            manager.download_recent_resources([('nile', 'basin')],
+                                              str(extract_directory))] == \
+        [-1]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""test_extraction.py
+    spt_dataset_manager
+
+    Tests for the archive extraction.
+
+    License: BSD-3 Clause
+"""
+import os
+import sys
+
+import pytest
+
+from spt_dataset_manager.dataset_manager import (extract_archive,
+                                                 get_extraction_pool,
+                                                 write_tarfile)
+
+
+def _write_archive(tmpdir):
+    file_path = str(tmpdir.join('Qout_1.nc'))
+    with open(file_path, 'wb') as output_file:
+        output_file.write(b'qout')
+    return write_tarfile(str(tmpdir.join('cycle.tar.gz')), [file_path])
+
+
+def test_extract_archive(tmpdir):
+    archive_path = _write_archive(tmpdir)
+    extract_archive(archive_path, str(tmpdir.join('extract')), 'tar.gz')
+    assert os.listdir(str(tmpdir.join('extract'))) == ['Qout_1.nc']
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="the start method is chosen from Python 3.7")
+def test_extraction_pool_is_shared(tmpdir):
+    extraction_pool = get_extraction_pool(2)
+    assert get_extraction_pool(2) is extraction_pool
+    assert extraction_pool._mp_context.get_start_method() in \
+        ('forkserver', 'spawn')
+    archive_path = _write_archive(tmpdir)
+    extraction_pool.submit(extract_archive, archive_path,
+                           str(tmpdir.join('extract')), 'tar.gz').result(60)
+    assert os.listdir(str(tmpdir.join('extract'))) == ['Qout_1.nc']
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""test_geoserver.py
+    spt_dataset_manager
+
+    Tests for the GeoServer manager with the catalog snapshot.
+
+    License: BSD-3 Clause
+"""
+import pytest
+
+engines = pytest.importorskip("tethys_dataset_services.engines")
+
+from spt_dataset_manager.dataset_manager import GeoServerDatasetManager
+
+_WORKSPACE = 'spt-app'
+
+
+class _Catalog(object):
+    def get_layergroups(self, workspaces=None):
+        return []
+
+
+class _FakeGeoServerEngine(object):
+    """
+    Records the REST calls of the manager. The list calls fail while
+    fail_lists is True.
+    """
+    fail_lists = False
+    workspaces = [_WORKSPACE]
+    layers = []
+
+    def __init__(self, endpoint, username, password):
+        self.calls = []
+        self.catalog = _Catalog()
+
+    def validate(self):
+        pass
+
+    def _list(self, names):
+        if self.fail_lists:
+            return {'success': False, 'error': 'unavailable'}
+        return {'success': True, 'result': list(names)}
+
+    def list_workspaces(self):
+        return self._list(self.workspaces)
+
+    def list_layers(self):
+        return self._list("{0}:{1}".format(_WORKSPACE, layer_name)
+                          for layer_name in self.layers)
+
+    def list_resources(self, workspace=None):
+        return self._list(self.layers)
+
+    def list_stores(self, workspace=None):
+        return self._list(self.layers)
+
+    def __getattr__(self, name):
+        # create_workspace, delete_layer, create_shapefile_resource, ...
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return {'success': True, 'result': {}}
+        return call
+
+
+@pytest.fixture
+def fake_engine(monkeypatch):
+    monkeypatch.setattr(engines, 'GeoServerSpatialDatasetEngine',
+                        _FakeGeoServerEngine)
+    monkeypatch.setattr(_FakeGeoServerEngine, 'fail_lists', False)
+    monkeypatch.setattr(_FakeGeoServerEngine, 'layers', [])
+    return _FakeGeoServerEngine
+
+
+def _create_manager():
+    return GeoServerDatasetManager('http://geoserver/geoserver/rest',
+                                   'admin', 'geoserver', 'app',
+                                   catalog_ttl=300)
+
+
+def test_existing_workspace_is_not_created(fake_engine):
+    manager = _create_manager()
+    assert 'create_workspace' not in manager.dataset_engine.calls
+
+
+def test_workspace_is_created_if_snapshot_fails(fake_engine):
+    fake_engine.fail_lists = True
+    manager = _create_manager()
+    assert manager.dataset_engine.calls == ['create_workspace']
+
+
+def test_purge_of_missing_layer_is_skipped(fake_engine):
+    manager = _create_manager()
+    manager.purge_remove_geoserver_layer('spt-app:missing')
+    assert manager.dataset_engine.calls == []
+
+
+def test_purge_of_existing_layer(fake_engine):
+    fake_engine.layers = ['flood_map']
+    manager = _create_manager()
+    manager.purge_remove_geoserver_layer('spt-app:flood_map')
+    calls = manager.dataset_engine.calls
+    assert calls[:3] == ['delete_layer', 'delete_resource', 'delete_store']
+    assert 'create_shapefile_resource' in calls
+    assert calls.count('delete_layer') == 2
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""test_import.py
+    spt_dataset_manager
+
+    Importing the package must not load the CKAN/GeoServer engines.
+
+    License: BSD-3 Clause
+"""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+_CHECK_IMPORT = textwrap.dedent("""
+    import sys
+    import spt_dataset_manager
+    heavy_modules = [name for name in ('tethys_dataset_services',
+                                       'requests', 'requests_toolbelt')
+                     if name in sys.modules]
+    print(",".join(heavy_modules))
+""")
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="the classes are loaded eagerly before 3.7")
+def test_import_does_not_load_engines():
+    # a fresh interpreter so other tests' imports do not count
+    heavy_modules = subprocess.check_output(
+        [sys.executable, "-c", _CHECK_IMPORT],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))\
+        .decode().strip()
+    assert heavy_modules == ""
+
+
+def test_manager_classes_load_on_access():
+    import spt_dataset_manager
+    assert spt_dataset_manager.ECMWFRAPIDDatasetManager.__name__ == \
+        'ECMWFRAPIDDatasetManager'
+    with pytest.raises(AttributeError):
+        spt_dataset_manager.NotAManager
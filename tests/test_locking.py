@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""test_locking.py
+    spt_dataset_manager
+
+    Tests for the lock files and the coalesced downloads.
+
+    License: BSD-3 Clause
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from spt_dataset_manager.locking import FileLock, fcntl, get_lock_path
+from spt_dataset_manager.singleflight import SingleFlight
+
+pytestmark = pytest.mark.skipif(fcntl is None,
+                                reason="lock files are removed on POSIX")
+
+
+def test_waiter_locks_new_file_after_removal(tmpdir):
+    lock_path = str(tmpdir.join('.cycle.lock'))
+    holder = FileLock(lock_path)
+    holder.acquire()
+    waiter = FileLock(lock_path)
+    waiter_thread = threading.Thread(target=waiter.acquire)
+    waiter_thread.start()
+    # the waiter blocks on the file that is removed
+    time.sleep(0.2)
+    holder.release(remove=True)
+    waiter_thread.join(5)
+    assert waiter.locked
+    assert os.path.exists(lock_path)
+    # a new caller is excluded by the waiter's lock
+    assert not FileLock(lock_path).acquire(blocking=False)
+    waiter.release()
+
+
+def test_shared_lock_is_not_removed(tmpdir):
+    lock_path = str(tmpdir.join('.cycle.lock'))
+    reader = FileLock(lock_path, shared=True)
+    reader.acquire()
+    reader.release(remove=True)
+    assert os.path.exists(lock_path)
+
+
+def test_single_flight_removes_lock_file(tmpdir):
+    lock_path = str(tmpdir.join('.cycle.lock'))
+    assert SingleFlight().do('cycle', lambda: 3, lock_path) == 3
+    assert not os.path.exists(lock_path)
+    with pytest.raises(ValueError):
+        SingleFlight().do('cycle', lambda: int('x'), lock_path)
+    assert not os.path.exists(lock_path)
+
+
+def _run_callers(single_flight, key, function, num_callers=2,
+                 lock_path=None):
+    results = []
+
+    def call():
+        try:
+            results.append(single_flight.do(key, function, lock_path))
+        except Exception as ex:
+            results.append(ex)
+
+    threads = [threading.Thread(target=call) for _ in range(num_callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_callers_share_one_download():
+    started = threading.Event()
+    finish = threading.Event()
+    downloads = []
+
+    def download():
+        downloads.append(1)
+        started.set()
+        finish.wait(5)
+        return 'Qout.nc'
+
+    single_flight = SingleFlight()
+    threads, results = _run_callers(single_flight, 'cycle', download)
+    assert started.wait(5)
+    # the second caller waits for the running download
+    time.sleep(0.2)
+    finish.set()
+    for thread in threads:
+        thread.join(5)
+    assert downloads == [1]
+    assert results == ['Qout.nc', 'Qout.nc']
+
+    # a later call runs again
+    assert single_flight.do('cycle', lambda: 'again') == 'again'
+
+
+def test_concurrent_callers_share_the_error():
+    def download():
+        time.sleep(0.2)
+        raise IOError("Download failed")
+
+    threads, results = _run_callers(SingleFlight(), 'cycle', download)
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 2
+    assert results[0] is results[1]
+    assert isinstance(results[0], IOError)
+
+
+def test_lock_file_serializes_other_processes(tmpdir):
+    lock_path = str(tmpdir.join('.cycle.lock'))
+    events = []
+
+    def download(name):
+        def run():
+            events.append(('start', name))
+            time.sleep(0.2)
+            events.append(('end', name))
+            return name
+        return run
+
+    # separate SingleFlights do not share calls, like two processes
+    threads = []
+    for name in ('first', 'second'):
+        thread_flight = SingleFlight()
+        new_threads, _ = _run_callers(thread_flight, 'cycle',
+                                      download(name), 1, lock_path)
+        threads += new_threads
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(5)
+    assert events == [('start', 'first'), ('end', 'first'),
+                      ('start', 'second'), ('end', 'second')]
+
+
+def test_file_download_holds_cycle_lock(tmpdir, monkeypatch, ckan_servers):
+    dataset_manager = pytest.importorskip("spt_dataset_manager."
+                                          "dataset_manager")
+    cycle_directory = str(tmpdir.join('nile-basin', '20150405.0'))
+    os.makedirs(cycle_directory)
+    held = []
+
+    def download(manager, check_location, extract_directory,
+                 resource_info_array):
+        held.append(not FileLock(get_lock_path(cycle_directory))
+                    .acquire(blocking=False))
+        held.append(os.listdir(cycle_directory))
+        return 1
+
+    monkeypatch.setattr(dataset_manager.CKANDatasetManager,
+                        '_download_resource_from_info', download)
+    manager = dataset_manager.ECMWFRAPIDDatasetManager(ckan_servers().url,
+                                                       'key')
+    assert manager.download_resource_from_info(
+        cycle_directory, [{}], 'return_2_points.geojson') == 1
+    # the lock is kept next to the cycle
+    assert held == [True, []]
+    assert sorted(os.listdir(str(tmpdir.join('nile-basin')))) == \
+        ['.locks', '20150405.0']
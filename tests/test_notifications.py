@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""test_notifications.py
+    spt_dataset_manager
+
+    Tests for the cycle complete notifications over local transports.
+
+    License: BSD-3 Clause
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+from spt_dataset_manager.notifications import (CycleListener, FileQueueSink,
+                                               UnixSocketSink, WebhookSink,
+                                               create_cycle_complete_event)
+
+
+class _RecordingManager(object):
+    """
+    Records the cycles the listener downloads
+    """
+    model_name = 'wrfp'
+
+    def __init__(self):
+        self.downloads = []
+        self.downloaded = threading.Event()
+
+    def download_cycle(self, watershed, subbasin, date_string,
+                       main_extract_directory):
+        self.downloads.append((watershed, subbasin, date_string))
+        self.downloaded.set()
+        return 1
+
+
+def _create_event(model_name='wrfp', watershed='USA'):
+    return create_cycle_complete_event(model_name, watershed, 'usa',
+                                       '20150405T2300Z', 'dataset', 1)
+
+
+@pytest.fixture
+def listener(tmpdir):
+    manager = _RecordingManager()
+    cycle_listener = CycleListener(manager, str(tmpdir.join('extract')),
+                                   watersheds=[('usa', 'usa')])
+    yield cycle_listener
+    cycle_listener.stop()
+
+
+def test_webhook(listener):
+    pytest.importorskip("requests")
+    server = listener.serve_webhook('127.0.0.1', 0)
+    WebhookSink("http://127.0.0.1:{0}/spt-events"
+                .format(server.server_port)).send(_create_event())
+
+    assert listener.manager.downloaded.wait(10)
+    assert listener.manager.downloads == [('usa', 'usa', '20150405T2300Z')]
+
+
+def test_unix_socket(tmpdir, listener):
+    if not hasattr(socket, 'AF_UNIX'):
+        pytest.skip("Unix sockets are not available")
+    socket_path = str(tmpdir.join('events.sock'))
+    listener.serve_unix_socket(socket_path)
+    sink = UnixSocketSink(socket_path)
+    sink.send(_create_event(watershed='other'))
+    sink.send(_create_event())
+
+    assert listener.manager.downloaded.wait(10)
+    listener.stop()
+    assert listener.manager.downloads == [('usa', 'usa', '20150405T2300Z')]
+    assert not os.path.exists(socket_path)
+
+
+def test_file_queue(tmpdir, listener):
+    queue_directory = str(tmpdir.join('queue'))
+    sink = FileQueueSink(queue_directory)
+    for event in (_create_event('erfp'), _create_event(),
+                  _create_event(watershed='other')):
+        sink.send(event)
+
+    results = listener.process_file_queue(queue_directory)
+
+    assert [(event['model'], event['watershed'], result)
+            for event, result in results] == [('erfp', 'USA', None),
+                                              ('wrfp', 'USA', 1),
+                                              ('wrfp', 'other', None)]
+    assert listener.manager.downloads == [('usa', 'usa', '20150405T2300Z')]
+    assert os.listdir(queue_directory) == []
+
+
+def test_upload_notifies_listener(tmpdir, ckan_servers):
+    pytest.importorskip("tethys_dataset_services")
+    from spt_dataset_manager.dataset_manager import \
+        WRFHydroHRRRDatasetManager
+    ckan = ckan_servers()
+    queue_directory = str(tmpdir.join('queue'))
+    manager = WRFHydroHRRRDatasetManager(
+        ckan.url, 'key', notification_sinks=[FileQueueSink(queue_directory)])
+    forecast_file = tmpdir.join('RapidResult_20150405T2300Z_CF.nc')
+    forecast_file.write('qout')
+    manager.zip_upload_resource(str(forecast_file), 'usa', 'usa')
+
+    main_extract_directory = str(tmpdir.join('extract'))
+    listener = CycleListener(WRFHydroHRRRDatasetManager(ckan.url, 'key'),
+                             main_extract_directory)
+    try:
+        results = listener.process_file_queue(queue_directory)
+    finally:
+        listener.stop()
+
+    assert [result for _, result in results] == [1]
+    extracted_files = [file_name for _, _, file_names
+                       in os.walk(main_extract_directory)
+                       for file_name in file_names]
+    assert extracted_files == ['RapidResult_20150405T2300Z_CF.nc']
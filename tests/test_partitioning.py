@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""test_partitioning.py
+    spt_dataset_manager
+
+    Tests for the datasets grouping the forecast cycles of a watershed.
+
+    License: BSD-3 Clause
+"""
+import datetime
+import os
+
+import pytest
+
+from spt_dataset_manager.partitioning import (get_partitioning,
+                                              parse_partition_key)
+
+
+def test_partition_keys_of_every_partitioning():
+    assert parse_partition_key('20150404t12') == \
+        (datetime.datetime(2015, 4, 4, 12), datetime.datetime(2015, 4, 4, 12))
+    assert parse_partition_key('20150404') == \
+        (datetime.datetime(2015, 4, 4), datetime.datetime(2015, 4, 5))
+    assert parse_partition_key('201512') == \
+        (datetime.datetime(2015, 12, 1), datetime.datetime(2016, 1, 1))
+    with pytest.raises(ValueError):
+        parse_partition_key('2015')
+    with pytest.raises(ValueError):
+        get_partitioning('year', "%Y%m%dt%H")
+
+
+@pytest.mark.parametrize("partitioning, dataset_name", [
+    ('day', 'erfp-nile-basin-20150430'),
+    ('month', 'erfp-nile-basin-201504'),
+])
+def test_cycles_round_trip(tmpdir, ckan_servers, partitioning,
+                           dataset_name):
+    pytest.importorskip("tethys_dataset_services")
+    from spt_dataset_manager.dataset_manager import ECMWFRAPIDDatasetManager
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key',
+                                       partitioning=partitioning)
+    source_directory = tmpdir.mkdir('output')
+    for date_string in ('20150430.0', '20150430.12'):
+        cycle_directory = source_directory.join('nile-basin', date_string)
+        for ensemble_number in (1, 2):
+            cycle_directory.ensure('Qout_nile_%d.nc' % ensemble_number)\
+                .write(date_string)
+    manager.zip_upload_resources(str(source_directory))
+    # both cycles in one dataset
+    assert len(ckan.get_resource_names(dataset_name)) == 4
+
+    extract_directory = tmpdir.mkdir('extract')
+    for date_string in ('20150430.0', '20150430.1200'):
+        assert manager.download_cycle('nile', 'basin', date_string,
+                                      str(extract_directory),
+                                      force=True) == 2
+        assert manager.dataset_name == dataset_name
+        cycle_directory = extract_directory.join('nile-basin', date_string)
+        assert sorted(os.listdir(str(cycle_directory))) == \
+            ['Qout_nile_1.nc', 'Qout_nile_2.nc']
+        assert cycle_directory.join('Qout_nile_1.nc').read() == \
+            date_string[:11]
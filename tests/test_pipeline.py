@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""test_pipeline.py
+    spt_dataset_manager
+
+    Tests for the compress-then-upload pipeline.
+
+    License: BSD-3 Clause
+"""
+import threading
+import time
+
+import pytest
+
+from spt_dataset_manager.pipeline import run_pipeline
+
+
+def test_results_in_order():
+    assert run_pipeline(range(5), lambda item: item * 2,
+                        lambda item, product: (item, product)) == \
+        [(item, item * 2) for item in range(5)]
+
+
+def test_produce_overlaps_consume():
+    consuming = threading.Event()
+    produced_while_consuming = []
+
+    def produce(item):
+        if item == 1:
+            # the first item is being uploaded
+            produced_while_consuming.append(consuming.wait(5))
+        return item
+
+    def consume(item, product):
+        consuming.set()
+        time.sleep(0.1)
+        return product
+
+    assert run_pipeline([0, 1], produce, consume) == [0, 1]
+    assert produced_while_consuming == [True]
+
+
+def test_queue_depth_bounds_waiting_products():
+    produced = []
+    max_waiting = []
+
+    def produce(item):
+        produced.append(item)
+        return item
+
+    def consume(item, product):
+        time.sleep(0.05)
+        # products handed over but not yet consumed
+        max_waiting.append(len(produced) - item - 1)
+        return product
+
+    run_pipeline(range(8), produce, consume, queue_depth=2)
+    # the queue plus the product waiting in the producer
+    assert max(max_waiting) <= 3
+
+
+def test_failed_produce_is_skipped(capsys):
+    def produce(item):
+        if item == 1:
+            raise IOError("Compression failed")
+        return item
+
+    assert run_pipeline(range(3), produce,
+                        lambda item, product: product) == [0, 2]
+    assert "Compression failed" in capsys.readouterr().out
+
+
+def test_failed_consume_stops_producer():
+    produced = []
+
+    def produce(item):
+        produced.append(item)
+        return item
+
+    def consume(item, product):
+        raise IOError("Upload failed")
+
+    with pytest.raises(IOError):
+        run_pipeline(range(100), produce, consume, queue_depth=1)
+    # the producer thread stopped without compressing every item
+    assert len(produced) < 100
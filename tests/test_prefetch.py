@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""test_prefetch.py
+    spt_dataset_manager
+
+    Tests for the scheduled downloads of new forecast cycles.
+
+    License: BSD-3 Clause
+"""
+import datetime
+import os
+
+from spt_dataset_manager.prefetch import (ECMWF_SCHEDULE, WRF_HYDRO_SCHEDULE,
+                                          PrefetchScheduler)
+
+_NOW = datetime.datetime(2015, 4, 5, 19, 0)
+
+
+class _FakeManager(object):
+    """
+    Downloads the cycles in available into the main extract directory
+    """
+    def __init__(self, available, calls):
+        self.available = available
+        self.calls = calls
+
+    def download_cycle(self, watershed, subbasin, date_string,
+                       main_extract_directory):
+        self.calls.append(date_string)
+        if date_string not in self.available:
+            return 0
+        cycle_directory = os.path.join(main_extract_directory,
+                                       '%s-%s' % (watershed, subbasin),
+                                       date_string)
+        if os.path.exists(cycle_directory):
+            return -1
+        os.makedirs(cycle_directory)
+        return 1
+
+
+def _schedule(tmpdir, available, calls):
+    return PrefetchScheduler(_FakeManager(available, calls),
+                             [('Nile', 'Basin')], str(tmpdir),
+                             ECMWF_SCHEDULE)
+
+
+def test_polls_due_cycles_newest_first(tmpdir):
+    calls = []
+    scheduler = _schedule(tmpdir, ['20150405.0'], calls)
+    # the 12 UTC cycle is due from 18 UTC
+    assert scheduler.run_pending(_NOW) == [('nile', 'basin', '20150405.0')]
+    assert calls == ['20150405.1200', '20150405.0']
+    assert scheduler.get_next_run(_NOW) == \
+        _NOW + ECMWF_SCHEDULE.poll_interval
+
+    scheduler.manager.available.append('20150405.1200')
+    assert scheduler.run_pending(_NOW) == \
+        [('nile', 'basin', '20150405.1200')]
+    # nothing is polled until the next cycle is published
+    del calls[:]
+    assert scheduler.get_next_run(_NOW) == \
+        datetime.datetime(2015, 4, 6, 6, 0)
+    assert scheduler.run_pending(_NOW) == []
+    assert calls == []
+
+
+def test_new_scheduler_skips_downloaded_cycles(tmpdir):
+    calls = []
+    _schedule(tmpdir, ['20150405.1200'], calls).run_pending(_NOW)
+    del calls[:]
+    # e.g. the next cron run
+    scheduler = _schedule(tmpdir, ['20150405.1200'], calls)
+    assert scheduler.run_pending(_NOW) == []
+    assert calls == []
+    assert scheduler.get_next_run(_NOW) == \
+        datetime.datetime(2015, 4, 6, 6, 0)
+
+
+def test_local_names_of_the_cycles(tmpdir):
+    scheduler = PrefetchScheduler(_FakeManager([], []), [('nile', 'basin')],
+                                  str(tmpdir), WRF_HYDRO_SCHEDULE)
+    assert not scheduler.is_downloaded('nile', 'basin', '20150405T1700Z')
+    tmpdir.ensure('nile-basin', 'RapidResult_20150405T1700Z_CF.nc')
+    assert scheduler.is_downloaded('nile', 'basin', '20150405T1700Z')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""test_profiling.py
+    spt_dataset_manager
+
+    Tests for the profiled manager operations.
+
+    License: BSD-3 Clause
+"""
+import os
+import pstats
+
+import pytest
+
+from spt_dataset_manager import profiling
+from spt_dataset_manager.profiling import (PROFILE_ENVIRONMENT_VARIABLE,
+                                           OperationProfiler, get_profiler,
+                                           profiled)
+
+
+@profiled
+class _Manager(object):
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+
+    def download(self):
+        return self.extract() + 1
+
+    def extract(self):
+        return 1
+
+    def fail(self):
+        raise IOError("Download failed")
+
+    def _helper(self):
+        return 'not profiled'
+
+
+def _read_log(output_directory):
+    with open(os.path.join(output_directory, 'operations.log')) as log_file:
+        return [line.rstrip('\n').split('\t') for line in log_file]
+
+
+def _fake_clock(monkeypatch, times):
+    times = iter(times)
+    monkeypatch.setattr(profiling, '_clock', lambda: next(times))
+
+
+def test_outermost_operation_is_timed_once(tmpdir, monkeypatch):
+    output_directory = str(tmpdir.join('profiles'))
+    _fake_clock(monkeypatch, [10.0, 12.5])
+    manager = _Manager(OperationProfiler(output_directory))
+    assert manager.download() == 2
+
+    log_lines = _read_log(output_directory)
+    assert len(log_lines) == 1
+    _, operation_name, elapsed_seconds, profile_path = log_lines[0]
+    assert operation_name == '_Manager.download'
+    assert elapsed_seconds == '2.500'
+    assert os.path.basename(profile_path).startswith('_Manager.download-')
+    # the nested operation is in the profile of the outer one
+    function_names = [function[2] for function
+                      in pstats.Stats(profile_path).stats]
+    assert 'extract' in function_names
+    assert sorted(os.listdir(output_directory)) == \
+        sorted(['operations.log', os.path.basename(profile_path)])
+
+
+def test_failed_operation_is_timed(tmpdir, monkeypatch):
+    output_directory = str(tmpdir.join('profiles'))
+    _fake_clock(monkeypatch, [0.0, 0.25, 1.0, 1.5])
+    manager = _Manager(OperationProfiler(output_directory))
+    with pytest.raises(IOError):
+        manager.fail()
+    # the depth is reset after the error
+    manager.extract()
+    assert [line[1:3] for line in _read_log(output_directory)] == \
+        [['_Manager.fail', '0.250'], ['_Manager.extract', '0.500']]
+
+
+def test_only_profiled_with_profiler(tmpdir, monkeypatch):
+    monkeypatch.delenv(PROFILE_ENVIRONMENT_VARIABLE, raising=False)
+    assert _Manager(get_profiler(None)).download() == 2
+    assert _Manager._helper is vars(_Manager)['_helper']
+    assert get_profiler(False) is None
+
+    monkeypatch.setenv(PROFILE_ENVIRONMENT_VARIABLE, str(tmpdir))
+    assert get_profiler(None).output_directory == str(tmpdir)
+    assert get_profiler(False) is None
+    profiler = OperationProfiler(str(tmpdir))
+    assert get_profiler(profiler) is profiler
+
+
+def test_invalid_profiler(tmpdir):
+    with pytest.raises(ValueError):
+        OperationProfiler(str(tmpdir), 'yappi')
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""test_rapid_input.py
+    spt_dataset_manager
+
+    Tests for the RAPID input uploads and incremental syncs.
+
+    License: BSD-3 Clause
+"""
+import datetime
+
+import pytest
+
+pytest.importorskip("tethys_dataset_services")
+
+from spt_dataset_manager.dataset_manager import RAPIDInputDatasetManager
+from spt_dataset_manager.delta import (LOCAL_MANIFEST_FILE, build_manifest,
+                                       read_local_manifest)
+
+
+def _write_input(source_directory, k_values):
+    source_directory.join('rapid_namelist_basin.dat').write('namelist')
+    source_directory.join('k.csv').write(k_values)
+
+
+def test_incremental_uploads_on_one_day(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = RAPIDInputDatasetManager(ckan.url, 'key', 'ecmwf', 'app')
+    source_directory = tmpdir.mkdir('nile')
+    _write_input(source_directory, '1')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+    first_base = manager.download_manifest()['base']
+    # the time of the full upload to the second
+    datetime.datetime.strptime(first_base, "%Y%m%dT%H%M%SZ")
+
+    for k_values in ('2', '3'):
+        _write_input(source_directory, k_values)
+        resource_info = manager.zip_upload_resource(str(source_directory),
+                                                    incremental=True)
+        assert resource_info['success']
+
+    manifest = manager.download_manifest()
+    assert manifest['deltas'] == [
+        'ecmwf-nile-basin-rapid-input-delta-%s-1' % first_base,
+        'ecmwf-nile-basin-rapid-input-delta-%s-2' % first_base]
+    resource_names = ckan.get_resource_names(manager.dataset_name)
+    assert set(manifest['deltas']) <= set(resource_names)
+
+
+def test_full_upload_has_no_manifest(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = RAPIDInputDatasetManager(ckan.url, 'key', 'ecmwf', 'app')
+    source_directory = tmpdir.mkdir('nile')
+    _write_input(source_directory, '1')
+    resource_info = manager.zip_upload_resource(str(source_directory))
+    assert resource_info['success']
+    assert ckan.get_resource_names(manager.dataset_name) == \
+        ['ecmwf-nile-basin-rapid-input']
+    assert 'resource_delete' not in ckan.actions
+
+
+def _read_files(directory):
+    return dict((relative_path,
+                 directory.join(relative_path).read())
+                for relative_path in build_manifest(str(directory)))
+
+
+def _sync(manager, extract_directory):
+    manager.sync_dataset(str(extract_directory), incremental=True)
+    return _read_files(extract_directory.join('nile-basin'))
+
+
+def test_deltas_are_applied_on_sync(tmpdir, ckan_servers, capsys):
+    ckan = ckan_servers()
+    manager = RAPIDInputDatasetManager(ckan.url, 'key', 'ecmwf', 'app')
+    source_directory = tmpdir.mkdir('nile')
+    extract_directory = tmpdir.mkdir('extract')
+    _write_input(source_directory, '1')
+    source_directory.join('x.csv').write('x')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+    assert _sync(manager, extract_directory) == \
+        _read_files(source_directory)
+
+    _write_input(source_directory, '2')
+    source_directory.join('x.csv').remove()
+    source_directory.join('n.csv').write('n')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+    capsys.readouterr()
+    assert _sync(manager, extract_directory) == \
+        _read_files(source_directory)
+    local_directory = extract_directory.join('nile-basin')
+    assert read_local_manifest(str(local_directory)) == \
+        manager.download_manifest()
+    # only the delta was downloaded
+    output = capsys.readouterr().out
+    assert 'APPLY DELTA' in output
+    assert 'Downloading and extracting' not in output
+
+
+def test_tampered_files_are_downloaded_again(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = RAPIDInputDatasetManager(ckan.url, 'key', 'ecmwf', 'app')
+    source_directory = tmpdir.mkdir('nile')
+    extract_directory = tmpdir.mkdir('extract')
+    _write_input(source_directory, '1')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+    _sync(manager, extract_directory)
+
+    extract_directory.join('nile-basin', 'rapid_namelist_basin.dat')\
+        .write('tampered')
+    _write_input(source_directory, '2')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+    local_directory = str(extract_directory.join('nile-basin'))
+    assert not manager.apply_deltas(local_directory,
+                                    manager.download_manifest(),
+                                    manager.get_dataset_info())
+    assert _sync(manager, extract_directory) == \
+        _read_files(source_directory)
+
+
+def test_missing_base_is_downloaded_again(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = RAPIDInputDatasetManager(ckan.url, 'key', 'ecmwf', 'app')
+    source_directory = tmpdir.mkdir('nile')
+    extract_directory = tmpdir.mkdir('extract')
+    _write_input(source_directory, '1')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+    _sync(manager, extract_directory)
+    _write_input(source_directory, '2')
+    manager.zip_upload_resource(str(source_directory), incremental=True)
+
+    local_directory = extract_directory.join('nile-basin')
+    local_directory.join(LOCAL_MANIFEST_FILE).remove()
+    assert not manager.apply_deltas(str(local_directory),
+                                    manager.download_manifest(),
+                                    manager.get_dataset_info())
+    assert _sync(manager, extract_directory) == \
+        _read_files(source_directory)
+    assert read_local_manifest(str(local_directory)) == \
+        manager.download_manifest()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""test_replication.py
+    spt_dataset_manager
+
+    Tests for the uploads replicated to several CKAN endpoints.
+
+    License: BSD-3 Clause
+"""
+import copy
+import os
+
+import pytest
+
+pytest.importorskip("tethys_dataset_services")
+
+from spt_dataset_manager.dataset_manager import WRFHydroHRRRDatasetManager
+from spt_dataset_manager.replication import (ReplicatedDatasetManager,
+                                             _clock)
+from spt_dataset_manager.retry_journal import RetryJournal
+
+_FILE_NAME = 'RapidResult_20150405T2300Z_CF.nc'
+
+
+def _write_forecast(tmpdir):
+    file_path = str(tmpdir.join(_FILE_NAME))
+    with open(file_path, 'wb') as forecast_file:
+        forecast_file.write(os.urandom(1000))
+    return file_path
+
+
+def test_failed_mirror_upload_is_retried_on_mirror(tmpdir, ckan_servers):
+    primary, mirror = ckan_servers(), ckan_servers()
+    retry_journal = RetryJournal(str(tmpdir.join('journal')), base_delay=0)
+    manager = ReplicatedDatasetManager.from_endpoints(
+        WRFHydroHRRRDatasetManager, [(primary.url, 'key'),
+                                     (mirror.url, 'key')],
+        retry_journal=retry_journal)
+
+    mirror.fail = True
+    manager.zip_upload_resource(_write_forecast(tmpdir), 'usa', 'usa')
+    mirror.fail = False
+    resource_name = 'wrfp-usa-usa-20150405T2300Z'
+    dataset_name = manager.primary.dataset_name
+    assert primary.get_resource_names(dataset_name) == [resource_name]
+    assert mirror.get_resource_names(dataset_name) == []
+    assert manager.upload_status[mirror.url]['failed'] == 1
+    tasks = retry_journal.get_tasks()
+    assert [task['engine_url'] for task in tasks] == [mirror.url]
+
+    num_primary_actions = len(primary.actions)
+    assert manager.retry_pending() == {'succeeded': [resource_name],
+                                       'failed': []}
+    assert mirror.get_resource_names(dataset_name) == [resource_name]
+    assert 'resource_create' not in primary.actions[num_primary_actions:]
+    assert retry_journal.get_tasks() == []
+
+
+def test_task_ids_differ_per_endpoint():
+    assert RetryJournal.get_task_id('dataset', 'resource', 'http://a') != \
+        RetryJournal.get_task_id('dataset', 'resource', 'http://b')
+    assert RetryJournal.get_task_id('dataset', 'resource') == \
+        RetryJournal.get_task_id('dataset', 'resource', None)
+
+
+class _FakeManager(object):
+    """
+    Records the calls to the read methods of a manager for one endpoint
+    """
+    def __init__(self, engine_url, results):
+        self.engine_url = engine_url
+        self.http_session = None
+        self.results = results
+        self.calls = []
+
+    def get_dataset_id(self):
+        self.calls.append('get_dataset_id')
+        return self.results.get('get_dataset_id')
+
+    def download_resource(self, extract_directory):
+        self.calls.append('download_resource')
+        result = self.results.get('download_resource')
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_manifest_name(self):
+        self.calls.append('get_manifest_name')
+        return 'manifest.json'
+
+
+def _replicate(*results):
+    managers = [_FakeManager('http://endpoint-{0}'.format(index), result)
+                for index, result in enumerate(results)]
+    replicated = ReplicatedDatasetManager(managers)
+    # the first endpoint is the fastest
+    for index, manager in enumerate(managers):
+        replicated._latencies[manager.engine_url] = (index, _clock())
+    return replicated, managers
+
+
+def test_helpers_are_not_routed_to_fastest():
+    replicated, managers = _replicate({}, {})
+    replicated._latencies.clear()
+    assert replicated.get_manifest_name() == 'manifest.json'
+    assert replicated._latencies == {}
+
+
+def test_read_fails_over_only_on_errors():
+    replicated, managers = _replicate(
+        {'download_resource': False},
+        {'download_resource': True})
+    assert replicated.download_resource('extract') is False
+    assert managers[1].calls == []
+
+    replicated, managers = _replicate(
+        {'download_resource': IOError('timed out')},
+        {'download_resource': True})
+    assert replicated.download_resource('extract') is True
+    assert managers[0].calls == managers[1].calls == ['download_resource']
+
+    replicated, managers = _replicate(
+        {'download_resource': IOError('timed out')},
+        {'download_resource': IOError('refused')})
+    with pytest.raises(IOError):
+        replicated.download_resource('extract')
+
+
+def test_lookup_fails_over_on_none():
+    replicated, managers = _replicate(
+        {}, {'get_dataset_id': 'dataset-id'})
+    assert replicated.get_dataset_id() == 'dataset-id'
+    assert managers[0].calls == managers[1].calls == ['get_dataset_id']
+
+
+def test_retried_uploads_are_no_longer_failed(tmpdir, ckan_servers):
+    primary, mirror = ckan_servers(), ckan_servers()
+    retry_journal = RetryJournal(str(tmpdir.join('journal')), base_delay=0)
+    manager = ReplicatedDatasetManager.from_endpoints(
+        WRFHydroHRRRDatasetManager, [(primary.url, 'key'),
+                                     (mirror.url, 'key')],
+        retry_journal=retry_journal)
+
+    mirror.fail = True
+    manager.zip_upload_resource(_write_forecast(tmpdir), 'usa', 'usa')
+    mirror.fail = False
+    manager.retry_pending()
+    assert manager.upload_status[mirror.url]['failed'] == 0
+    assert manager.upload_status[mirror.url]['succeeded'] == 1
+
+
+def test_copies_replicate_uploads(tmpdir, ckan_servers):
+    primary, mirror = ckan_servers(), ckan_servers()
+    manager = copy.copy(ReplicatedDatasetManager.from_endpoints(
+        WRFHydroHRRRDatasetManager, [(primary.url, 'key'),
+                                     (mirror.url, 'key')]))
+    assert manager.primary.replicator is manager
+    assert manager.managers[1].replicator is None
+
+    manager.zip_upload_resource(_write_forecast(tmpdir), 'usa', 'usa')
+    resource_name = 'wrfp-usa-usa-20150405T2300Z'
+    dataset_name = manager.primary.dataset_name
+    assert primary.get_resource_names(dataset_name) == [resource_name]
+    assert mirror.get_resource_names(dataset_name) == [resource_name]
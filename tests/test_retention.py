@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""test_retention.py
+    spt_dataset_manager
+
+    Tests for the removal of old forecast cycles.
+
+    License: BSD-3 Clause
+"""
+import os
+
+from spt_dataset_manager.locking import FileLock
+from spt_dataset_manager.retention import (ForecastRetention,
+                                           get_cycle_lock_path, reading)
+
+
+def _write_cycle(main_extract_directory, cycle_name):
+    cycle_directory = main_extract_directory.join('nile-basin', cycle_name)
+    cycle_directory.ensure('Qout_1.nc').write('qout')
+    return str(cycle_directory)
+
+
+def test_keeps_newest_cycles_and_locked_cycles(tmpdir):
+    retention = ForecastRetention(keep_cycles=1)
+    old_cycle = _write_cycle(tmpdir, '20150404.0')
+    retention.register(old_cycle)
+    with reading(old_cycle):
+        retention.register(_write_cycle(tmpdir, '20150405.0'))
+        assert os.path.exists(old_cycle)
+
+    removed_paths = retention.register(_write_cycle(tmpdir, '20150406.0'))
+    assert sorted(removed_paths) == \
+        [old_cycle, str(tmpdir.join('nile-basin', '20150405.0'))]
+    assert sorted(os.listdir(str(tmpdir.join('nile-basin')))) == \
+        ['.locks', '20150406.0']
+    assert os.listdir(str(tmpdir.join('nile-basin', '.locks'))) == []
+
+
+def test_removed_cycle_lock_excludes_new_callers(tmpdir):
+    retention = ForecastRetention(keep_cycles=1)
+    old_cycle = _write_cycle(tmpdir, '20150404.0')
+    retention.register(old_cycle)
+    retention.register(_write_cycle(tmpdir, '20150405.0'))
+    assert not os.path.exists(get_cycle_lock_path(old_cycle))
+
+    # a new download of the removed cycle
+    download_lock = FileLock(get_cycle_lock_path(old_cycle))
+    download_lock.acquire()
+    try:
+        assert os.path.exists(get_cycle_lock_path(old_cycle))
+        assert not FileLock(get_cycle_lock_path(old_cycle))\
+            .acquire(blocking=False)
+    finally:
+        download_lock.release()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""test_retry_journal.py
+    spt_dataset_manager
+
+    Tests for the journal of failed uploads and their replay.
+
+    License: BSD-3 Clause
+"""
+import os
+import time
+
+import pytest
+
+from spt_dataset_manager.retry_journal import RetryJournal
+
+
+def _record(journal, archive_path, resource_name='resource'):
+    return journal.record(archive_path, engine_url='http://ckan',
+                          model_name='wrfp', dataset_name='dataset',
+                          resource_name=resource_name, error='unavailable')
+
+
+def test_record_keeps_archive(tmpdir):
+    journal = RetryJournal(str(tmpdir.join('journal')))
+    archive = tmpdir.join('resource.tar.gz')
+    archive.write('archive')
+
+    task = _record(journal, str(archive))
+    archive.remove()
+
+    assert journal.get_due_tasks() == [task]
+    with open(journal.get_archive_path(task)) as archive_file:
+        assert archive_file.read() == 'archive'
+
+
+def test_recording_resource_again_replaces_task(tmpdir):
+    journal = RetryJournal(str(tmpdir.join('journal')))
+    archive = tmpdir.join('resource.tar.gz')
+    archive.write('first')
+    _record(journal, str(archive))
+    archive.remove()
+    archive.write('second')
+
+    task = _record(journal, str(archive))
+    _record(journal, str(archive), 'other_resource')
+
+    assert len(journal.get_tasks()) == 2
+    assert len(os.listdir(journal.journal_directory)) == 4
+    with open(journal.get_archive_path(task)) as archive_file:
+        assert archive_file.read() == 'second'
+
+    journal.complete(task)
+    assert [task['resource_name'] for task in journal.get_tasks()] == \
+        ['other_resource']
+    assert len(os.listdir(journal.journal_directory)) == 2
+
+
+def test_reschedule_backs_off_and_gives_up(tmpdir):
+    journal = RetryJournal(str(tmpdir.join('journal')), max_attempts=3,
+                           base_delay=60, max_delay=100)
+    archive = tmpdir.join('resource.tar.gz')
+    archive.write('archive')
+    task = _record(journal, str(archive))
+
+    delays = []
+    for _ in range(2):
+        before = time.time()
+        task = journal.reschedule(task, IOError("unavailable"))
+        delays.append(round(task['next_attempt'] - before, -1))
+        assert journal.get_due_tasks() == []
+    assert delays == [60, 100]
+    assert task['last_error'] == 'unavailable'
+
+    task = journal.reschedule(task)
+    assert task['status'] == 'failed'
+    assert journal.get_tasks('failed') == [task]
+    assert journal.get_tasks('pending') == []
+
+
+def test_manager_replays_failed_upload(tmpdir, ckan_servers):
+    pytest.importorskip("tethys_dataset_services")
+    from spt_dataset_manager.dataset_manager import \
+        WRFHydroHRRRDatasetManager
+    ckan = ckan_servers()
+    journal = RetryJournal(str(tmpdir.join('journal')), base_delay=0)
+    manager = WRFHydroHRRRDatasetManager(ckan.url, 'key',
+                                         retry_journal=journal)
+    forecast_file = tmpdir.join('RapidResult_20150405T2300Z_CF.nc')
+    forecast_file.write('qout')
+
+    ckan.fail = True
+    manager.zip_upload_resource(str(forecast_file), 'usa', 'usa')
+    ckan.fail = False
+    resource_name = 'wrfp-usa-usa-20150405T2300Z'
+    assert [task['resource_name'] for task in journal.get_tasks()] == \
+        [resource_name]
+
+    # a replay that fails again is rescheduled
+    ckan.fail = True
+    assert manager.retry_pending() == {'succeeded': [],
+                                       'failed': [resource_name]}
+    assert journal.get_tasks()[0]['attempts'] == 1
+    ckan.fail = False
+
+    # another manager (e.g. a cron job) replays the archive
+    retry_manager = WRFHydroHRRRDatasetManager(ckan.url, 'key',
+                                               retry_journal=journal)
+    assert retry_manager.retry_pending() == {'succeeded': [resource_name],
+                                             'failed': []}
+    assert journal.get_tasks() == []
+    assert os.listdir(journal.journal_directory) == []
+    assert ckan.get_resource_names(manager.dataset_name) == [resource_name]
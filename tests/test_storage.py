@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""test_storage.py
+    spt_dataset_manager
+
+    Tests for the object stores of the resource payloads.
+
+    License: BSD-3 Clause
+"""
+import os
+import sys
+import types
+
+import pytest
+
+from spt_dataset_manager.storage import FileSystemStorage, S3Storage
+
+
+def _write_payload(tmpdir, num_bytes):
+    payload = os.urandom(num_bytes)
+    file_path = str(tmpdir.join('payload.tar.gz'))
+    with open(file_path, 'wb') as payload_file:
+        payload_file.write(payload)
+    return file_path, payload
+
+
+def _check_round_trip(storage, tmpdir, num_bytes):
+    file_path, payload = _write_payload(tmpdir, num_bytes)
+    sent_bytes = []
+    url = storage.put(file_path, 'cycle/resource one.tar.gz',
+                      sent_bytes.append)
+    assert url == storage.get_url('cycle/resource one.tar.gz')
+    assert storage.owns(url)
+    assert not storage.owns('http://ckan/resource.tar.gz')
+    assert sum(sent_bytes) == num_bytes
+
+    local_file_path = str(tmpdir.join('download.tar.gz'))
+    storage.download(url, local_file_path)
+    with open(local_file_path, 'rb') as local_file:
+        assert local_file.read() == payload
+
+    storage.delete(url)
+    with pytest.raises(Exception):
+        storage.download(url, str(tmpdir.join('deleted.tar.gz')))
+
+
+def test_file_system_storage(tmpdir):
+    _check_round_trip(FileSystemStorage(str(tmpdir.join('store'))), tmpdir,
+                      3 * 1048576 + 1)
+
+
+def test_file_system_storage_base_url(tmpdir):
+    storage = FileSystemStorage(str(tmpdir.join('store')),
+                                'http://data.example/store/')
+    assert storage.get_url('cycle/resource one.tar.gz') == \
+        'http://data.example/store/cycle/resource%20one.tar.gz'
+    _check_round_trip(storage, tmpdir, 1000)
+
+
+def test_s3_storage_multipart(tmpdir, monkeypatch):
+    moto = pytest.importorskip("moto")
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    with moto.mock_aws():
+        storage = S3Storage('spt', prefix='forecasts',
+                            multipart_size=5 * 1048576, max_concurrency=4,
+                            region_name='us-east-1')
+        storage.client.create_bucket(Bucket='spt')
+        # three parts uploaded in parallel
+        _check_round_trip(storage, tmpdir, 12 * 1048576)
+        assert storage.get_url('cycle/a.tar.gz') == \
+            'https://spt.s3.amazonaws.com/forecasts/cycle/a.tar.gz'
+
+
+class _StubS3Client(object):
+    """
+    Keeps the objects of a boto3 S3 client in memory
+    """
+    def __init__(self, service_name, **client_options):
+        self.service_name = service_name
+        self.client_options = client_options
+        self.objects = {}
+        self.calls = []
+
+    def upload_file(self, file_path, bucket, key, Config=None,
+                    Callback=None):
+        self.calls.append(('upload_file', bucket, key, Config))
+        with open(file_path, 'rb') as upload_file:
+            self.objects[(bucket, key)] = upload_file.read()
+        if Callback is not None:
+            Callback(len(self.objects[(bucket, key)]))
+
+    def download_file(self, bucket, key, file_path, Config=None,
+                      Callback=None):
+        self.calls.append(('download_file', bucket, key, Config))
+        with open(file_path, 'wb') as download_file:
+            download_file.write(self.objects[(bucket, key)])
+
+    def delete_object(self, Bucket, Key):
+        self.calls.append(('delete_object', Bucket, Key, None))
+        self.objects.pop((Bucket, Key), None)
+
+
+class _StubTransferConfig(object):
+    def __init__(self, **options):
+        self.options = options
+
+
+@pytest.fixture
+def stub_boto3(monkeypatch):
+    """
+    Replaces boto3 with a module creating _StubS3Clients
+    """
+    boto3 = types.ModuleType('boto3')
+    boto3.client = _StubS3Client
+    boto3_s3 = types.ModuleType('boto3.s3')
+    boto3_transfer = types.ModuleType('boto3.s3.transfer')
+    boto3_transfer.TransferConfig = _StubTransferConfig
+    boto3.s3 = boto3_s3
+    boto3_s3.transfer = boto3_transfer
+    for module in (boto3, boto3_s3, boto3_transfer):
+        monkeypatch.setitem(sys.modules, module.__name__, module)
+    return boto3
+
+
+def test_s3_storage_with_stub_client(tmpdir, stub_boto3):
+    storage = S3Storage('spt', prefix='/forecasts/',
+                        endpoint_url='http://minio:9000/',
+                        multipart_size=1048576, max_concurrency=1,
+                        region_name='us-east-1')
+    assert storage.client.client_options == {
+        'endpoint_url': 'http://minio:9000/', 'region_name': 'us-east-1'}
+    assert storage.transfer_config.options == {
+        'multipart_threshold': 1048576, 'multipart_chunksize': 1048576,
+        'max_concurrency': 1, 'use_threads': False}
+    assert storage.get_url('cycle/resource one.tar.gz') == \
+        'http://minio:9000/spt/forecasts/cycle/resource%20one.tar.gz'
+    _check_round_trip(storage, tmpdir, 1000)
+    object_key = 'forecasts/cycle/resource one.tar.gz'
+    assert [call[:3] for call in storage.client.calls] == [
+        ('upload_file', 'spt', object_key),
+        ('download_file', 'spt', object_key),
+        ('delete_object', 'spt', object_key),
+        ('download_file', 'spt', object_key)]
+    assert storage.client.calls[0][3] is storage.transfer_config
+
+    storage = S3Storage('spt', public_base_url='https://cdn.example/spt/')
+    assert storage.get_url('cycle/a.tar.gz') == \
+        'https://cdn.example/spt/cycle/a.tar.gz'
+    assert storage.transfer_config.options['use_threads']
+
+
+def test_s3_storage_requires_boto3(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'boto3', None)
+    with pytest.raises(ImportError) as error:
+        S3Storage('spt')
+    assert 'FileSystemStorage' in str(error.value)
+
+
+def test_manager_registers_s3_payload(tmpdir, ckan_servers, stub_boto3):
+    pytest.importorskip("tethys_dataset_services")
+    from spt_dataset_manager.dataset_manager import \
+        WRFHydroHRRRDatasetManager
+    ckan = ckan_servers()
+    storage = S3Storage('spt', endpoint_url='http://minio:9000')
+    manager = WRFHydroHRRRDatasetManager(ckan.url, 'key', storage=storage)
+    forecast_file = tmpdir.join('RapidResult_20150405T2300Z_CF.nc')
+    forecast_file.write('qout')
+
+    manager.zip_upload_resource(str(forecast_file), 'usa', 'usa')
+
+    resource_info = manager.get_resource_info()
+    assert resource_info['url'] == storage.get_url(
+        '%s/%s.tar.gz' % (manager.dataset_name, manager.resource_name))
+    assert ckan.uploads == {}
+    extract_directory = str(tmpdir.join('extract'))
+    manager.download_resource_from_info(extract_directory, [resource_info])
+    assert os.listdir(extract_directory) == [
+        'RapidResult_20150405T2300Z_CF.nc']
+
+
+def test_manager_registers_stored_payload(tmpdir, ckan_servers):
+    pytest.importorskip("tethys_dataset_services")
+    from spt_dataset_manager.dataset_manager import \
+        WRFHydroHRRRDatasetManager
+    ckan = ckan_servers()
+    storage = FileSystemStorage(str(tmpdir.join('store')))
+    manager = WRFHydroHRRRDatasetManager(ckan.url, 'key', storage=storage)
+    forecast_file = tmpdir.join('RapidResult_20150405T2300Z_CF.nc')
+    forecast_file.write('qout')
+
+    manager.zip_upload_resource(str(forecast_file), 'usa', 'usa')
+
+    resource_info = manager.get_resource_info()
+    assert storage.owns(resource_info['url'])
+    # only the URL was sent to CKAN
+    assert ckan.uploads == {}
+    extract_directory = str(tmpdir.join('extract'))
+    manager.download_resource_from_info(extract_directory, [resource_info])
+    assert os.listdir(extract_directory) == [
+        'RapidResult_20150405T2300Z_CF.nc']
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""test_throttle.py
+    spt_dataset_manager
+
+    Tests for the bandwidth and concurrency limits.
+
+    License: BSD-3 Clause
+"""
+import socket
+import threading
+
+import pytest
+
+from spt_dataset_manager import throttle
+from spt_dataset_manager.throttle import (AdaptiveConcurrencyLimiter,
+                                          TokenBucket, TransferRequest)
+
+
+class _FakeClock(object):
+    """
+    Time that only moves when the code sleeps or the test advances it
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = _FakeClock()
+    monkeypatch.setattr(throttle, '_clock', fake_clock)
+    monkeypatch.setattr(throttle.time, 'sleep', fake_clock.sleep)
+    return fake_clock
+
+
+def test_token_bucket_limits_average_rate(clock):
+    bucket = TokenBucket(1000)
+    # the first second worth of data is a burst
+    bucket.consume(1000)
+    assert clock.sleeps == []
+    for _ in range(4):
+        bucket.consume(500)
+    assert clock.sleeps == [0.5, 0.5, 0.5, 0.5]
+    assert clock.now == 1002.0
+
+    # idle time refills the bucket up to its capacity only
+    clock.now += 10
+    bucket.consume(1500)
+    assert clock.sleeps[-1] == 0.5
+
+
+def test_token_bucket_rejects_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_limit_grows_with_healthy_transfers(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=4)
+    for _ in range(20):
+        start_time = limiter.acquire()
+        clock.now += 0.1
+        limiter.release(start_time)
+    assert limiter.limit == 4
+
+
+def test_slow_transfers_do_not_grow_limit(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+    start_time = limiter.acquire()
+    clock.now += 0.1
+    limiter.release(start_time)
+    for _ in range(10):
+        start_time = limiter.acquire()
+        clock.now += 1.0
+        limiter.release(start_time)
+    assert limiter.limit == 2
+
+
+def test_overload_backs_off_once_per_wave(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, max_limit=8)
+    start_times = [limiter.acquire() for _ in range(4)]
+    clock.now += 1
+    # the transfers started together only halve the limit once
+    for start_time in start_times:
+        limiter.release(start_time, success=False, overloaded=True)
+    assert limiter.limit == 4
+
+    start_time = limiter.acquire()
+    limiter.release(start_time, success=False, overloaded=True)
+    assert limiter.limit == 2
+    for _ in range(3):
+        limiter.release(limiter.acquire(), success=False, overloaded=True)
+    assert limiter.limit == 1
+
+
+def test_error_rate_backs_off(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=4,
+                                         error_window=4,
+                                         error_rate_threshold=0.5)
+    for success in (True, True, False, False):
+        limiter.release(limiter.acquire(), success=success)
+    # half of the last transfers failed
+    assert limiter.limit == 4
+    limiter.release(limiter.acquire(), success=False)
+    assert limiter.limit == 2
+
+
+def test_acquire_waits_for_slot():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+    start_time = limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        limiter.release(limiter.acquire())
+        acquired.set()
+
+    waiting_thread = threading.Thread(target=acquire)
+    waiting_thread.start()
+    assert not acquired.wait(0.2)
+    limiter.release(start_time)
+    assert acquired.wait(5)
+    waiting_thread.join()
+
+
+@pytest.mark.parametrize('status_code, success, overloaded', [
+    (200, True, False),
+    (409, False, False),
+    (503, False, True),
+])
+def test_transfer_request_status_codes(clock, status_code, success,
+                                       overloaded):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+    with TransferRequest(limiter, 1048576) as transfer:
+        transfer.set_status_code(status_code)
+    assert (transfer.success, transfer.overloaded) == (success, overloaded)
+    # a single error is above the error rate threshold
+    assert limiter.limit == (4 if success else 2)
+
+
+def test_transfer_request_timeout_is_overload(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+    with pytest.raises(socket.timeout):
+        with TransferRequest(limiter) as transfer:
+            raise socket.timeout()
+    assert transfer.overloaded
+    assert limiter.limit == 2
+    # the slot was released
+    limiter.acquire()
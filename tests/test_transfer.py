@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""test_transfer.py
+    spt_dataset_manager
+
+    Tests for the HTTP transfer helpers.
+
+    License: BSD-3 Clause
+"""
+import json
+import os
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from spt_dataset_manager.transfer import (TransferProgress,
+                                          download_to_file,
+                                          route_engine_requests,
+                                          stream_upload)
+
+_CONTENT = os.urandom(300000)
+
+
+@pytest.fixture
+def content_url():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(_CONTENT)))
+            self.end_headers()
+            self.wfile.write(_CONTENT)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            response = json.dumps({
+                'success': True,
+                'result': {
+                    'content_type': self.headers['Content-Type'],
+                    'has_payload': _CONTENT in body,
+                },
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    yield "http://127.0.0.1:{0}/Qout.nc".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+class _Response(object):
+    status_code = 200
+    text = '{"success": true, "result": {"name": "dataset"}}'
+
+
+class _RecordingSession(object):
+    def __init__(self):
+        self.urls = []
+
+    def post(self, url, data=None, headers=None):
+        self.urls.append(url)
+        return _Response()
+
+
+def test_engine_api_calls_use_session():
+    engines = pytest.importorskip("tethys_dataset_services.engines")
+    engine = engines.CkanDatasetEngine(
+        endpoint="http://ckan.invalid/api/3/action", apikey="key")
+    session = _RecordingSession()
+
+    route_engine_requests(engine, session)
+    result = engine.execute_api_method('package_show', id='dataset')
+
+    assert result['result']['name'] == 'dataset'
+    assert session.urls == ["http://ckan.invalid/api/3/action/package_show"]
+
+    route_engine_requests(engine, None)
+    assert '_execute_request' not in engine.__dict__
+
+
+class _RawWithoutFp(object):
+    """
+    urllib3 response without the private http.client response
+    """
+    def __init__(self, raw):
+        self._raw = raw
+
+    def readinto(self, buffer):
+        return self._raw.readinto(buffer)
+
+    def release_conn(self):
+        self._raw.release_conn()
+
+    def close(self):
+        self._raw.close()
+
+
+class _SessionWithoutFp(object):
+    def get(self, url, **kwargs):
+        import requests
+        r = requests.get(url, **kwargs)
+        r.raw = _RawWithoutFp(r.raw)
+        return r
+
+
+@pytest.mark.parametrize('session', [None, _SessionWithoutFp()])
+def test_download_to_file(tmpdir, content_url, session):
+    pytest.importorskip("requests")
+    local_file_path = str(tmpdir.join('Qout.nc'))
+    assert download_to_file(content_url, local_file_path, session,
+                            buffer_size=65536) == len(_CONTENT)
+    with open(local_file_path, 'rb') as local_file:
+        assert local_file.read() == _CONTENT
+
+
+class _RecordingLimiter(object):
+    def __init__(self):
+        self.consumed = []
+
+    def consume(self, num_bytes):
+        self.consumed.append(num_bytes)
+
+
+def test_progress_callback_interval(monkeypatch):
+    from spt_dataset_manager import transfer
+    now = [0.0]
+    monkeypatch.setattr(transfer, '_clock', lambda: now[0])
+    reports = []
+    limiter = _RecordingLimiter()
+    progress = TransferProgress('Qout.nc', 300,
+                                lambda *report: reports.append(report),
+                                limiter, callback_interval=1.0)
+    for bytes_transferred, elapsed in ((100, 0.5), (200, 1.0), (300, 0.1)):
+        now[0] += elapsed
+        progress.update(bytes_transferred)
+
+    # none within the first interval, then the rate of each interval
+    assert reports == [('Qout.nc', 200, 300, pytest.approx(200 / 1.5)),
+                       ('Qout.nc', 300, 300, pytest.approx(100 / 0.1))]
+    assert limiter.consumed == [100, 100, 100]
+
+
+def test_stream_upload_reports_progress(tmpdir, content_url):
+    pytest.importorskip("requests_toolbelt")
+    file_path = str(tmpdir.join('Qout.nc'))
+    with open(file_path, 'wb') as upload_file:
+        upload_file.write(_CONTENT)
+    reports = []
+    limiter = _RecordingLimiter()
+
+    status_code, response_dict = stream_upload(
+        content_url, {'name': 'Qout'}, file_path, 'Qout.nc',
+        progress_callback=lambda *report: reports.append(report),
+        bandwidth_limiter=limiter)
+
+    assert status_code == 200
+    assert response_dict['result']['has_payload']
+    assert response_dict['result']['content_type']\
+        .startswith('multipart/form-data')
+    name, bytes_transferred, total_bytes, bytes_per_second = reports[-1]
+    assert name == 'Qout.nc'
+    # the whole form including the field and the boundaries
+    assert bytes_transferred == total_bytes > len(_CONTENT)
+    assert bytes_per_second > 0
+    assert sum(limiter.consumed) == total_bytes
+
+
+def test_download_charges_bandwidth_limiter(tmpdir, content_url):
+    pytest.importorskip("requests")
+    limiter = _RecordingLimiter()
+    download_to_file(content_url, str(tmpdir.join('Qout.nc')),
+                     bandwidth_limiter=limiter, buffer_size=65536)
+    assert sum(limiter.consumed) == len(_CONTENT)
+    assert max(limiter.consumed) <= 65536
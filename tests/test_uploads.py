@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""test_uploads.py
+    spt_dataset_manager
+
+    Tests for the uploads of the archives to the CKAN FileStore.
+
+    License: BSD-3 Clause
+"""
+import copy
+import json
+import os
+
+import pytest
+
+pytest.importorskip("tethys_dataset_services")
+
+from spt_dataset_manager.dataset_manager import ECMWFRAPIDDatasetManager
+
+
+def _write_cycle(source_directory):
+    cycle_directory = source_directory.join('nile-basin', '20150404.0')
+    contents = {}
+    for ensemble_number in (1, 2, 3):
+        file_name = 'Qout_nile_%d.nc' % ensemble_number
+        contents[file_name] = os.urandom(1000)
+        cycle_directory.ensure(file_name).write_binary(contents[file_name])
+    for return_period in (2, 10):
+        file_name = 'return_%d_points.geojson' % return_period
+        contents[file_name] = json.dumps({'features': []}).encode('utf-8')
+        cycle_directory.ensure(file_name).write_binary(contents[file_name])
+    return contents
+
+
+def _check_downloads(manager, tmpdir, contents):
+    resources = manager._get_dataset_resources()
+    assert len(resources) == len(contents)
+    extract_directory = str(tmpdir.join('extract'))
+    manager.download_resource_from_info(extract_directory, resources)
+    for file_name, content in contents.items():
+        with open(os.path.join(extract_directory, file_name), 'rb') \
+                as extracted_file:
+            assert extracted_file.read() == content
+
+
+def test_archives_are_uploaded_with_package_revise(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    contents = _write_cycle(source_directory)
+
+    manager.zip_upload_resources(str(source_directory))
+
+    # one call for the ensembles and one for the warning points
+    assert ckan.actions.count('package_revise') == 2
+    assert 'resource_create' not in ckan.actions
+    assert len(ckan.uploads) == len(contents)
+    _check_downloads(manager, tmpdir, contents)
+    assert os.listdir(str(source_directory.join('nile-basin'))) == \
+        ['20150404.0']
+
+
+def test_batches_are_limited_in_size(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    manager.UPLOAD_BATCH_MAX_BYTES = 1
+    source_directory = tmpdir.mkdir('output')
+    contents = _write_cycle(source_directory)
+
+    manager.zip_upload_resources(str(source_directory))
+
+    assert ckan.actions.count('package_revise') == len(contents)
+    _check_downloads(manager, tmpdir, contents)
+
+
+def test_archives_are_uploaded_one_by_one_before_ckan_2_9(tmpdir,
+                                                          ckan_servers):
+    ckan = ckan_servers()
+    ckan.revise_supported = False
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    contents = _write_cycle(source_directory)
+
+    manager.zip_upload_resources(str(source_directory))
+
+    # the version is checked before any archive is sent
+    assert ckan.actions.count('status_show') == 1
+    assert 'package_revise' not in ckan.actions
+    assert ckan.actions.count('resource_create') == len(contents)
+    _check_downloads(manager, tmpdir, contents)
+
+
+def test_large_archives_are_streamed_one_by_one(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    manager.UPLOAD_BATCH_MAX_FILE_BYTES = 1100
+    source_directory = tmpdir.mkdir('output')
+    contents = _write_cycle(source_directory)
+
+    manager.zip_upload_resources(str(source_directory))
+
+    # the forecasts are larger, only the warning points are batched
+    assert ckan.actions.count('resource_create') == 3
+    assert ckan.actions.count('package_revise') == 1
+    _check_downloads(manager, tmpdir, contents)
+
+
+def test_copies_share_the_version_check(tmpdir, ckan_servers):
+    ckan = ckan_servers()
+    manager = ECMWFRAPIDDatasetManager(ckan.url, 'key')
+    source_directory = tmpdir.mkdir('output')
+    _write_cycle(source_directory)
+    manager_copy = copy.copy(manager)
+    manager.zip_upload_resources(str(source_directory))
+    manager_copy.zip_upload_resources(str(source_directory))
+    assert ckan.actions.count('status_show') == 1